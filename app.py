@@ -1,20 +1,44 @@
-import json
 import os
+import csv
+import glob
+import json
+import re
+import time
+import shutil
+import secrets
+import atexit
+import hashlib
 import logging
+import multiprocessing
+import threading
+import zipfile
+import zlib
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
-from io import BytesIO
+from functools import partial
+from io import BytesIO, StringIO
 
+import click
+import numpy as np
 import pandas as pd
-from flask import Flask, render_template, request, redirect, url_for, send_file, flash, session
+from flask import Flask, g, jsonify, render_template, request, redirect, url_for, send_file, flash, get_flashed_messages, session, stream_template, make_response, abort
 from werkzeug.utils import secure_filename
 
 from process_pensions import (
-    PensionFileProcessor,
     SEVERANCE_COLUMN_TAGS,
     TAGMUL_PERIOD_COLUMNS,
+    merge_results,
+    process_file,
 )
+from result_cache import DEFAULT_TTL_SECONDS, ResultCache
+from results_store import RESULTS_DB_FILENAME, ResultsStore
+from upload_queue import DEFAULT_MAX_QUEUED, DEFAULT_MAX_QUEUED_PER_USER, FairJobQueue, QueueFull
+from upload_spool import SpoolError, UploadSpool
 
-import openpyxl
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, PatternFill, Alignment
 from openpyxl.utils import get_column_letter
 
@@ -23,6 +47,18 @@ app.secret_key = 'your-secret-key-here'  # Change this to a secure secret key
 app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['PROCESSED_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'processed')
+app.config['RESULTS_DB'] = os.path.join(app.config['PROCESSED_FOLDER'], RESULTS_DB_FILENAME)
+app.config['EXPORT_FOLDER'] = os.path.join(app.config['PROCESSED_FOLDER'], 'exports')
+app.config['RESULTS_FOLDER'] = os.path.join(app.config['PROCESSED_FOLDER'], 'results')
+app.config['RESULT_TTL_SECONDS'] = DEFAULT_TTL_SECONDS
+app.config['SPOOL_FOLDER'] = os.path.join(app.config['PROCESSED_FOLDER'], 'spool')
+app.config['UPLOAD_WORKERS'] = os.cpu_count() or 1
+# Upload queue limits hold per server process; gunicorn.conf.py pins the app to one worker
+app.config['UPLOAD_QUEUE_LIMIT'] = DEFAULT_MAX_QUEUED
+app.config['UPLOAD_QUEUE_PER_USER'] = DEFAULT_MAX_QUEUED_PER_USER
+# Uploads with more files than the queue takes at once are admitted in slices; each
+# further slice waits this long for room before the upload is refused
+app.config['UPLOAD_SLICE_WAIT_SECONDS'] = 120
 
 # Ensure storage folders exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -61,19 +97,563 @@ NUMERIC_COLUMNS = {
     *TAGMUL_COLUMNS,
 }
 
+# Low-cardinality text columns stored as pandas categories (codes instead of repeated strings)
+CATEGORY_COLUMNS = [
+    'שם תכנית',
+    'חברה מנהלת',
+    'סוג מוצר',
+    'תאריך נכונות יתרה',
+    'מעסיקים היסטוריים',
+]
+
+
+# Display column -> aggregate returned by ResultsStore.account_totals
+TOTAL_COLUMNS = {
+    'יתרה': 'balance',
+    'סך תגמולים': 'tagmul_total',
+    'סך פיצויים': 'severance_total',
+    'סך רכיבים': 'component_total',
+    'פער יתרה מול רכיבים': 'balance_diff',
+}
+
+
+NUMBER_FORMAT = '#,##0.00'
+HEADER_FONT = Font(bold=True, color='FFFFFF')
+HEADER_FILL = PatternFill(start_color='4472C4', end_color='4472C4', fill_type='solid')
+HEADER_ALIGNMENT = Alignment(horizontal='right', vertical='center')
+
+PERSON_DETAIL_LABELS = {
+    'full_name': 'שם הלקוח',
+    'id_number': 'מספר תעודת זהות',
+    'birth_date': 'תאריך לידה',
+    'gender': 'מין',
+    'marital_status': 'מצב משפחתי',
+    'previous_last_name': 'שם משפחה קודם',
+    'full_address': 'כתובת מלאה',
+    'street': 'רחוב',
+    'house_number': 'מספר בית',
+    'entrance': 'כניסה',
+    'apartment': 'דירה',
+    'city': 'יישוב',
+    'zip_code': 'מיקוד',
+    'po_box': 'ת.ד.',
+    'phone': 'טלפון',
+    'mobile': 'נייד',
+    'email': 'דוא"ל',
+    'death_date': 'תאריך פטירה',
+}
+
+BENEFICIARY_EXPORT_COLUMNS = {
+    'record_type': 'סוג רשומה',
+    'account_number': 'מספר חשבון',
+    'plan_name': 'שם תכנית',
+    'product_type': 'סוג מוצר',
+    'managing_company': 'חברה מנהלת',
+    'id_number': 'תעודת זהות',
+    'first_name': 'שם פרטי',
+    'last_name': 'שם משפחה',
+    'birth_date': 'תאריך לידה',
+    'relation_code': 'קוד קרבה',
+    'percent': 'אחוז זכאות',
+    'definition_code': 'קוד הגדרה',
+}
+
+# Raw tag groups kept per account by the extractor
+RAW_FIELD_GROUPS = {
+    'שדות_חברה_מנהלת': 'חברה מנהלת',
+    'שדות_סוג_תוכנית': 'סוג תכנית',
+    'שדות_פיצויים_תגמולים': 'פיצויים ותגמולים',
+}
+
+RECONCILIATION_COLUMNS = {
+    'מספר_חשבון': 'מספר חשבון',
+    'חברה_מנהלת': 'חברה מנהלת',
+    'יתרה': 'יתרה',
+    'סך_תגמולים': 'סך תגמולים',
+    'סך_פיצויים': 'סך פיצויים',
+    'סך_רכיבים': 'סך רכיבים',
+    'פער_יתרה_מול_רכיבים': 'פער יתרה מול רכיבים',
+    'תאריך_נכונות_יתרה': 'תאריך נכונות יתרה',
+}
+RECONCILIATION_NUMERIC = {'יתרה', 'סך_תגמולים', 'סך_פיצויים', 'סך_רכיבים', 'פער_יתרה_מול_רכיבים'}
+
+
+def _column_width(title, numeric):
+    return 16 if numeric else min(max(len(title) + 4, 14), 40)
+
+
+def _create_export_sheet(workbook, title, headers, numeric_headers=()):
+    """Create a right-to-left write-only sheet with preset widths, a frozen styled header and number formats.
+
+    Returns the sheet and the per-column number format (None for text columns).
+    """
+    worksheet = workbook.create_sheet(title)
+    worksheet.sheet_view.rightToLeft = True
+    worksheet.freeze_panes = 'A2'
+    formats = []
+    for col_num, header in enumerate(headers, 1):
+        numeric = header in numeric_headers
+        worksheet.column_dimensions[get_column_letter(col_num)].width = _column_width(header, numeric)
+        formats.append(NUMBER_FORMAT if numeric else None)
+
+    header_cells = []
+    for header in headers:
+        cell = WriteOnlyCell(worksheet, value=header)
+        cell.font = HEADER_FONT
+        cell.fill = HEADER_FILL
+        cell.alignment = HEADER_ALIGNMENT
+        header_cells.append(cell)
+    worksheet.append(header_cells)
+    return worksheet, formats
+
+
+def _append_export_row(worksheet, formats, values):
+    row = []
+    for number_format, value in zip(formats, values):
+        if number_format and isinstance(value, (int, float)):
+            cell = WriteOnlyCell(worksheet, value=value)
+            cell.number_format = number_format
+            row.append(cell)
+        else:
+            row.append('' if value is None else value)
+    worksheet.append(row)
+
+
+def build_export_workbook(store, file_ids, content_hash=None):
+    """Write the stored results as a multi-sheet XLSX in one write-only pass and return its bytes.
+
+    Sheets: accounts table, beneficiaries, client details, raw balance fields and
+    reconciliation differences. Accounts are read from the store in batches and fanned
+    out to the accounts, raw fields and reconciliation sheets as they arrive.
+    content_hash is recorded as the workbook identifier.
+    """
+    workbook = Workbook(write_only=True)
+    workbook.properties.identifier = content_hash
+    accounts_sheet, account_formats = _create_export_sheet(workbook, 'נתוני פנסיה', TABLE_COLUMNS, NUMERIC_COLUMNS)
+    beneficiaries_sheet, beneficiary_formats = _create_export_sheet(
+        workbook, 'מוטבים', list(BENEFICIARY_EXPORT_COLUMNS.values())
+    )
+    client_sheet, client_formats = _create_export_sheet(workbook, 'פרטי לקוח', ['שדה', 'ערך'])
+    raw_sheet, raw_formats = _create_export_sheet(
+        workbook, 'שדות יתרה גולמיים', ['מספר חשבון', 'חברה מנהלת', 'קבוצה', 'תג', 'ערך']
+    )
+    reconciliation_headers = list(RECONCILIATION_COLUMNS.values())
+    reconciliation_sheet, reconciliation_formats = _create_export_sheet(
+        workbook,
+        'התאמת יתרות',
+        reconciliation_headers,
+        {RECONCILIATION_COLUMNS[key] for key in RECONCILIATION_NUMERIC},
+    )
+
+    for account in store.iter_accounts(file_ids):
+        row = flatten_accounts({'accounts': [account]})[0]
+        _append_export_row(accounts_sheet, account_formats, [row.get(column) for column in TABLE_COLUMNS])
+
+        number = account.get('מספר_חשבון', '')
+        company = account.get('חברה_מנהלת', '')
+        for group, group_label in RAW_FIELD_GROUPS.items():
+            for tag, value in (account.get(group) or {}).items():
+                _append_export_row(raw_sheet, raw_formats, [number, company, group_label, tag, value])
+
+        if account.get('פער_יתרה_מול_רכיבים'):
+            _append_export_row(
+                reconciliation_sheet,
+                reconciliation_formats,
+                [account.get(key) for key in RECONCILIATION_COLUMNS],
+            )
+
+    for beneficiary in store.load_beneficiaries(file_ids):
+        _append_export_row(
+            beneficiaries_sheet,
+            beneficiary_formats,
+            [beneficiary.get(key) for key in BENEFICIARY_EXPORT_COLUMNS],
+        )
+
+    for person in store.load_clients(file_ids):
+        for key, label in PERSON_DETAIL_LABELS.items():
+            if person.get(key):
+                _append_export_row(client_sheet, client_formats, [label, person[key]])
+
+    output = BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+
+def read_workbook_identifier(path):
+    """Identifier recorded in an XLSX file's core properties, or None."""
+    try:
+        with zipfile.ZipFile(path) as archive:
+            core = archive.read('docProps/core.xml').decode('utf-8')
+    except (OSError, KeyError, zipfile.BadZipFile):
+        return None
+    match = re.search(r'<dc:identifier>([^<]*)</dc:identifier>', core)
+    return match.group(1) if match else None
+
+
+EXPORT_FORMATS = {
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', build_export_workbook),
+}
+
+# Rows written per chunk of a streamed export
+STREAM_BATCH_ROWS = 500
+STREAM_CHUNK_BYTES = 16 * 1024
+GZIP_LEVEL = 6
+COMPRESS_MIN_BYTES = 1024
+COMPRESSIBLE_MIMETYPES = {
+    'text/html',
+    'text/css',
+    'text/csv',
+    'text/javascript',
+    'application/javascript',
+    'application/json',
+    'application/x-ndjson',
+}
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+
+# Third-party assets, served from static/ once vendored (flask vendor-assets), else from the CDN
+VENDOR_ASSETS = {
+    'vendor/bootstrap.rtl.min.css': 'https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.rtl.min.css',
+    'vendor/dataTables.bootstrap5.min.css': 'https://cdn.datatables.net/1.11.5/css/dataTables.bootstrap5.min.css',
+    'vendor/jquery-3.6.0.min.js': 'https://code.jquery.com/jquery-3.6.0.min.js',
+    'vendor/bootstrap.bundle.min.js': 'https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/js/bootstrap.bundle.min.js',
+    'vendor/jquery.dataTables.min.js': 'https://cdn.datatables.net/1.11.5/js/jquery.dataTables.min.js',
+    'vendor/dataTables.bootstrap5.min.js': 'https://cdn.datatables.net/1.11.5/js/dataTables.bootstrap5.min.js',
+}
+
+_asset_hashes: dict = {}
+
+
+def _template_version():
+    """Short hash of the templates and static files, so page ETags change on deploy."""
+    digest = hashlib.sha256()
+    for folder in (app.template_folder, app.static_folder):
+        for path in sorted(glob.glob(os.path.join(app.root_path, folder, '**', '*.*'), recursive=True)):
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+TEMPLATE_VERSION = _template_version()
+
+_export_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='export')
+_pending_exports: dict = {}
+_pending_exports_lock = threading.Lock()
+
+
+def results_content_hash(results):
+    """Content hash of what the exports show; identical results share export artifacts."""
+    content = [
+        [result.get('accounts'), result.get('beneficiaries'), result.get('person_details')]
+        for result in results
+    ]
+    payload = json.dumps(content, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def export_artifact_path(content_hash, export_format):
+    return os.path.join(app.config['EXPORT_FOLDER'], f'{content_hash}.{export_format}')
+
+
+def export_artifact_is_current(content_hash, export_format):
+    """Whether the cached artifact exists and was built from the results hashed to content_hash."""
+    return read_workbook_identifier(export_artifact_path(content_hash, export_format)) == content_hash
+
+
+def write_export_artifacts(content_hash, file_ids):
+    """Build every export format from the stored results, skipping the ones already cached.
+
+    Returns False, writing nothing, when the results were deleted in the meantime.
+    """
+    os.makedirs(app.config['EXPORT_FOLDER'], exist_ok=True)
+    with ResultsStore(app.config['RESULTS_DB']) as store:
+        # One read transaction, so the rows cannot be deleted between the check and the build
+        store.conn.execute('BEGIN')
+        try:
+            if not store.has_files(file_ids):
+                logging.warning(f"Export {content_hash} skipped: its results are no longer stored")
+                return False
+            for export_format, (_, builder) in EXPORT_FORMATS.items():
+                if export_artifact_is_current(content_hash, export_format):
+                    continue
+                path = export_artifact_path(content_hash, export_format)
+                temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+                with open(temp_path, 'wb') as f:
+                    f.write(builder(store, file_ids, content_hash))
+                os.replace(temp_path, path)
+        finally:
+            store.conn.rollback()
+    return True
+
+
+def schedule_export_artifacts(content_hash, file_ids):
+    """Build the export artifacts in the background as soon as results are stored."""
+    with _pending_exports_lock:
+        if content_hash in _pending_exports:
+            return
+        future = _export_executor.submit(write_export_artifacts, content_hash, file_ids)
+        _pending_exports[content_hash] = future
+
+    def _done(completed):
+        with _pending_exports_lock:
+            _pending_exports.pop(content_hash, None)
+        if completed.exception() is not None:
+            logging.error(f"Background export failed: {str(completed.exception())}")
+
+    future.add_done_callback(_done)
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def _release_result(payload):
+    """Drop the results-store rows of an expired or replaced result."""
+    if payload.get('file_ids'):
+        with ResultsStore(app.config['RESULTS_DB']) as store:
+            store.delete_files(payload['file_ids'])
+
+
+def get_result_cache():
+    """App-wide server-side result cache, created on first use."""
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache(
+                app.config['RESULTS_FOLDER'],
+                ttl=app.config['RESULT_TTL_SECONDS'],
+                on_expire=_release_result,
+            )
+        return _result_cache
+
+
+def session_owner():
+    """Random per-session token that owns the session's stored results."""
+    if 'owner_id' not in session:
+        session['owner_id'] = secrets.token_urlsafe(16)
+    return session['owner_id']
+
+
+def collect_expired_results():
+    """Expire old results, then sweep export artifacts, legacy processed_*.json files and abandoned chunked uploads past the TTL."""
+    if get_result_cache().collect_garbage() is None:
+        return
+    cutoff = time.time() - app.config['RESULT_TTL_SECONDS']
+    stale_patterns = [
+        os.path.join(app.config['EXPORT_FOLDER'], '*'),
+        os.path.join(app.config['PROCESSED_FOLDER'], 'processed_*.json'),
+    ]
+    for pattern in stale_patterns:
+        for path in glob.glob(pattern):
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except FileNotFoundError:
+                continue
+    get_upload_spool().collect_garbage(app.config['RESULT_TTL_SECONDS'])
+
+
+def get_results_store():
+    """Open the results store once per request."""
+    if 'results_store' not in g:
+        g.results_store = ResultsStore(app.config['RESULTS_DB'])
+    return g.results_store
+
+
+@app.teardown_appcontext
+def close_results_store(exception=None):
+    store = g.pop('results_store', None)
+    if store is not None:
+        store.close()
+
+
+def column_totals(store, file_ids):
+    """Per-column totals for the results table, summed in SQL."""
+    totals = store.account_totals(file_ids)
+    column_sums = {column: totals[key] for column, key in TOTAL_COLUMNS.items()}
+    for column in SEVERANCE_COLUMNS:
+        column_sums[column] = totals['severance_components'].get(column, 0.0)
+    for column in TAGMUL_COLUMNS:
+        column_sums[column] = totals['tagmul_periods'].get(column, 0.0)
+    return column_sums
+
+
+def asset_url(path):
+    """URL of a static asset with its content hash, or the CDN copy of a vendor asset not yet vendored."""
+    full_path = os.path.join(app.static_folder, path)
+    try:
+        mtime = os.path.getmtime(full_path)
+    except OSError:
+        if path in VENDOR_ASSETS:
+            return VENDOR_ASSETS[path]
+        raise
+    cached = _asset_hashes.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(full_path, 'rb') as f:
+            cached = (mtime, hashlib.sha256(f.read()).hexdigest()[:12])
+        _asset_hashes[path] = cached
+    return url_for('static', filename=path, v=cached[1])
+
+
+app.jinja_env.globals['asset_url'] = asset_url
+
+
+def missing_vendor_assets():
+    """VENDOR_ASSETS paths not yet downloaded into static/."""
+    return [path for path in VENDOR_ASSETS if not os.path.exists(os.path.join(app.static_folder, path))]
+
+
+@app.cli.command('vendor-assets')
+@click.option('--check', is_flag=True, help='Only report missing assets, exiting non-zero if any are.')
+def vendor_assets(check):
+    """Download the third-party assets into static/vendor for offline deployments.
+
+    The deploy host has no internet access: run this on a connected machine, then copy
+    static/vendor to the deploy host (or commit it) before starting gunicorn there.
+    """
+    if check:
+        missing = missing_vendor_assets()
+        for path in missing:
+            print(f"missing: {os.path.join(app.static_folder, path)}")
+        if missing:
+            raise click.ClickException(
+                "vendor assets missing; run 'flask --app app vendor-assets' on a machine with "
+                "internet access and copy static/vendor here"
+            )
+        return
+    for path, url in VENDOR_ASSETS.items():
+        target = os.path.join(app.static_folder, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with urllib.request.urlopen(url, timeout=30) as source, open(target, 'wb') as f:
+            f.write(source.read())
+        print(f"{url} -> {target}")
+
+
+def negotiate_encoding():
+    """Preferred response encoding the client accepts ('gzip' or 'deflate'), or None."""
+    return request.accept_encodings.best_match(['gzip', 'deflate'])
+
+
+def _compressor(encoding):
+    wbits = 16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS
+    return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, wbits)
+
+
+@app.after_request
+def compress_response(response):
+    """Compress buffered text responses above COMPRESS_MIN_BYTES and mark hashed static assets immutable."""
+    if request.endpoint == 'static' and response.status_code == 200 and request.args.get('v'):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+
+    if (
+        response.status_code != 200
+        or 'Content-Encoding' in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+    if response.direct_passthrough and request.endpoint == 'static':
+        # Static files are sent as file wrappers; buffer them so they can be compressed
+        response.direct_passthrough = False
+        response.make_sequence()
+    if response.is_streamed:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding()
+    if not encoding:
+        return response
+
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    compressor = _compressor(encoding)
+    response.set_data(compressor.compress(data) + compressor.flush())
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-{encoding}', weak=weak)
+    return response
+
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'xml'}
 
 
-def process_pension_file(filepath):
-    """Process a single pension file and return the structured result."""
+# Pool workers come from a forkserver rather than a fork of this threaded process, which
+# could copy a lock held by another request thread into the child and deadlock it
+UPLOAD_POOL_START_METHOD = 'forkserver'
+
+_upload_executor = None
+_upload_executor_lock = threading.Lock()
+_upload_queue = None
+_upload_queue_lock = threading.Lock()
+
+
+def get_upload_executor():
+    """App-wide process pool for parsing uploads, created on first use and reused across requests."""
+    global _upload_executor
+    with _upload_executor_lock:
+        if _upload_executor is None:
+            context = multiprocessing.get_context(UPLOAD_POOL_START_METHOD)
+            # Import the parser once in the server instead of in every new worker
+            context.set_forkserver_preload(['process_pensions'])
+            _upload_executor = ProcessPoolExecutor(max_workers=app.config['UPLOAD_WORKERS'], mp_context=context)
+        return _upload_executor
+
+
+def _discard_upload_executor(executor):
+    global _upload_executor
+    with _upload_executor_lock:
+        if _upload_executor is executor:
+            _upload_executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+@atexit.register
+def _shutdown_upload_executor():
+    if _upload_executor is not None:
+        _upload_executor.shutdown(wait=False, cancel_futures=True)
+
+
+def get_upload_queue():
+    """App-wide admission queue for upload parsing, created on first use."""
+    global _upload_queue
+    with _upload_queue_lock:
+        if _upload_queue is None:
+            _upload_queue = FairJobQueue(
+                app.config['UPLOAD_WORKERS'],
+                max_queued=app.config['UPLOAD_QUEUE_LIMIT'],
+                max_queued_per_user=app.config['UPLOAD_QUEUE_PER_USER'],
+            )
+        return _upload_queue
+
+
+def _parse_on_pool(filepath):
+    executor = get_upload_executor()
     try:
-        processor = PensionFileProcessor(filepath)
-        return processor.process()
-    except Exception as e:
-        logging.error(f"Error processing {filepath}: {str(e)}")
-        return None
+        return executor.submit(process_file, filepath).result()
+    except BrokenProcessPool:
+        # A crashed worker poisons the pool; the next job gets a fresh one
+        _discard_upload_executor(executor)
+        raise
+
+
+def process_uploaded_files(filepaths, owner):
+    """Parse files through the upload queue; outcomes (result, None or the raised exception) follow the input order.
+
+    Raises QueueFull when the queue cannot take the files.
+    """
+    futures = get_upload_queue().submit_in_slices(
+        owner, _parse_on_pool, filepaths, timeout=app.config['UPLOAD_SLICE_WAIT_SECONDS']
+    )
+    outcomes = []
+    for future in futures:
+        try:
+            outcomes.append(future.result())
+        except Exception as e:
+            outcomes.append(e)
+    return outcomes
 
 
 def _as_float(value):
@@ -83,6 +663,67 @@ def _as_float(value):
         return None
 
 
+def build_results_dataframe(rows):
+    """Build the results table with numeric columns coerced and text columns categorized."""
+    df = pd.DataFrame(rows, columns=TABLE_COLUMNS)
+    numeric_cols = [col for col in df.columns if col in NUMERIC_COLUMNS]
+    df[numeric_cols] = df[numeric_cols].apply(pd.to_numeric, errors='coerce')
+    for col in CATEGORY_COLUMNS:
+        categorical = df[col].fillna('').astype('category')
+        if '' not in categorical.cat.categories:
+            # Keep '' as a valid category so display code can fillna('')
+            categorical = categorical.cat.add_categories([''])
+        df[col] = categorical
+    return df, numeric_cols
+
+
+# A digit followed by whole groups of three digits up to the decimal point
+THOUSANDS_PATTERN = r'(\d)(?=(?:\d{3})+\.)'
+
+
+def _format_amounts(values):
+    """Format an array of amounts as '1,234.56' strings, with '' for missing or infinite values.
+
+    '%.2f' rounds exactly as '{:.2f}' does; the thousands separators are then
+    inserted with one vectorized regex replace over the whole array.
+    """
+    finite = np.isfinite(values).ravel()
+    fixed = pd.Series(np.char.mod('%.2f', np.where(finite, values.ravel(), 0.0)))
+    formatted = fixed.str.replace(THOUSANDS_PATTERN, r'\1,', regex=True).to_numpy(dtype=object)
+    formatted[~finite] = ''
+    return formatted.reshape(values.shape)
+
+
+def build_results_view(rows):
+    """Build the display cells and totals row of the results table.
+
+    The numeric block is formatted and summed in one pass over a single float
+    array; the returned view is stored with the result so re-renders reuse it.
+    """
+    df, numeric_cols = build_results_dataframe(rows)
+    columns = df.columns.tolist()
+    numeric_indexes = [idx for idx, col in enumerate(columns) if col in numeric_cols]
+    text_indexes = [idx for idx, col in enumerate(columns) if col not in numeric_cols]
+
+    block = df.iloc[:, numeric_indexes].to_numpy(dtype=float)
+    values = np.empty(df.shape, dtype=object)
+    values[:, text_indexes] = df.iloc[:, text_indexes].fillna('').to_numpy(dtype=object)
+    values[:, numeric_indexes] = _format_amounts(block)
+
+    totals_row = np.full(len(columns), '', dtype=object)
+    totals_row[numeric_indexes] = _format_amounts(np.nansum(block, axis=0))
+    totals_row[0] = 'סה"כ'
+
+    return {
+        'columns': columns,
+        'values': values.tolist(),
+        'totals_row': totals_row.tolist(),
+        'record_count': len(df),
+        'numeric_columns': numeric_cols,
+        'numeric_column_indexes': numeric_indexes,
+    }
+
+
 def flatten_accounts(result):
     flattened = []
     if not result:
@@ -124,6 +765,73 @@ def flatten_accounts(result):
     return flattened
 
 
+def store_upload_results(uploads, outcomes, owner):
+    """Merge parsed uploads in upload order, persist them and store the result for owner.
+
+    uploads are (filename, filepath) pairs and outcomes their parse results or
+    exceptions. Returns (result_id, payload, errors), where errors lists
+    (filename, message) for failed files; result_id is None when no accounts were found.
+    """
+    store = get_results_store()
+    cache = get_result_cache()
+
+    # Drop the previous upload's stored result (and its rows in the results store)
+    previous_id = session.pop('result_id', None)
+    if previous_id:
+        cache.delete(previous_id, owner)
+
+    # Merge in upload order so person details and beneficiaries are deterministic
+    results = []
+    errors = []
+    combined_person_details: dict[str, str] = {}
+    for (filename, _), result in zip(uploads, outcomes):
+        if isinstance(result, Exception):
+            errors.append((filename, str(result)))
+            continue
+        if result:
+            result['source'] = filename
+            results.append(result)
+
+            person = result.get('person_details') or {}
+            if isinstance(person, dict):
+                for key, value in person.items():
+                    if value and not combined_person_details.get(key):
+                        combined_person_details[key] = value
+
+    # Accounts repeated across files are reported once, from the freshest file
+    merged_results, conflicts = merge_results(results)
+    all_rows = []
+    all_beneficiaries: list[dict] = []
+    for result in merged_results:
+        all_rows.extend(flatten_accounts(result))
+        beneficiaries = result.get('beneficiaries') or []
+        if isinstance(beneficiaries, list):
+            all_beneficiaries.extend(beneficiaries)
+
+    if not all_rows:
+        return None, None, errors
+
+    # Persist processed data to the results store and keep only the result ID in session.
+    # Every file's balances are kept as history, including the superseded copies.
+    store.add_snapshots(results)
+    file_ids = store.save_results(merged_results)
+    content_hash = results_content_hash(merged_results)
+    schedule_export_artifacts(content_hash, file_ids)
+    payload = {
+        'file_ids': file_ids,
+        'export_hash': content_hash,
+        'view': build_results_view(all_rows),
+        'person_details': combined_person_details,
+        'beneficiaries': all_beneficiaries,
+        'conflicts': conflicts,
+        'timestamp': datetime.now().strftime('%d/%m/%Y %H:%M:%S'),
+    }
+    result_id = cache.put(owner, payload)
+    session['result_id'] = result_id
+    collect_expired_results()
+    return result_id, payload, errors
+
+
 @app.route('/', methods=['GET', 'POST'])
 def upload_file():
     if request.method == 'POST':
@@ -136,100 +844,38 @@ def upload_file():
             flash('לא נבחר קובץ', 'error')
             return redirect(request.url)
         
-        # Remove previous processed file reference if exists
-        previous_file = session.pop('results_file', None)
-        if previous_file:
-            old_path = os.path.join(app.config['PROCESSED_FOLDER'], previous_file)
-            if os.path.exists(old_path):
-                try:
-                    os.remove(old_path)
-                except OSError:
-                    logging.warning(f"Unable to remove old processed file: {old_path}")
-
-        # Process each file
-        all_rows = []
-        combined_person_details: dict[str, str] = {}
-        all_beneficiaries: list[dict] = []
+        owner = session_owner()
+
+        # Save every file, then parse them together through the upload queue
+        uploads = []
         for file in files:
             if file and allowed_file(file.filename):
                 filename = secure_filename(file.filename)
                 filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
                 file.save(filepath)
-
-                # Process the pension file
-                try:
-                    result = process_pension_file(filepath)
-                    if result:
-                        all_rows.extend(flatten_accounts(result))
-
-                        person = result.get('person_details') or {}
-                        if isinstance(person, dict):
-                            for key, value in person.items():
-                                if value and not combined_person_details.get(key):
-                                    combined_person_details[key] = value
-
-                        beneficiaries = result.get('beneficiaries') or []
-                        if isinstance(beneficiaries, list):
-                            all_beneficiaries.extend(beneficiaries)
-                except Exception as e:
-                    flash(f'שגיאה בעיבוד הקובץ {filename}: {str(e)}', 'error')
-                    continue
+                uploads.append((filename, filepath))
             else:
                 flash(f'סוג קובץ לא חוקי: {file.filename}', 'error')
 
-        if all_rows:
-            # Persist processed data to disk and keep reference in session
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            processed_filename = f'processed_{timestamp}.json'
-            processed_path = os.path.join(app.config['PROCESSED_FOLDER'], processed_filename)
-
-            with open(processed_path, 'w', encoding='utf-8') as processed_file:
-                json.dump(all_rows, processed_file, ensure_ascii=False)
-
-            session['results_file'] = processed_filename
-
-            # Prepare DataFrame for display
-            df = pd.DataFrame(all_rows, columns=TABLE_COLUMNS)
-            numeric_cols = [col for col in df.columns if col in NUMERIC_COLUMNS]
-            df[numeric_cols] = df[numeric_cols].apply(pd.to_numeric, errors='coerce')
-
-            display_df = df.copy()
-            for col in numeric_cols:
-                display_df[col] = display_df[col].apply(
-                    lambda x: f'{x:,.2f}' if pd.notnull(x) else ''
-                )
-
-            df_columns = display_df.columns.tolist()
-            df_values = display_df.fillna('').values.tolist()
-            numeric_column_indexes = [
-                idx for idx, col in enumerate(df_columns) if col in numeric_cols
-            ]
-
-            totals_map = {col: df[col].sum(min_count=1) for col in numeric_cols}
-            totals_row = []
-            for idx, col in enumerate(df_columns):
-                if idx == 0:
-                    totals_row.append('סה"כ')
-                elif col in totals_map and pd.notnull(totals_map[col]):
-                    totals_row.append(f'{totals_map[col]:,.2f}')
-                elif col in totals_map:
-                    totals_row.append('0.00')
-                else:
-                    totals_row.append('')
-
-            return render_template(
-                'results.html',
-                df_columns=df_columns,
-                df_values=df_values,
-                totals_row=totals_row,
-                record_count=len(df),
-                timestamp=datetime.now().strftime('%d/%m/%Y %H:%M:%S'),
-                numeric_columns=numeric_cols,
-                numeric_column_indexes=numeric_column_indexes,
-                wide_layout=True,
-                person_details=combined_person_details,
-                beneficiaries=all_beneficiaries,
-            )
+        try:
+            outcomes = process_uploaded_files([filepath for _, filepath in uploads], owner)
+        except QueueFull as e:
+            if e.per_user:
+                flash('קבצים קודמים שלך עדיין ממתינים לעיבוד. אנא נסה שוב בעוד מספר שניות.', 'error')
+            else:
+                flash('המערכת עמוסה כרגע. אנא נסה שוב בעוד מספר שניות.', 'error')
+            response = make_response(render_template('upload.html'), 429 if e.per_user else 503)
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response
+
+        result_id, payload, errors = store_upload_results(uploads, outcomes, owner)
+        for filename, message in errors:
+            flash(f'שגיאה בעיבוד הקובץ {filename}: {message}', 'error')
+
+        if result_id:
+            if payload['conflicts']:
+                flash(f'נמצאו {len(payload["conflicts"])} חשבונות כפולים עם נתונים שונים; הוצגה הגרסה העדכנית ביותר', 'warning')
+            return render_results(payload, result_id)
         else:
             flash('לא בוצע עיבוד של קבצים', 'error')
             return redirect(request.url)
@@ -237,63 +883,142 @@ def upload_file():
     return render_template('upload.html')
 
 
-@app.route('/export')
-def export():
-    processed_filename = session.get('results_file')
-    if not processed_filename:
-        flash('אין נתונים לייצוא', 'error')
+def _chunked(parts, size=STREAM_CHUNK_BYTES):
+    """Group template output into chunks of about size bytes."""
+    buffer = []
+    buffered = 0
+    for part in parts:
+        buffer.append(part)
+        buffered += len(part)
+        if buffered >= size:
+            yield ''.join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def _compress_stream(chunks, encoding):
+    """Compress a stream of text chunks, flushing after each so the client can render it as it arrives."""
+    compressor = _compressor(encoding)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8')) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_page(template_name, **context):
+    """Render a template as a streamed response, compressed when the client accepts it.
+
+    Flash messages are taken from the session here, before the session cookie is
+    sent; a template popping them mid-stream would leave them in the cookie.
+    """
+    context.setdefault('flashed_messages', get_flashed_messages(with_categories=True))
+    chunks = _chunked(stream_template(template_name, **context))
+    encoding = negotiate_encoding()
+    if encoding:
+        response = app.response_class(_compress_stream(chunks, encoding), mimetype='text/html')
+        response.headers['Content-Encoding'] = encoding
+    else:
+        response = app.response_class(chunks, mimetype='text/html')
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def render_results(payload, result_id):
+    """Render the results page for a stored result."""
+    view = payload['view']
+    messages = get_flashed_messages(with_categories=True)
+    response = stream_page(
+        'results.html',
+        df_columns=view['columns'],
+        df_values=view['values'],
+        totals_row=view['totals_row'],
+        record_count=view['record_count'],
+        timestamp=payload['timestamp'],
+        numeric_columns=view['numeric_columns'],
+        numeric_column_indexes=view['numeric_column_indexes'],
+        wide_layout=True,
+        person_details=payload['person_details'],
+        beneficiaries=payload['beneficiaries'],
+        conflicts=payload['conflicts'],
+        result_id=result_id,
+        flashed_messages=messages,
+    )
+    if messages:
+        # The messages are shown once; a cached copy must not bring them back
+        response.cache_control.no_store = True
+        return response
+    # Stored results never change, so the page only changes with the templates
+    response.set_etag(f"{result_id}-{TEMPLATE_VERSION}-{response.headers.get('Content-Encoding', 'identity')}")
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def current_result():
+    """The session's stored result payload, or None."""
+    result_id = session.get('result_id')
+    if not result_id:
+        return None
+    return get_result_cache().get(result_id, session_owner())
+
+
+@app.route('/results/<result_id>')
+def show_results(result_id):
+    payload = get_result_cache().get(result_id, session_owner())
+    if payload is None:
+        flash('התוצאות אינן זמינות עוד. אנא עבד מחדש את הקבצים.', 'error')
         return redirect(url_for('upload_file'))
+    # Pending flash messages are part of the page, so only answer 304 without them
+    etag = f"{result_id}-{TEMPLATE_VERSION}-{negotiate_encoding() or 'identity'}"
+    if request.if_none_match.contains(etag) and not session.get('_flashes'):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    return render_results(payload, result_id)
+
 
-    processed_path = os.path.join(app.config['PROCESSED_FOLDER'], processed_filename)
-    if not os.path.exists(processed_path):
-        flash('קובץ העיבוד לא נמצא. אנא עבד מחדש את הקבצים.', 'error')
-        session.pop('results_file', None)
+def _serve_export(export_format):
+    """Serve a cached export artifact, honouring If-None-Match."""
+    payload = current_result()
+    if payload is None:
+        flash('אין נתונים לייצוא', 'error')
         return redirect(url_for('upload_file'))
+    content_hash = payload['export_hash']
+    file_ids = payload['file_ids']
+
+    etag = f'{content_hash}-{export_format}'
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    path = export_artifact_path(content_hash, export_format)
+    pending = _pending_exports.get(content_hash)
+    if pending is not None:
+        try:
+            pending.result()
+        except Exception as e:
+            logging.error(f"Background export failed: {str(e)}")
 
     try:
-        with open(processed_path, 'r', encoding='utf-8') as processed_file:
-            data = json.load(processed_file)
-
-        df = pd.DataFrame(data, columns=TABLE_COLUMNS)
-        numeric_cols = [col for col in df.columns if col in NUMERIC_COLUMNS]
-        df[numeric_cols] = df[numeric_cols].apply(pd.to_numeric, errors='coerce')
-
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='נתוני פנסיה')
-            workbook = writer.book
-            worksheet = writer.sheets['נתוני פנסיה']
-
-            header_format = Font(bold=True, color='FFFFFF')
-            header_fill = PatternFill(start_color='4472C4', end_color='4472C4', fill_type='solid')
-
-            for col_num, column_title in enumerate(df.columns, 1):
-                cell = worksheet.cell(row=1, column=col_num)
-                cell.font = header_format
-                cell.fill = header_fill
-                cell.alignment = Alignment(horizontal='right', vertical='center')
-
-            number_format = '#,##0.00'
-            for col_num, column_title in enumerate(df.columns, 1):
-                column_letter = get_column_letter(col_num)
-                max_length = len(str(column_title))
-                for cell in worksheet[column_letter]:
-                    if cell.row == 1:
-                        continue
-                    value = cell.value
-                    if column_title in NUMERIC_COLUMNS and isinstance(value, (int, float)):
-                        cell.number_format = number_format
-                    if value is not None:
-                        max_length = max(max_length, len(str(value)))
-                worksheet.column_dimensions[column_letter].width = min(max_length + 2, 50)
-
-        output.seek(0)
+        if not export_artifact_is_current(content_hash, export_format) and not write_export_artifacts(content_hash, file_ids):
+            flash('קובץ העיבוד לא נמצא. אנא עבד מחדש את הקבצים.', 'error')
+            session.pop('result_id', None)
+            return redirect(url_for('upload_file'))
+
+        mimetype, _ = EXPORT_FORMATS[export_format]
         timestamp = datetime.now().strftime('%Y%m%d_%H%M')
         return send_file(
-            output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            path,
+            mimetype=mimetype,
             as_attachment=True,
-            download_name=f'pension_results_{timestamp}.xlsx'
+            download_name=f'pension_results_{timestamp}.{export_format}',
+            etag=etag,
+            conditional=True,
+            max_age=0,
         )
 
     except Exception as e:
@@ -301,5 +1026,295 @@ def export():
         flash(f'שגיאה ביצוא הקובץ: {str(e)}', 'error')
         return redirect(url_for('upload_file'))
 
+
+@app.route('/export')
+def export():
+    return _serve_export('xlsx')
+
+
+def _format_stream_value(column, value):
+    if column in NUMERIC_COLUMNS:
+        return f'{value:.2f}' if isinstance(value, (int, float)) else ''
+    return '' if value is None else str(value)
+
+
+def generate_csv_export(db_path, file_ids):
+    """Yield the results table as CSV text: BOM and header first, then rows in batches, then totals."""
+    store = ResultsStore(db_path)
+    try:
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+        buffer.write('\ufeff')
+        writer.writerow(TABLE_COLUMNS)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+        for count, account in enumerate(store.iter_accounts(file_ids), 1):
+            row = flatten_accounts({'accounts': [account]})[0]
+            writer.writerow([_format_stream_value(column, row.get(column)) for column in TABLE_COLUMNS])
+            if count % STREAM_BATCH_ROWS == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+
+        totals = column_totals(store, file_ids)
+        writer.writerow([
+            'סה"כ' if index == 0 else _format_stream_value(column, totals[column] or 0.0) if column in totals else ''
+            for index, column in enumerate(TABLE_COLUMNS)
+        ])
+        yield buffer.getvalue()
+    finally:
+        store.close()
+
+
+def generate_jsonl_export(db_path, file_ids):
+    """Yield one JSON line per results table row."""
+    store = ResultsStore(db_path)
+    try:
+        lines = []
+        for account in store.iter_accounts(file_ids):
+            lines.append(json.dumps(flatten_accounts({'accounts': [account]})[0], ensure_ascii=False))
+            if len(lines) == STREAM_BATCH_ROWS:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+        if lines:
+            yield '\n'.join(lines) + '\n'
+    finally:
+        store.close()
+
+
+def _stream_export(export_format, generate, mimetype):
+    payload = current_result()
+    if payload is None:
+        flash('אין נתונים לייצוא', 'error')
+        return redirect(url_for('upload_file'))
+    content_hash = payload['export_hash']
+    file_ids = payload['file_ids']
+
+    # Streamed, so compress_response leaves it alone; compress it here the way stream_page does
+    encoding = negotiate_encoding()
+    etag = f'{content_hash}-{export_format}-{encoding}' if encoding else f'{content_hash}-{export_format}'
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    # The generator opens its own store connection: it runs after the request context is gone
+    chunks = generate(app.config['RESULTS_DB'], file_ids)
+    if encoding:
+        response = app.response_class(_compress_stream(chunks, encoding), mimetype=mimetype)
+        response.headers['Content-Encoding'] = encoding
+    else:
+        response = app.response_class(chunks, mimetype=mimetype)
+    response.vary.add('Accept-Encoding')
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M')
+    response.headers['Content-Disposition'] = f'attachment; filename=pension_results_{timestamp}.{export_format}'
+    response.headers['Cache-Control'] = 'no-cache'
+    response.set_etag(etag)
+    return response
+
+
+@app.route('/export.csv')
+def export_csv():
+    return _stream_export('csv', generate_csv_export, 'text/csv')
+
+
+@app.route('/export.jsonl')
+def export_jsonl():
+    return _stream_export('jsonl', generate_jsonl_export, 'application/x-ndjson')
+
+
+_upload_spool = None
+_upload_spool_lock = threading.Lock()
+
+
+def get_upload_spool():
+    """App-wide spool for chunked uploads, created on first use."""
+    global _upload_spool
+    with _upload_spool_lock:
+        if _upload_spool is None:
+            _upload_spool = UploadSpool(app.config['SPOOL_FOLDER'])
+        return _upload_spool
+
+
+def _api_error(message, status, retry_after=None):
+    response = jsonify({'error': message})
+    response.status_code = status
+    if retry_after is not None:
+        response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def _chunked_upload_or_404(upload_id):
+    spool = get_upload_spool()
+    if not spool.owns(upload_id, session_owner()):
+        abort(404)
+    return spool
+
+
+def _spooled_filename(filename):
+    if not allowed_file(filename):
+        abort(_api_error(f'invalid file type: {filename}', 400))
+    return secure_filename(filename)
+
+
+def _parse_spooled(spool, upload_id, filename, filepath):
+    """Queue job: parse an assembled file and record the outcome in the spool."""
+    try:
+        result = _parse_on_pool(filepath)
+    except Exception as e:
+        logging.error(f"Error processing {filepath}: {str(e)}")
+        spool.write_result(upload_id, filename, error=str(e))
+    else:
+        spool.write_result(upload_id, filename, result=result)
+
+
+@app.route('/api/uploads', methods=['POST'])
+def create_chunked_upload():
+    upload_id = get_upload_spool().create(session_owner())
+    return jsonify({'upload_id': upload_id}), 201
+
+
+@app.route('/api/uploads/<upload_id>')
+def chunked_upload_status(upload_id):
+    spool = _chunked_upload_or_404(upload_id)
+    return jsonify({'upload_id': upload_id, 'files': spool.status(upload_id)})
+
+
+@app.route('/api/uploads/<upload_id>/files/<filename>/chunks/<int:index>', methods=['PUT'])
+def upload_chunk(upload_id, filename, index):
+    """Store one numbered chunk; the X-Chunk-SHA256 header must hold the chunk's SHA-256."""
+    spool = _chunked_upload_or_404(upload_id)
+    filename = _spooled_filename(filename)
+    checksum = request.headers.get('X-Chunk-SHA256')
+    if not checksum:
+        return _api_error('missing X-Chunk-SHA256 header', 400)
+    try:
+        spool.write_chunk(upload_id, filename, index, request.get_data(), checksum)
+    except SpoolError as e:
+        return _api_error(str(e), 400)
+    return jsonify({'filename': filename, 'received': spool.received_chunks(upload_id, filename)})
+
+
+@app.route('/api/uploads/<upload_id>/files/<filename>/complete', methods=['POST'])
+def complete_chunked_file(upload_id, filename):
+    """Assemble a file from its chunks and queue it for parsing while the rest of the package uploads.
+
+    Expects JSON {"chunks": <count>, "sha256": <optional whole-file hash>}. Completing a
+    file again is harmless; after the queue was full it queues the file again.
+    """
+    spool = _chunked_upload_or_404(upload_id)
+    filename = _spooled_filename(filename)
+    body = request.get_json(silent=True) or {}
+    try:
+        total_chunks = int(body['chunks'])
+    except (KeyError, TypeError, ValueError):
+        return _api_error('the chunk count is required', 400)
+    try:
+        filepath = spool.assemble(upload_id, filename, total_chunks, body.get('sha256'))
+    except SpoolError as e:
+        return _api_error(str(e), 400)
+    if filepath is None:
+        # Assembled by an earlier or concurrent request, which queued it; re-queue only after a full queue
+        if not spool.claim_retry(upload_id, filename):
+            entry = spool.status(upload_id).get(filename) or {}
+            if entry.get('state', 'receiving') == 'receiving':
+                entry = {'state': 'processing'}
+            return jsonify({'filename': filename, **entry}), 202
+        filepath = spool.file_path(upload_id, filename)
+
+    job = partial(_parse_spooled, spool, upload_id, filename)
+    try:
+        get_upload_queue().submit_many(session_owner(), job, [filepath])
+    except QueueFull as e:
+        # Recorded as failed so /finish is not held up; completing the file again re-queues it
+        spool.write_result(upload_id, filename, error=f'parsing queue full: {e}', retryable=True)
+        return _api_error(str(e), 429 if e.per_user else 503, e.retry_after)
+    return jsonify({'filename': filename, 'state': 'processing'}), 202
+
+
+@app.route('/api/uploads/<upload_id>/finish', methods=['POST'])
+def finish_chunked_upload(upload_id):
+    """Merge the parsed files of a chunked upload into a stored result, like a regular upload.
+
+    Accepts optional JSON {"files": [...]} giving the package order; other files follow by name.
+    """
+    spool = _chunked_upload_or_404(upload_id)
+    status = spool.status(upload_id)
+    if not status:
+        return _api_error('no files were uploaded', 400)
+    pending = sorted(name for name, entry in status.items() if entry['state'] in ('receiving', 'processing'))
+    if pending:
+        response = jsonify({'error': 'files are still uploading or processing', 'pending': pending})
+        response.status_code = 409
+        response.headers['Retry-After'] = '1'
+        return response
+
+    body = request.get_json(silent=True) or {}
+    requested = [secure_filename(name) for name in body.get('files') or [] if isinstance(name, str)]
+    ordered = [name for name in dict.fromkeys(requested) if name in status]
+    ordered += sorted(name for name in status if name not in ordered)
+
+    uploads = []
+    outcomes = []
+    for filename in ordered:
+        record = spool.read_result(upload_id, filename)
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        shutil.move(spool.file_path(upload_id, filename), filepath)
+        uploads.append((filename, filepath))
+        outcomes.append(RuntimeError(record['error']) if record['error'] else record['result'])
+
+    result_id, payload, errors = store_upload_results(uploads, outcomes, session_owner())
+    spool.remove(upload_id)
+    file_errors = [{'filename': filename, 'error': message} for filename, message in errors]
+    if not result_id:
+        response = jsonify({'error': 'no accounts were found', 'errors': file_errors})
+        response.status_code = 422
+        return response
+    return jsonify({
+        'result_id': result_id,
+        'url': url_for('show_results', result_id=result_id),
+        'record_count': payload['view']['record_count'],
+        'conflicts': len(payload['conflicts']),
+        'errors': file_errors,
+    })
+
+
+@app.route('/api/metrics')
+def metrics_api():
+    return jsonify({'upload_queue': get_upload_queue().metrics()})
+
+
+@app.route('/timeline')
+def timeline():
+    client_id = (request.args.get('client_id') or '').strip().lstrip('0')
+    if not client_id:
+        flash('לא הוזן מספר תעודת זהות', 'error')
+        return redirect(url_for('upload_file'))
+
+    store = get_results_store()
+    accounts = store.balance_timeline(client_id)
+    if not accounts:
+        flash(f'לא נמצאה היסטוריית יתרות עבור {client_id}', 'error')
+        return redirect(url_for('upload_file'))
+
+    return render_template(
+        'timeline.html',
+        client_id=client_id,
+        person_details=store.load_client(client_id),
+        accounts=accounts,
+    )
+
+
+@app.route('/api/timeline/<client_id>')
+def timeline_api(client_id):
+    client_id = client_id.strip().lstrip('0')
+    return jsonify({
+        'client_id': client_id,
+        'accounts': get_results_store().balance_timeline(client_id),
+    })
+
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,199 @@
+import os
+import sys
+import time
+import logging
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import wait
+from typing import Any, Callable, Iterable, Iterator
+
+try:
+    import resource  # type: ignore
+except ImportError:  # pragma: no cover - not available on Windows
+    resource = None
+
+DEFAULT_TIME_BUDGET = 300.0
+DEFAULT_MEMORY_LIMIT_MB = 2048
+DEFAULT_MAX_TASKS_PER_WORKER = 100
+POLL_INTERVAL = 0.5
+
+
+def _current_vsize_bytes() -> int:
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return 0
+
+
+def _apply_memory_limit(memory_limit_mb: int) -> None:
+    """Cap the worker's address space so a runaway file raises MemoryError instead of swapping."""
+    if resource is None or not memory_limit_mb:
+        return
+    baseline = _current_vsize_bytes()
+    if not baseline:
+        return
+    limit = baseline + memory_limit_mb * 1024 * 1024
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ValueError, OSError) as e:
+        logging.warning(f"Unable to set worker memory limit: {str(e)}")
+
+
+def _peak_rss_mb() -> float:
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _worker_main(conn, task: Callable[[str], Any], memory_limit_mb: int, max_tasks: int) -> None:
+    _apply_memory_limit(memory_limit_mb)
+    baseline_mb = _peak_rss_mb()
+    for _ in range(max_tasks):
+        try:
+            file_path = conn.recv()
+        except EOFError:
+            break
+        if file_path is None:
+            break
+        try:
+            result = task(file_path)
+        except MemoryError:
+            conn.send(('rejected', 'memory ceiling exceeded'))
+            break
+        except Exception as e:
+            conn.send(('error', str(e)))
+            continue
+
+        growth = _peak_rss_mb() - baseline_mb
+        if memory_limit_mb and growth > memory_limit_mb:
+            conn.send(('rejected', f'memory ceiling exceeded ({growth:.0f} MB)'))
+            break
+        conn.send(('ok', result))
+    conn.close()
+
+
+class _Worker:
+    def __init__(self, context, task, memory_limit_mb: int, max_tasks: int):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_conn, task, memory_limit_mb, max_tasks),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.tasks_done = 0
+        self.file_path: str | None = None
+        self.started_at = 0.0
+
+    def assign(self, file_path: str) -> None:
+        self.file_path = file_path
+        self.started_at = time.monotonic()
+        self.conn.send(file_path)
+
+    def stop(self, kill: bool = False) -> None:
+        if kill:
+            self.process.kill()
+        else:
+            try:
+                self.conn.send(None)
+            except (OSError, ValueError):
+                pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class BatchExecutor:
+    """Run a per-file task in worker processes with a time budget and memory ceiling per file.
+
+    A file that exceeds its budget has its worker killed, and run() reports it as
+    rejected with a reason. Workers are replaced after max_tasks_per_worker files
+    to return leaked memory to the system.
+    """
+
+    def __init__(
+        self,
+        task: Callable[[str], Any],
+        workers: int | None = None,
+        time_budget: float = DEFAULT_TIME_BUDGET,
+        memory_limit_mb: int = DEFAULT_MEMORY_LIMIT_MB,
+        max_tasks_per_worker: int = DEFAULT_MAX_TASKS_PER_WORKER,
+    ):
+        self.task = task
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.time_budget = time_budget
+        self.memory_limit_mb = memory_limit_mb
+        self.max_tasks_per_worker = max(1, max_tasks_per_worker)
+        self._context = multiprocessing.get_context()
+
+    def run(self, file_paths: Iterable[str]) -> Iterator[tuple[str, Any, str | None]]:
+        """Yield (file_path, result, rejection_reason) as each file finishes, in completion order.
+
+        result is None when the task failed or the file was rejected; rejection_reason
+        is None unless the file was killed or exceeded its limits.
+        """
+        pending = deque(file_paths)
+        busy: list[_Worker] = []
+        idle: list[_Worker] = []
+        try:
+            while pending or busy:
+                while pending and (idle or len(busy) < self.workers):
+                    worker = idle.pop() if idle else _Worker(
+                        self._context, self.task, self.memory_limit_mb, self.max_tasks_per_worker
+                    )
+                    worker.assign(pending.popleft())
+                    busy.append(worker)
+
+                ready = wait(
+                    [worker.conn for worker in busy] + [worker.process.sentinel for worker in busy],
+                    timeout=POLL_INTERVAL,
+                )
+                now = time.monotonic()
+                for worker in list(busy):
+                    file_path = worker.file_path
+                    outcome = None
+                    retire = False
+                    kill = False
+                    if worker.conn in ready or worker.process.sentinel in ready:
+                        try:
+                            status, payload = worker.conn.recv()
+                        except (EOFError, OSError):
+                            worker.process.join(timeout=1)
+                            outcome = (file_path, None, f'worker exited with code {worker.process.exitcode}')
+                            retire = True
+                        else:
+                            worker.tasks_done += 1
+                            if status == 'ok':
+                                outcome = (file_path, payload, None)
+                            elif status == 'error':
+                                logging.error(f"Error processing {file_path}: {payload}")
+                                outcome = (file_path, None, None)
+                            else:
+                                outcome = (file_path, None, payload)
+                                retire = True
+                            retire = retire or worker.tasks_done >= self.max_tasks_per_worker
+                    elif now - worker.started_at > self.time_budget:
+                        outcome = (file_path, None, f'time budget of {self.time_budget:g}s exceeded')
+                        retire = True
+                        kill = True
+
+                    if outcome is None:
+                        continue
+                    busy.remove(worker)
+                    if retire:
+                        worker.stop(kill=kill)
+                    else:
+                        worker.file_path = None
+                        idle.append(worker)
+                    yield outcome
+        finally:
+            for worker in busy:
+                worker.stop(kill=True)
+            for worker in idle:
+                worker.stop()
@@ -0,0 +1,33 @@
+# Production server settings: gunicorn -c gunicorn.conf.py app:app
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+
+# One worker process, many threads. The upload admission queue (FairJobQueue) and the
+# parsing process pool live in the worker, so with more workers each would enforce its
+# own UPLOAD_QUEUE_LIMIT and take turns only between its own users. Parsing still uses
+# every core through the pool; threads serve the other requests meanwhile.
+workers = 1
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '16'))
+# An upload request waits for its files to be parsed
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '300'))
+
+
+def on_starting(server):
+    """Refuse to start with more than one worker, or while pages would still load Bootstrap, jQuery and DataTables from the CDN."""
+    if server.cfg.workers != 1:
+        raise SystemExit(
+            f"gunicorn must run a single worker (got {server.cfg.workers}): upload queue limits "
+            "and per-user fairness are kept in the worker process. Scale with GUNICORN_THREADS."
+        )
+
+    from app import missing_vendor_assets
+
+    missing = missing_vendor_assets()
+    if missing:
+        raise SystemExit(
+            f"Missing vendor assets ({', '.join(missing)}). This host cannot download them: run "
+            "'flask --app app vendor-assets' on a machine with internet access, then copy its "
+            "static/vendor directory here (or commit it) before starting gunicorn."
+        )
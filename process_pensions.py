@@ -2,15 +2,32 @@ import os
 import glob
 import json
 import csv
+import time
+import hashlib
+import argparse
 import logging
+import re
+import sys
+from functools import lru_cache
 from datetime import datetime
 from typing import Any
 import xml.etree.ElementTree as ET
 
+from batch_executor import (
+    DEFAULT_MAX_TASKS_PER_WORKER,
+    DEFAULT_MEMORY_LIMIT_MB,
+    DEFAULT_TIME_BUDGET,
+    BatchExecutor,
+)
+from results_store import RESULTS_DB_FILENAME, ResultsStore
+from schema_types import NUMERIC_KINDS, code_label, decode_value, tag_type
+
 try:
-    import pandas as pd  # type: ignore
+    from openpyxl import Workbook  # type: ignore
+    from openpyxl.cell import WriteOnlyCell  # type: ignore
+    from openpyxl.styles import Font  # type: ignore
 except ImportError:  # pragma: no cover - optional dependency
-    pd = None
+    Workbook = None
 
 MANAGING_COMPANY_TAGS = [
     'SHEM-METAFEL',
@@ -79,6 +96,10 @@ EMPLOYER_NAME_TAGS = [
     'SHEM-HAMESHALLEM'
 ]
 
+# Employer entities (YeshutMaasik) are linked to accounts by the provider's employer number
+EMPLOYER_REF_TAG = 'MPR-MAASIK-BE-YATZRAN'
+EMPLOYER_ID_TAGS = [EMPLOYER_REF_TAG, 'MISPAR-MEZAHE-MAASIK']
+
 PRODUCT_TYPE_MAP = {
     '1': 'פוליסת ביטוח חיים משולב חיסכון',
     '2': 'פוליסת ביטוח חיים',
@@ -117,6 +138,270 @@ TAGMUL_ROLE_BY_REKIV = {
 EMPLOYEE_SUG_CODES = {'2', '4', '8', '10'}
 EMPLOYER_SUG_CODES = {'3', '7', '9', '11'}
 
+# Declarative account field map. Each output field lists its source tags in
+# priority order (first tag wins) and the scope the tags are read from:
+#   'child'   - direct children of the account element (first non-empty value wins)
+#   'subtree' - every descendant of the account; unique values collected per tag
+#   'exists'  - tags that appear anywhere below the account, regardless of value
+#   'lineage' - descendants of the account and of each ancestor, nearest first
+# Subtree fields may also match any tag containing one of 'keywords', and use
+# 'order': 'document' to keep tags in order of first appearance.
+ACCOUNT_FIELD_SPEC = {
+    'account_number': {
+        'scope': 'child',
+        'tags': ['MISPAR-POLISA-O-HESHBON', 'MISPAR-HESHBON', 'MISPAR-POLISA', 'AccountNumber', 'AccountId', 'PolicyNumber'],
+    },
+    'company': {
+        'scope': 'child',
+        'tags': ['SHEM-YATZRAN', 'YATZRAN', 'SHEM_HA_MOSAD', 'Company', 'Provider'],
+    },
+    'plan': {
+        'scope': 'child',
+        'tags': ['SHEM-TOCHNIT', 'TOCHNIT', 'SHEM_TOCHNIT'],
+    },
+    'plan_type': {
+        'scope': 'child',
+        'tags': PLAN_TYPE_TAGS,
+    },
+    'balance_date': {
+        'scope': 'child',
+        'tags': ['TAARICH-NECHONUT', 'TAARICH-ERECH-TZVIROT', 'TAARICH-ERECH', 'TAARICH-MADAD', 'TAARICH-ERECH-HAFKADA'],
+    },
+    'start_date': {
+        'scope': 'child',
+        'tags': ['TAARICH-HITZTARFUT-RISHON'],
+    },
+    'plan_type_fields': {
+        'scope': 'subtree',
+        'tags': PLAN_TYPE_TAGS,
+    },
+    'plan_type_indicators': {
+        'scope': 'exists',
+        'tags': ['HODAAT-LEKULAM', 'HODAAT-LEPENSIA', 'HODAAT-LIBRAT'],
+    },
+    'balance_fields': {
+        'scope': 'subtree',
+        'tags': BALANCE_EXPLICIT_TAGS,
+        'keywords': BALANCE_KEYWORDS,
+        'include_self': True,
+        'order': 'document',
+    },
+    'managing_company_fields': {
+        'scope': 'lineage',
+        'tags': MANAGING_COMPANY_TAGS,
+    },
+    'plan_names': {
+        'scope': 'lineage',
+        'tags': ['SHEM-TOCHNIT', 'TOCHNIT', 'SHEM_TOCHNIT'],
+    },
+    'product_codes': {
+        'scope': 'lineage',
+        'tags': ['SUG-MUTZAR'],
+    },
+    'employer_names': {
+        'scope': 'subtree',
+        'tags': EMPLOYER_NAME_TAGS,
+    },
+    'employer_refs': {
+        'scope': 'subtree',
+        'tags': [EMPLOYER_REF_TAG],
+    },
+}
+
+
+def intern_text(value: Any) -> Any:
+    """Intern text so repeated values across accounts and files share one string object."""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _keyword_entries(keyword_fields, tag: str, skip_fields=()) -> list[tuple[str, int, str]]:
+    tag_upper = tag.upper()
+    return [
+        (field, priority, scope)
+        for field, priority, scope, keywords in keyword_fields
+        if field not in skip_fields and any(keyword in tag_upper for keyword in keywords)
+    ]
+
+
+def compile_field_spec(spec: dict[str, dict[str, Any]]) -> dict[str, Any]:
+    """Compile a field spec into a tag -> ((field, priority, scope), ...) dispatch table."""
+    dispatch: dict[str, list[tuple[str, int, str]]] = {}
+    keyword_fields: list[tuple[str, int, str, tuple[str, ...]]] = []
+    for field, rule in spec.items():
+        scope = rule['scope']
+        tags = rule.get('tags', [])
+        for priority, tag in enumerate(tags):
+            dispatch.setdefault(tag, []).append((field, priority, scope))
+        if rule.get('keywords'):
+            keywords = tuple(keyword.upper() for keyword in rule['keywords'])
+            keyword_fields.append((field, len(tags), scope, keywords))
+
+    for tag, entries in dispatch.items():
+        entries.extend(_keyword_entries(keyword_fields, tag, {field for field, _, _ in entries}))
+
+    return {
+        'spec': spec,
+        'dispatch': {tag: tuple(entries) for tag, entries in dispatch.items()},
+        'keyword_fields': keyword_fields,
+        'lineage_tags': frozenset(
+            tag for rule in spec.values() if rule['scope'] == 'lineage' for tag in rule['tags']
+        ),
+    }
+
+
+def dispatch_entries(compiled: dict[str, Any], tag: str) -> tuple[tuple[str, int, str], ...]:
+    """Return the dispatch entries for a tag, resolving keyword rules once per tag."""
+    entries = compiled['dispatch'].get(tag)
+    if entries is None:
+        entries = tuple(_keyword_entries(compiled['keyword_fields'], tag))
+        compiled['dispatch'][tag] = entries
+    return entries
+
+
+# Process-wide per-tag classification: each distinct tag is matched against the explicit
+# tags and balance keywords once, and every account walk in every document reuses it
+ACCOUNT_FIELD_DISPATCH = compile_field_spec(ACCOUNT_FIELD_SPEC)
+
+# Plan-name keywords, matched in a single regex pass per name (lookahead keeps overlapping hits)
+PLAN_NAME_KEYWORD_PATTERN = re.compile(
+    '(?=(גמל להשקעה|השתלמות|פנסיה|מקפת|עתודות|גמל|ביטוח|חיים|מנהל|חיסכון|savings))',
+    re.IGNORECASE
+)
+
+INSURANCE_PRODUCT_TYPES = {
+    'פוליסת ביטוח חיים משולב חיסכון',
+    'פוליסת ביטוח חיים',
+    'פוליסת חיסכון טהור',
+}
+
+PRODUCT_TYPE_CACHE_SIZE = 4096
+
+
+def _classify_plan_name(name: str) -> str | None:
+    hits = {match.lower() for match in PLAN_NAME_KEYWORD_PATTERN.findall(name)}
+    if not hits:
+        return None
+    if 'גמל להשקעה' in hits:
+        return 'גמל להשקעה'
+    if 'השתלמות' in hits:
+        return 'קרן השתלמות'
+    if hits & {'פנסיה', 'מקפת', 'עתודות'}:
+        return 'קרן פנסיה'
+    if 'גמל' in hits:
+        return 'קופת גמל'
+    if 'ביטוח' in hits and hits & {'חיים', 'מנהל'}:
+        return 'פוליסת ביטוח חיים'
+    if hits & {'חיסכון', 'savings'}:
+        return 'פוליסת חיסכון טהור'
+    return None
+
+
+@lru_cache(maxsize=PRODUCT_TYPE_CACHE_SIZE)
+def _classify_product_type(plan_names: tuple[str, ...], codes: tuple[str, ...]) -> str:
+    name_type: str | None = None
+    for name in plan_names:
+        name_type = _classify_plan_name(name)
+        if name_type:
+            break
+
+    code_type: str | None = None
+    for code in codes:
+        mapped = PRODUCT_TYPE_MAP.get(code)
+        if mapped:
+            code_type = mapped
+            break
+
+    if code_type and name_type:
+        if code_type == name_type:
+            return code_type
+        if code_type in INSURANCE_PRODUCT_TYPES:
+            if name_type in {'קרן פנסיה', 'קרן השתלמות'}:
+                return name_type
+            return code_type
+        return name_type
+
+    if name_type:
+        return name_type
+
+    if code_type:
+        return code_type
+
+    if plan_names:
+        return plan_names[0]
+
+    if codes:
+        return codes[0]
+
+    return ''
+
+
+def classify_product_type(plan_names, codes) -> str:
+    """Classify a product from its plan names and SUG-MUTZAR codes (memoized)."""
+    normalized_names = tuple(name.strip() for name in plan_names if name and name.strip())
+    normalized_codes = tuple(code.strip() for code in codes if code and code.strip())
+    return _classify_product_type(normalized_names, normalized_codes)
+
+
+def product_type_cache_stats() -> dict[str, Any]:
+    """Hit/miss counters of the product-type classifier cache."""
+    info = _classify_product_type.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        'hits': info.hits,
+        'misses': info.misses,
+        'size': info.currsize,
+        'max_size': info.maxsize,
+        'hit_rate': info.hits / lookups if lookups else 0.0,
+    }
+
+
+# Known holdings interface variants (SUG-MIMSHAK, MISPAR-GIRSAT-XML, product family)
+# are routed to a fixed-path extractor; anything else goes through the generic probe.
+HOLDINGS_INTERFACES = ['1', '2', '3']
+HOLDINGS_XML_VERSIONS = ['007', '008', '009']
+HOLDINGS_PRODUCT_FAMILIES = ['KGM', 'PNN', 'PNO', 'ING', 'INP', 'INK']
+
+EXTRACTION_ROUTES = {
+    (interface, version, family): 'holdings'
+    for interface in HOLDINGS_INTERFACES
+    for version in HOLDINGS_XML_VERSIONS
+    for family in HOLDINGS_PRODUCT_FAMILIES
+}
+
+HOLDINGS_ACCOUNT_PATH = './YeshutYatzran/Mutzarim/Mutzar/HeshbonotOPolisot/HeshbonOPolisa'
+HOLDINGS_CUSTOMER_PATH = './YeshutYatzran/Mutzarim/Mutzar/NetuneiMutzar/YeshutLakoach'
+
+# Transfer header fields reported with every result (KoteretKovetz)
+FILE_HEADER_TAGS = {
+    'execution_date': 'TAARICH-BITZUA',
+    'sender_code': 'KOD-SHOLEACH',
+    'sender_name': 'SHEM-SHOLEACH',
+    'transfer_id': 'MEZAHE-HAAVARA',
+    'file_number': 'MISPAR-HAKOVETZ',
+}
+
+# A retransmitted file repeats the transfer identifiers of the original.
+# Parts of one transfer share them too, so the first account number tells parts apart.
+TRANSFER_KEY_FIELDS = ('sender_code', 'transfer_id', 'file_number')
+TRANSFER_PART_TAG = 'MISPAR-POLISA-O-HESHBON'
+TRANSFER_HEADER_TAG = 'KoteretKovetz'
+# The header pre-pass never reads past the first product, even when it carries no account number
+TRANSFER_PART_SCOPE_TAG = 'Mutzar'
+
+PRODUCT_FAMILY_PATTERN = re.compile(r'_([A-Z]{3})_\d{12}_\d+\.[A-Za-z]+$')
+FILE_TIMESTAMP_PATTERN = re.compile(r'_(\d{12})_\d+\.[A-Za-z]+$')
+ISO_DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+# Account keys holding low-cardinality text (providers, plans, product types, employers)
+INTERNED_ACCOUNT_KEYS = [
+    'שם_תכנית',
+    'חברה_מנהלת',
+    'קוד_חברה_מנהלת',
+    'תאריך_נכונות_יתרה',
+    'סוג_מוצר',
+    'מעסיקים_היסטוריים',
+]
+
 BALANCE_TOLERANCE = 0.5
 NUMERIC_SENTINELS = {'', '0', '0.0', '0.00', 'NIL', 'None', 'none'}
 
@@ -133,12 +418,16 @@ class PensionFileProcessor:
         self.tree = None
         self.root = None
         self.parent_map = {}
+        self._lineage_cache = None
+        self._employers = None
     
     def process(self) -> dict:
         try:
             if not self._load_file():
                 return None
             return self._extract_data()
+        except MemoryError:
+            raise
         except Exception as e:
             logging.error(f"Error processing {self.file_path}: {str(e)}")
             return None
@@ -152,16 +441,43 @@ class PensionFileProcessor:
             self.root = self.tree.getroot()
             self.parent_map = {child: parent for parent in self.root.iter() for child in parent}
             return True
+        except MemoryError:
+            raise
         except Exception as e:
             logging.error(f"Failed to load {self.file_path}: {str(e)}")
             return False
     
-    def _extract_data(self) -> dict:
-        """Extract account data from the XML file using a generic approach."""
-        accounts = []
-        person_details = self._extract_person_details()
-        beneficiaries: list[dict[str, Any]] = []
-        
+    def _resolve_route(self) -> tuple[str, dict[str, str]]:
+        """Identify the interface variant from the file header and name."""
+        header = self.root.find('KoteretKovetz')
+        schema = {
+            'interface': self._get_text(header, 'SUG-MIMSHAK') if header is not None else '',
+            'version': self._get_text(header, 'MISPAR-GIRSAT-XML') if header is not None else '',
+            'family': '',
+        }
+        match = PRODUCT_FAMILY_PATTERN.search(os.path.basename(self.file_path))
+        if match:
+            schema['family'] = match.group(1)
+
+        route = EXTRACTION_ROUTES.get((schema['interface'], schema['version'], schema['family']), 'generic')
+        return route, schema
+
+    def _extract_header(self) -> dict[str, str]:
+        header = self.root.find('KoteretKovetz')
+        if header is None:
+            return {}
+        return {key: self._get_text(header, tag) for key, tag in FILE_HEADER_TAGS.items()}
+
+    def _find_account_nodes(self, route: str) -> tuple[list, str]:
+        """Locate account elements, using the fixed holdings path when the variant is known."""
+        if route == 'holdings':
+            account_nodes = self.root.findall(HOLDINGS_ACCOUNT_PATH)
+            if account_nodes:
+                return account_nodes, route
+            logging.debug("Holdings path matched no accounts in %s; using generic probe", self.file_path)
+        return self._find_account_nodes_generic(), 'generic'
+
+    def _find_account_nodes_generic(self) -> list:
         # Try different possible account element names
         account_elements = [
             'HeshbonOPolisa',  # Common in many pension files
@@ -198,51 +514,41 @@ class PensionFileProcessor:
                                  self.root.find('.//MISPAR-HESHBON') is not None or
                                  self.root.find('.//MISPAR-POLISA') is not None):
             account_nodes = [self.root]
+
+        return account_nodes
+
+    def _extract_data(self) -> dict:
+        """Extract account data from the XML file, routed by interface variant."""
+        accounts = []
+        route, schema = self._resolve_route()
+        account_nodes, route = self._find_account_nodes(route)
+        person_details = self._extract_person_details(route)
+        beneficiaries: list[dict[str, Any]] = []
         
         for account in account_nodes:
-            # Get account number from common field names
-            acc_number = self._get_text(account, 'MISPAR-POLISA-O-HESHBON') or \
-                        self._get_text(account, 'MISPAR-HESHBON') or \
-                        self._get_text(account, 'MISPAR-POLISA') or \
-                        self._get_text(account, 'AccountNumber') or \
-                        self._get_text(account, 'AccountId') or \
-                        self._get_text(account, 'PolicyNumber') or \
-                        'לא ידוע'
-            
-            # Get company name from common field names (fallback)
-            company = self._get_text(account, 'SHEM-YATZRAN') or \
-                     self._get_text(account, 'YATZRAN') or \
-                     self._get_text(account, 'SHEM_HA_MOSAD') or \
-                     self._get_text(account, 'Company') or \
-                     self._get_text(account, 'Provider') or \
-                     'לא ידוע'
-            
-            # Get plan name from common field names
-            plan = self._get_text(account, 'SHEM-TOCHNIT') or \
-                  self._get_text(account, 'TOCHNIT') or \
-                  self._get_text(account, 'SHEM_TOCHNIT') or \
-                  'לא ידוע'
-            
+            # Resolve every mapped field in one walk of the account subtree
+            fields = self._walk_account_fields(account)
+
+            acc_number = fields['account_number'] or 'לא ידוע'
+            company = fields['company'] or 'לא ידוע'
+            plan = fields['plan'] or 'לא ידוע'
+
             # Get plan type
-            plan_type = self._get_plan_type(account)
+            plan_type = self._get_plan_type(fields)
 
             # Get balance
             balance = self._find_balance(account)
 
             # Get balance valuation date
-            balance_date = self._get_balance_date(account)
+            balance_date = self._get_balance_date(account, fields)
 
             # Get managing company details (name/code)
-            managing_company_name, managing_company_code = self._get_managing_company(account, fallback_name=company)
+            managing_company_name, managing_company_code = self._get_managing_company(fields, fallback_name=company)
 
-            # Collect all managing company tag values
-            managing_company_fields = self._collect_specific_tags(account, MANAGING_COMPANY_TAGS)
-
-            # Collect all plan type related tag values
-            plan_type_fields = self._collect_specific_tags(account, PLAN_TYPE_TAGS, include_parents=False)
-
-            # Collect balances related to tagmulim/pitzuyim
-            balance_related_fields = self._collect_balance_related_fields(account)
+            # Collect all managing company / plan type / tagmulim-pitzuyim tag values
+            managing_company_fields = self._join_field_values(fields['managing_company_fields'], interned=True)
+            plan_type_fields = self._join_field_values(fields['plan_type_fields'], interned=True)
+            balance_related_fields = self._join_field_values(fields['balance_fields'])
             tagmul_periods = self._collect_tagmul_periods(account)
             severance_components = self._extract_severance_components(account, balance_related_fields)
             tagmul_total = sum(tagmul_periods.values())
@@ -252,9 +558,10 @@ class PensionFileProcessor:
             if abs(balance_diff) <= BALANCE_TOLERANCE:
                 balance_diff = 0.0
 
-            employer_names = self._collect_employer_names(account)
-            start_date = self._get_start_date(account)
-            product_type = self._get_product_type(account)
+            employer_ids = self._account_employer_ids(account, fields)
+            employer_names = self._collect_employer_names(employer_ids, fields)
+            start_date = self._format_date(fields['start_date'])
+            product_type = self._get_product_type(fields)
 
             acc_data = {
                 'מספר_חשבון': acc_number,
@@ -278,6 +585,9 @@ class PensionFileProcessor:
             acc_data['סך_רכיבים'] = component_total
             acc_data['פער_יתרה_מול_רכיבים'] = balance_diff
             acc_data['שמות_מעסיקים'] = employer_names
+            acc_data['מזהי_מעסיקים'] = employer_ids
+            for key in INTERNED_ACCOUNT_KEYS:
+                acc_data[key] = intern_text(acc_data[key])
 
             if balance_diff != 0.0:
                 logging.debug(
@@ -291,8 +601,8 @@ class PensionFileProcessor:
                 self._collect_beneficiaries_for_account(
                     account,
                     acc_number,
-                    plan,
-                    product_type,
+                    acc_data['שם_תכנית'],
+                    acc_data['סוג_מוצר'],
                     acc_data['חברה_מנהלת'],
                 )
             )
@@ -302,10 +612,14 @@ class PensionFileProcessor:
             'accounts': accounts,
             'person_details': person_details,
             'beneficiaries': beneficiaries,
+            'employers': self._employer_registry()['names'],
+            'route': route,
+            'schema': schema,
+            'header': self._extract_header(),
             'processed_at': datetime.now().isoformat()
         }
 
-    def _extract_person_details(self) -> dict[str, str]:
+    def _extract_person_details(self, route: str = 'generic') -> dict[str, str]:
         """Extract personal details of the main client (if present)."""
         details: dict[str, str] = {}
         if self.root is None:
@@ -315,6 +629,8 @@ class PensionFileProcessor:
             './/YeshutLakoach',
             './/Lakoach',
         ]
+        if route == 'holdings':
+            candidate_paths.insert(0, HOLDINGS_CUSTOMER_PATH)
         customer_elem = None
         for path in candidate_paths:
             customer_elem = self.root.find(path)
@@ -445,7 +761,7 @@ class PensionFileProcessor:
                 '4': 'אלמן/ה',
                 '5': 'פרוד/ה',
             }
-            text = marital_map.get(marital_status)
+            text = marital_map.get(marital_status) or code_label('MATZAV-MISHPACHTI', marital_status)
             if text:
                 details['marital_status'] = text
 
@@ -519,25 +835,8 @@ class PensionFileProcessor:
             if value is not None and value > 0:
                 return value
 
-        # 5. Fall back to scanning numeric values as a last resort
-        potential_balances = []
-        for elem in account_elem.iter():
-            if elem.text and any(c.isdigit() for c in elem.text):
-                try:
-                    value = float(elem.text.replace(',', ''))
-                    if value > 0:
-                        tag = elem.tag.upper()
-                        weight = 1.0
-                        if 'SCHUM' in tag or 'YITRAT' in tag or 'ERECH' in tag:
-                            weight = 2.0
-                        potential_balances.append((weight, value, elem.tag))
-                except (ValueError, AttributeError):
-                    continue
-
-        if potential_balances:
-            potential_balances.sort(key=lambda x: (-x[0], -x[1]))
-            return potential_balances[0][1]
-
+        # Nothing above matched: the account carries no savings balance (e.g. a risk-only
+        # policy). Other decimals under it are sums insured, premiums or costs, not balances.
         return 0.0
 
     def _sum_fields(self, base_elem, xpath: str, field_candidates: list[str]) -> tuple[float, int]:
@@ -563,49 +862,114 @@ class PensionFileProcessor:
         node = elem.find(f'.//{tag}')
         return node.text.strip() if node is not None and node.text else ''
 
-    def _collect_tag_values(self, start_elem, tag: str, include_parents: bool = True) -> list[str]:
-        values: list[str] = []
+    def _walk_account_fields(self, account_elem) -> dict[str, Any]:
+        """Fill every ACCOUNT_FIELD_SPEC field in a single walk of the account subtree."""
+        spec = ACCOUNT_FIELD_DISPATCH['spec']
+        child_values: dict[str, dict[int, str]] = {}
+        subtree_values: dict[str, dict[str, list[str]]] = {}
+        present: dict[str, set[str]] = {}
+
+        for node in account_elem.iter():
+            entries = dispatch_entries(ACCOUNT_FIELD_DISPATCH, node.tag)
+            if not entries:
+                continue
+            is_self = node is account_elem
+            is_child = not is_self and self.parent_map.get(node) is account_elem
+            text = node.text.strip() if node.text else ''
+            for field, priority, scope in entries:
+                if scope == 'child':
+                    # Mirror elem.find(tag): only the first matching child counts
+                    if is_child:
+                        child_values.setdefault(field, {}).setdefault(priority, text)
+                elif scope == 'subtree':
+                    if text and (not is_self or spec[field].get('include_self')):
+                        values = subtree_values.setdefault(field, {}).setdefault(node.tag, [])
+                        if text not in values:
+                            values.append(text)
+                elif scope == 'exists':
+                    if not is_self:
+                        present.setdefault(field, set()).add(node.tag)
+
+        fields: dict[str, Any] = {}
+        for field, rule in spec.items():
+            scope = rule['scope']
+            if scope == 'child':
+                by_priority = child_values.get(field, {})
+                fields[field] = next(
+                    (by_priority[priority] for priority in sorted(by_priority) if by_priority[priority]),
+                    ''
+                )
+            elif scope == 'subtree':
+                collected = subtree_values.get(field, {})
+                if rule.get('order') != 'document':
+                    ordered = {tag: collected[tag] for tag in rule['tags'] if tag in collected}
+                    ordered.update(collected)
+                    collected = ordered
+                fields[field] = collected
+            elif scope == 'exists':
+                fields[field] = present.get(field, set())
+            else:
+                fields[field] = self._lineage_values(account_elem, rule['tags'])
+        return fields
+
+    def _lineage_index(self) -> dict[str, list[tuple[str, frozenset]]]:
+        """Index lineage-scoped tag values with their ancestors, built once per document."""
+        if self._lineage_cache is None:
+            lineage_tags = ACCOUNT_FIELD_DISPATCH['lineage_tags']
+            index: dict[str, list[tuple[str, frozenset]]] = {}
+            stack = [(self.root, ())]
+            while stack:
+                node, ancestors = stack.pop()
+                if node.tag in lineage_tags and node.text and node.text.strip():
+                    index.setdefault(node.tag, []).append((node.text.strip(), frozenset(ancestors)))
+                child_ancestors = ancestors + (id(node),)
+                stack.extend((child, child_ancestors) for child in reversed(node))
+            self._lineage_cache = index
+        return self._lineage_cache
+
+    def _lineage_values(self, start_elem, tags: list[str]) -> dict[str, list[str]]:
+        """Values of each tag below start_elem and then below each ancestor, nearest first."""
+        chain: list[int] = []
         current = start_elem
-        visited: set[int] = set()
-        while current is not None and id(current) not in visited:
-            visited.add(id(current))
-            for node in current.findall(f'.//{tag}'):
-                if node.text and node.text.strip():
-                    values.append(node.text.strip())
-            if not include_parents:
-                break
+        while current is not None and id(current) not in chain:
+            chain.append(id(current))
             current = self.parent_map.get(current)
-        # Deduplicate preserving order
-        seen = set()
-        unique_values = []
-        for value in values:
-            if value not in seen:
-                seen.add(value)
-                unique_values.append(value)
-        return unique_values
-
-    def _collect_specific_tags(self, start_elem, tags: list[str], include_parents: bool = True) -> dict[str, str]:
-        collected: dict[str, str] = {}
+
+        index = self._lineage_index()
+        collected: dict[str, list[str]] = {}
         for tag in tags:
-            values = self._collect_tag_values(start_elem, tag, include_parents=include_parents)
-            if values:
-                collected[tag] = ' | '.join(values)
+            ranked = []
+            for order, (value, ancestors) in enumerate(index.get(tag, ())):
+                for level, ancestor_id in enumerate(chain):
+                    if ancestor_id in ancestors:
+                        ranked.append((level, order, value))
+                        break
+            if ranked:
+                ranked.sort()
+                collected[tag] = list(dict.fromkeys(value for _, _, value in ranked))
         return collected
 
-    def _get_managing_company(self, account_elem, fallback_name: str = 'לא ידוע') -> tuple[str, str]:
+    def _join_field_values(self, values_by_tag: dict[str, list[str]], interned: bool = False) -> dict[str, str]:
+        joined = {tag: ' | '.join(values) for tag, values in values_by_tag.items()}
+        if interned:
+            joined = {tag: intern_text(value) for tag, value in joined.items()}
+        return joined
+
+    def _get_managing_company(self, fields: dict[str, Any], fallback_name: str = 'לא ידוע') -> tuple[str, str]:
         name = ''
         code = ''
         name_tags = [tag for tag in MANAGING_COMPANY_TAGS if not tag.startswith('KOD') and 'MEZAHE' not in tag.upper()]
         code_tags = [tag for tag in MANAGING_COMPANY_TAGS if tag.startswith('KOD') or 'MEZAHE' in tag.upper()]
+        values_by_tag = fields['managing_company_fields']
 
         for tag in name_tags:
-            values = self._collect_tag_values(account_elem, tag)
+            values = values_by_tag.get(tag)
             if values:
                 name = values[0]
                 break
 
         for tag in code_tags:
-            values = self._collect_tag_values(account_elem, tag)
+            values = values_by_tag.get(tag)
             if values:
                 code = values[0]
                 break
@@ -617,45 +981,25 @@ class PensionFileProcessor:
 
         return name, code
     
-    def _get_plan_type(self, account_elem) -> str:
+    def _get_plan_type(self, fields: dict[str, Any]) -> str:
         """Try to determine the plan type based on available fields."""
-        type_fields = [
-            'SUG-TOCHNIT-O-CHESHBON',
-            'SUG-POLISA',
-            'SUG-MUTZAR',
-            'SUG-KEREN-PENSIA',
-            'SUG-KUPA',
-            'SUG-HAFRASHA'
-        ]
-
-        for field in type_fields:
-            value = self._get_text(account_elem, field)
-            if value:
-                return value
+        if fields['plan_type']:
+            return fields['plan_type']
 
         # Check for known indicators
-        if account_elem.find('.//HODAAT-LEKULAM') is not None:
+        indicators = fields['plan_type_indicators']
+        if 'HODAAT-LEKULAM' in indicators:
             return 'קופת גמל'
-        if account_elem.find('.//HODAAT-LEPENSIA') is not None:
+        if 'HODAAT-LEPENSIA' in indicators:
             return 'קרן פנסיה'
-        if account_elem.find('.//HODAAT-LIBRAT') is not None:
+        if 'HODAAT-LIBRAT' in indicators:
             return 'ביטוח מנהלים'
 
         return 'לא ידוע'
 
-    def _get_balance_date(self, account_elem) -> str:
-        date_fields = [
-            'TAARICH-NECHONUT',
-            'TAARICH-ERECH-TZVIROT',
-            'TAARICH-ERECH',
-            'TAARICH-MADAD',
-            'TAARICH-ERECH-HAFKADA'
-        ]
-
-        for field in date_fields:
-            value = self._get_text(account_elem, field)
-            if value:
-                return self._format_date(value)
+    def _get_balance_date(self, account_elem, fields: dict[str, Any]) -> str:
+        if fields['balance_date']:
+            return self._format_date(fields['balance_date'])
 
         yitrot_date = account_elem.find('.//BlockItrot//TAARICH-ERECH-TZVIROT')
         if yitrot_date is not None and yitrot_date.text:
@@ -664,9 +1008,18 @@ class PensionFileProcessor:
         return ''
         
     def _get_float(self, elem, tag: str) -> float:
+        text = self._get_text(elem, tag)
+        if not text:
+            return None
+        kind = tag_type(tag)
+        if kind in NUMERIC_KINDS:
+            value = decode_value(tag, text)
+            return float(value) if value is not None else None
+        if kind is not None:
+            # Declared as a code, date or string: not an amount even when it looks like one
+            return None
         try:
-            text = self._get_text(elem, tag)
-            return float(text.replace(',', '')) if text else None
+            return float(text.replace(',', ''))
         except (ValueError, AttributeError):
             return None
 
@@ -681,31 +1034,6 @@ class PensionFileProcessor:
                 return f"{value[:4]}-{value[4:6]}"
         return value
 
-    def _collect_balance_related_fields(self, account_elem) -> dict[str, str]:
-        collected: dict[str, list[str]] = {}
-        explicit_set = set(BALANCE_EXPLICIT_TAGS)
-        for node in account_elem.iter():
-            if not node.text or not node.text.strip():
-                continue
-            tag_upper = node.tag.upper()
-            is_explicit = node.tag in explicit_set
-            has_keyword = any(keyword in tag_upper for keyword in BALANCE_KEYWORDS)
-            if not (is_explicit or has_keyword):
-                continue
-            value = node.text.strip()
-            collected.setdefault(node.tag, []).append(value)
-
-        result: dict[str, str] = {}
-        for tag, values in collected.items():
-            seen = set()
-            unique_values = []
-            for value in values:
-                if value not in seen:
-                    seen.add(value)
-                    unique_values.append(value)
-            result[tag] = ' | '.join(unique_values)
-        return result
-
     def _collect_tagmul_periods(self, account_elem) -> dict[str, float]:
         totals_by_key: dict[tuple[str, str], float] = {key: 0.0 for key in TAGMUL_PERIOD_COLUMNS}
         has_period_data: dict[str, bool] = {'employee': False, 'employer': False}
@@ -755,90 +1083,10 @@ class PensionFileProcessor:
 
         return result
 
-    def _get_start_date(self, account_elem) -> str:
-        date_value = self._get_text(account_elem, 'TAARICH-HITZTARFUT-RISHON')
-        if date_value:
-            return self._format_date(date_value)
-        return ''
-
-    def _get_product_type(self, account_elem) -> str:
-        plan_name_tags = ['SHEM-TOCHNIT', 'TOCHNIT', 'SHEM_TOCHNIT']
-        plan_names: list[str] = []
-        for tag in plan_name_tags:
-            names = self._collect_tag_values(account_elem, tag, include_parents=True)
-            for name in names:
-                normalized = (name or '').strip()
-                if normalized:
-                    plan_names.append(normalized)
-
-        name_type: str | None = None
-        for name in plan_names:
-            name_lower = name.lower()
-            if 'גמל להשקעה' in name or 'קופת גמל להשקעה' in name:
-                name_type = 'גמל להשקעה'
-                break
-            if 'השתלמות' in name:
-                name_type = 'קרן השתלמות'
-                break
-            if 'פנסיה' in name or 'מקפת' in name or 'עתודות' in name:
-                name_type = 'קרן פנסיה'
-                break
-            if 'גמל' in name:
-                name_type = 'קופת גמל'
-                break
-            if 'ביטוח' in name and ('חיים' in name or 'מנהלים' in name or 'מנהל' in name):
-                if 'מקפת' in name or 'פנסיה' in name:
-                    name_type = 'קרן פנסיה'
-                    break
-                name_type = 'פוליסת ביטוח חיים'
-                break
-            if 'חיסכון' in name or 'savings' in name_lower:
-                name_type = 'פוליסת חיסכון טהור'
-                break
-
-        codes = self._collect_tag_values(account_elem, 'SUG-MUTZAR', include_parents=True)
-        if not codes:
-            code = self._get_text(account_elem, 'SUG-MUTZAR')
-            codes = [code] if code else []
-
-        code_type: str | None = None
-        for code in codes:
-            normalized_code = (code or '').strip()
-            if not normalized_code:
-                continue
-            mapped = PRODUCT_TYPE_MAP.get(normalized_code)
-            if mapped:
-                code_type = mapped
-                break
-
-        if code_type and name_type:
-            if code_type == name_type:
-                return code_type
-            if code_type in {
-                'פוליסת ביטוח חיים משולב חיסכון',
-                'פוליסת ביטוח חיים',
-                'פוליסת חיסכון טהור',
-            }:
-                if name_type in {'קרן פנסיה', 'קרן השתלמות'}:
-                    return name_type
-                return code_type
-            return name_type
-
-        if name_type:
-            return name_type
-
-        if code_type:
-            return code_type
-
-        if plan_names:
-            return plan_names[0]
-
-        for code in codes:
-            normalized_code = (code or '').strip()
-            if normalized_code:
-                return normalized_code
-
-        return ''
+    def _get_product_type(self, fields: dict[str, Any]) -> str:
+        plan_names = tuple(name for names in fields['plan_names'].values() for name in names)
+        codes = tuple(fields['product_codes'].get('SUG-MUTZAR', []))
+        return classify_product_type(plan_names, codes)
 
     def _collect_beneficiaries_for_account(
         self,
@@ -877,12 +1125,12 @@ class PensionFileProcessor:
                 row['birth_date'] = self._format_date(birth_raw)
             relation = self._get_text(mutav, 'SUG-ZIKA')
             if relation:
-                row['relation_code'] = relation
+                row['relation_code'] = intern_text(relation)
             if percent:
                 row['percent'] = percent
             definition = self._get_text(mutav, 'HAGDARAT-MUTAV') or self._get_text(mutav, 'MAHUT-MUTAV')
             if definition:
-                row['definition_code'] = definition
+                row['definition_code'] = intern_text(definition)
             results.append(row)
 
         for sheer in account_elem.findall('.//NetuneiSheerim//Sheer'):
@@ -905,24 +1153,64 @@ class PensionFileProcessor:
                 row['birth_date'] = self._format_date(birth_raw)
             relation = self._get_text(sheer, 'SUG-ZIKA')
             if relation:
-                row['relation_code'] = relation
+                row['relation_code'] = intern_text(relation)
             results.append(row)
 
         return results
 
-    def _collect_employer_names(self, account_elem) -> list[str]:
+    def _clean_employer_name(self, value: str) -> str:
+        clean_value = value.strip().strip('"').strip("'")
+        return clean_value.replace(' | ', ' ').strip()
+
+    def _employer_registry(self) -> dict[str, Any]:
+        """Index employer entities once per document, interning names by employer ID."""
+        if self._employers is None:
+            names: dict[str, str] = {}
+            by_product: dict[int, list[str]] = {}
+            for position, employer in enumerate(self.root.iter('YeshutMaasik')):
+                employer_id = next(
+                    (value for value in (self._get_text(employer, tag) for tag in EMPLOYER_ID_TAGS) if value),
+                    f'#{position}'
+                )
+                name = ''
+                for tag in EMPLOYER_NAME_TAGS:
+                    name = self._clean_employer_name(self._get_text(employer, tag))
+                    if name:
+                        break
+                names.setdefault(employer_id, intern_text(name))
+                product = self._enclosing(employer, 'Mutzar')
+                by_product.setdefault(id(product), []).append(employer_id)
+            self._employers = {'names': names, 'by_product': by_product}
+        return self._employers
+
+    def _enclosing(self, elem, tag: str):
+        current = self.parent_map.get(elem)
+        while current is not None and current.tag != tag:
+            current = self.parent_map.get(current)
+        return current if current is not None else self.root
+
+    def _account_employer_ids(self, account_elem, fields: dict[str, Any]) -> list[str]:
+        """Employers referenced by the account, or those of its product when it has no reference."""
+        registry = self._employer_registry()
+        refs = fields['employer_refs'].get(EMPLOYER_REF_TAG)
+        if refs:
+            return [ref for ref in refs if ref in registry['names']]
+        return list(registry['by_product'].get(id(self._enclosing(account_elem, 'Mutzar')), []))
+
+    def _collect_employer_names(self, employer_ids: list[str], fields: dict[str, Any]) -> list[str]:
         names: list[str] = []
         seen: set[str] = set()
+        registry_names = self._employer_registry()['names']
 
-        for tag in EMPLOYER_NAME_TAGS:
-            values = self._collect_tag_values(account_elem, tag, include_parents=True)
-            for value in values:
-                clean_value = value.strip().strip('"').strip("'")
-                clean_value = clean_value.replace(' | ', ' ').strip()
-                if not clean_value or clean_value in seen:
-                    continue
-                seen.add(clean_value)
-                names.append(clean_value)
+        candidates = [registry_names[employer_id] for employer_id in employer_ids]
+        for values in fields['employer_names'].values():
+            candidates.extend(self._clean_employer_name(value) for value in values)
+
+        for clean_value in candidates:
+            if not clean_value or clean_value in seen:
+                continue
+            seen.add(clean_value)
+            names.append(clean_value)
 
         return names
 
@@ -964,123 +1252,696 @@ class PensionFileProcessor:
     def _format_float(self, value: float) -> str:
         return f"{value:.2f}" if value else ''
 
-def process_directory(directory: str, output_file: str = None) -> list:
-    print(f"Scanning directory: {directory}")
-    # Updated to search for both XML and DAT files
+RESULTS_BASENAME = 'pension_results'
+MANIFEST_FILENAME = 'pension_manifest.json'
+PROGRESS_SUFFIX = '.progress.json'
+CHECKPOINT_INTERVAL_SECONDS = 30.0
+REJECTED_DIRNAME = 'rejected'
+REJECTED_LOG_FILENAME = 'rejected.jsonl'
+
+CSV_FIELDNAMES = [
+    'חברה מנהלת',
+    'מספר_חשבון',
+    'שם_תכנית',
+    'יתרה',
+    'תאריך_נכונות_יתרה',
+    'תאריך התחלה',
+    'סוג מוצר',
+    'מעסיקים היסטוריים',
+    'סך תגמולים',
+    'סך פיצויים',
+    'סך רכיבים',
+    'פער יתרה מול רכיבים',
+    'פיצויים מעסקי נוכחי',
+    'פיצויים לאחר התחשבנות',
+    'פיצויים שלא עברו התחשבנות',
+    'פיצויים ממעסיקים קודמים ברצף זכויות',
+    'פיצויים ממעסיקים קודמים ברצף קצבה',
+    *TAGMUL_PERIOD_COLUMNS.values(),
+]
+
+CSV_NUMERIC_FIELDNAMES = {
+    'יתרה',
+    'סך תגמולים',
+    'סך פיצויים',
+    'סך רכיבים',
+    'פער יתרה מול רכיבים',
+    *SEVERANCE_COLUMN_TAGS.keys(),
+    *TAGMUL_PERIOD_COLUMNS.values(),
+}
+
+
+def find_input_files(directory: str) -> list[str]:
+    """Return every XML/DAT file under directory, sorted and without duplicates.
+
+    Files quarantined under the rejected/ subdirectory are skipped.
+    """
     files_to_process = []
     files_to_process.extend(glob.glob(os.path.join(directory, '**/*.xml'), recursive=True))
     files_to_process.extend(glob.glob(os.path.join(directory, '**/*.dat'), recursive=True))
+    rejected_prefix = os.path.join(directory, REJECTED_DIRNAME) + os.sep
+    return sorted(path for path in set(files_to_process) if not path.startswith(rejected_prefix))
+
+
+def read_transfer_header(file_path: str) -> dict[str, str] | None:
+    """Read the KoteretKovetz fields and first account number, stopping before the rest of the file.
+
+    Reading ends with the header block when it carries no transfer identifiers,
+    and otherwise at the first account number or the end of the first product.
+    """
+    header_tags = {tag: key for key, tag in FILE_HEADER_TAGS.items()}
+    info: dict[str, str] = {}
+    try:
+        for _, elem in ET.iterparse(file_path, events=('end',)):
+            if elem.tag in header_tags:
+                info[header_tags[elem.tag]] = (elem.text or '').strip()
+            elif elem.tag == TRANSFER_HEADER_TAG:
+                if not (info.get('transfer_id') or info.get('file_number')):
+                    break
+            elif elem.tag == TRANSFER_PART_TAG:
+                info['first_account'] = (elem.text or '').strip()
+                break
+            elif elem.tag == TRANSFER_PART_SCOPE_TAG:
+                break
+    except (ET.ParseError, OSError) as e:
+        logging.debug("Header pre-pass failed for %s: %s", file_path, e)
+        return None
+    return info
+
+
+def find_superseded_files(file_paths: list[str], headers: dict[str, dict | None] | None = None) -> dict[str, str]:
+    """Map each retransmitted copy to the copy that supersedes it, from file headers alone.
+
+    Copies of one logical transfer share KOD-SHOLEACH, MEZAHE-HAAVARA, MISPAR-HAKOVETZ
+    and first account number; the latest TAARICH-BITZUA is kept, ties going to the
+    first file in order. headers caches read_transfer_header results by path; files
+    missing from it are read and added.
+    """
+    headers = {} if headers is None else headers
+    groups: dict[tuple, list[tuple[str, str]]] = {}
+    for file_path in file_paths:
+        if file_path not in headers:
+            headers[file_path] = read_transfer_header(file_path)
+        info = headers[file_path]
+        if not info or not (info.get('transfer_id') or info.get('file_number')):
+            continue
+        key = tuple(info.get(field, '') for field in TRANSFER_KEY_FIELDS) + (info.get('first_account', ''),)
+        groups.setdefault(key, []).append((info.get('execution_date', ''), file_path))
+
+    superseded: dict[str, str] = {}
+    for copies in groups.values():
+        if len(copies) < 2:
+            continue
+        latest = max(copies, key=lambda copy: copy[0])
+        for copy in copies:
+            if copy is not latest:
+                superseded[copy[1]] = latest[1]
+    return superseded
+
+
+def process_file(file_path: str) -> dict | None:
+    """Worker task: extract one file."""
+    return PensionFileProcessor(file_path).process()
+
+
+def quarantine_file(directory: str, source: str, reason: str) -> str:
+    """Move a rejected file under <directory>/rejected/ and log the reason to rejected.jsonl."""
+    rejected_dir = os.path.join(directory, REJECTED_DIRNAME)
+    target = os.path.join(rejected_dir, source)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(os.path.join(directory, source), target)
+    with open(os.path.join(rejected_dir, REJECTED_LOG_FILENAME), 'a', encoding='utf-8') as f:
+        f.write(json.dumps({
+            'source': source,
+            'reason': reason,
+            'rejected_at': datetime.now().isoformat(),
+        }, ensure_ascii=False))
+        f.write('\n')
+    print(f"  Rejected {source}: {reason}")
+    return target
+
+
+def file_fingerprint(path: str, previous: dict | None = None) -> dict:
+    """Size, mtime and content hash of a file; the hash is reused when size and mtime match."""
+    stat = os.stat(path)
+    if previous and previous.get('size') == stat.st_size and previous.get('mtime') == stat.st_mtime_ns:
+        return previous
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+
+
+def _load_json(path: str, default: Any) -> Any:
+    if not os.path.exists(path):
+        return default
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable {path}: {str(e)}")
+        return default
+
+
+def _write_json_atomic(path: str, data: Any, indent: int | None = None, durable: bool = False) -> None:
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+        if durable:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def flatten_result_rows(result: dict) -> list[dict[str, str]]:
+    """Flatten one file result into CSV rows keyed by CSV_FIELDNAMES."""
+    rows = []
+    for account in result.get('accounts', []):
+        row = {}
+        for field in ['חברה מנהלת', 'מספר_חשבון', 'שם_תכנית', 'יתרה', 'תאריך_נכונות_יתרה']:
+            row[field] = account.get(field, '')
+
+        row['חברה מנהלת'] = account.get('חברה_מנהלת', '')
+
+        severance_components = account.get('רכיבי_פיצויים', {})
+        for column_name in SEVERANCE_COLUMN_TAGS:
+            value = severance_components.get(column_name)
+            if value is not None:
+                row[column_name] = f"{value:.2f}"
+            else:
+                row[column_name] = ''
+        employer_list = account.get('שמות_מעסיקים', [])
+        if isinstance(employer_list, list):
+            row['מעסיקים היסטוריים'] = '.'.join(employer_list)
+        else:
+            row['מעסיקים היסטוריים'] = account.get('מעסיקים_היסטוריים', '')
+        row['תאריך התחלה'] = account.get('תאריך_התחלה', '')
+        row['סוג מוצר'] = account.get('סוג_מוצר', '')
+
+        row['סך תגמולים'] = f"{account.get('סך_תגמולים', 0.0):.2f}"
+        row['סך פיצויים'] = f"{account.get('סך_פיצויים', 0.0):.2f}"
+        row['סך רכיבים'] = f"{account.get('סך_רכיבים', 0.0):.2f}"
+        balance_diff = account.get('פער_יתרה_מול_רכיבים', 0.0)
+        row['פער יתרה מול רכיבים'] = f"{balance_diff:.2f}"
+
+        tagmul_periods = account.get('תגמולים_לפי_תקופה', {})
+        for column_name in TAGMUL_PERIOD_COLUMNS.values():
+            value = tagmul_periods.get(column_name)
+            row[column_name] = f"{value:.2f}" if value is not None and value != 0 else ''
+
+        rows.append({field: row.get(field, '') for field in CSV_FIELDNAMES})
+    return rows
+
+
+def _result_timestamp(result: dict) -> str:
+    """TAARICH-BITZUA of the transfer, or the timestamp in the file name, as YYYYMMDDHHMMSS."""
+    execution_date = (result.get('header') or {}).get('execution_date', '')
+    if execution_date.isdigit():
+        return execution_date.ljust(14, '0')
+    match = FILE_TIMESTAMP_PATTERN.search(result.get('file', ''))
+    return match.group(1).ljust(14, '0') if match else ''
+
+
+def merge_results(results: list[dict]) -> tuple[list[dict], list[dict[str, Any]]]:
+    """Drop accounts reported by more than one file, keeping the freshest copy.
+
+    Accounts are matched on (managing company code, account number) in a single
+    hash-indexed pass. The copy with the latest balance date wins, then the latest
+    transfer timestamp, then the earliest file. Repeats inside one file are separate
+    accounts and are all kept. Returns the results with dropped accounts (and their
+    beneficiaries) removed, plus one conflict record for every dropped copy whose
+    balance or balance date differs from the kept one.
+    """
+    winners: dict[tuple[str, str], tuple[tuple[str, str], int]] = {}
+    for index, result in enumerate(results):
+        timestamp = _result_timestamp(result)
+        for account in result.get('accounts', []):
+            number = account.get('מספר_חשבון', '')
+            if not number or number == 'לא ידוע':
+                continue
+            key = (account.get('קוד_חברה_מנהלת', ''), number)
+            balance_date = account.get('תאריך_נכונות_יתרה', '')
+            freshness = (balance_date if ISO_DATE_PATTERN.match(balance_date) else '', timestamp)
+            current = winners.get(key)
+            if current is None or freshness > current[0]:
+                winners[key] = (freshness, index)
+
+    kept_accounts: dict[tuple[str, str], dict] = {}
+    for index, result in enumerate(results):
+        for account in result.get('accounts', []):
+            key = (account.get('קוד_חברה_מנהלת', ''), account.get('מספר_חשבון', ''))
+            if key in winners and winners[key][1] == index:
+                kept_accounts.setdefault(key, account)
+
+    merged: list[dict] = []
+    conflicts: list[dict[str, Any]] = []
+    for index, result in enumerate(results):
+        accounts = []
+        dropped_numbers = set()
+        for account in result.get('accounts', []):
+            key = (account.get('קוד_חברה_מנהלת', ''), account.get('מספר_חשבון', ''))
+            if key not in winners or winners[key][1] == index:
+                accounts.append(account)
+                continue
+            dropped_numbers.add(key[1])
+            kept = kept_accounts[key]
+            if (
+                abs(kept.get('יתרה', 0.0) - account.get('יתרה', 0.0)) > BALANCE_TOLERANCE
+                or kept.get('תאריך_נכונות_יתרה') != account.get('תאריך_נכונות_יתרה')
+            ):
+                conflicts.append({
+                    'managing_company_code': key[0],
+                    'managing_company': kept.get('חברה_מנהלת', ''),
+                    'account_number': key[1],
+                    'kept_file': results[winners[key][1]].get('file', ''),
+                    'kept_balance': kept.get('יתרה', 0.0),
+                    'kept_balance_date': kept.get('תאריך_נכונות_יתרה', ''),
+                    'dropped_file': result.get('file', ''),
+                    'dropped_balance': account.get('יתרה', 0.0),
+                    'dropped_balance_date': account.get('תאריך_נכונות_יתרה', ''),
+                })
+
+        if not dropped_numbers:
+            merged.append(result)
+            continue
+        merged_result = dict(result)
+        merged_result['accounts'] = accounts
+        kept_numbers = {account.get('מספר_חשבון', '') for account in accounts}
+        merged_result['beneficiaries'] = [
+            beneficiary for beneficiary in result.get('beneficiaries', [])
+            if beneficiary.get('account_number') not in dropped_numbers
+            or beneficiary.get('account_number') in kept_numbers
+        ]
+        merged.append(merged_result)
+    return merged, conflicts
+
+
+class ResultsWriter:
+    """Stream file results to <output_file>.jsonl and their accounts to <output_file>.csv.
+
+    Each result is written as soon as it is available, so memory does not grow
+    with the number of files. Open with append=True to extend existing outputs.
+    """
+
+    def __init__(self, output_file: str, append: bool = False):
+        self.output_file = output_file
+        self.jsonl_file = f"{output_file}.jsonl"
+        self.csv_file = f"{output_file}.csv"
+        mode = 'a' if append else 'w'
+        write_header = not append or not os.path.exists(self.csv_file) or os.path.getsize(self.csv_file) == 0
+        self._jsonl = open(self.jsonl_file, mode, encoding='utf-8')
+        self._csv = open(self.csv_file, mode, encoding='utf-8-sig' if write_header else 'utf-8', newline='')
+        self._writer = csv.DictWriter(self._csv, fieldnames=CSV_FIELDNAMES)
+        if write_header:
+            self._writer.writeheader()
+        self.results_written = 0
+        self.rows_written = 0
+
+    def write(self, result: dict) -> None:
+        self._jsonl.write(json.dumps(result, ensure_ascii=False))
+        self._jsonl.write('\n')
+        rows = flatten_result_rows(result)
+        self._writer.writerows(rows)
+        self.results_written += 1
+        self.rows_written += len(rows)
+
+    def flush(self) -> None:
+        self._jsonl.flush()
+        self._csv.flush()
+
+    def checkpoint(self) -> dict[str, int]:
+        """Flush both outputs to disk and return their durable byte offsets."""
+        offsets = {}
+        for key, handle in (('jsonl', self._jsonl), ('csv', self._csv)):
+            handle.flush()
+            os.fsync(handle.fileno())
+            offsets[key] = os.fstat(handle.fileno()).st_size
+        return offsets
+
+    def close(self) -> None:
+        self._jsonl.close()
+        self._csv.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def iter_results(jsonl_file: str):
+    """Yield stored file results one at a time."""
+    if not os.path.exists(jsonl_file):
+        return
+    with open(jsonl_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def csv_to_excel(csv_file: str, excel_file: str) -> bool:
+    """Convert the streamed CSV to Excel row by row using a write-only workbook."""
+    if Workbook is None:
+        print("openpyxl is not installed; skipping Excel export. Install with 'pip install openpyxl' to enable it.")
+        return False
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet()
+    with open(csv_file, 'r', encoding='utf-8-sig', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return False
+        header_cells = []
+        for title in header:
+            cell = WriteOnlyCell(worksheet, value=title)
+            cell.font = Font(bold=True)
+            header_cells.append(cell)
+        worksheet.append(header_cells)
+
+        numeric_positions = [index for index, title in enumerate(header) if title in CSV_NUMERIC_FIELDNAMES]
+        for row in reader:
+            values: list[Any] = list(row)
+            for index in numeric_positions:
+                if index < len(values) and values[index]:
+                    try:
+                        values[index] = float(values[index])
+                    except ValueError:
+                        pass
+            worksheet.append(values)
+
+    workbook.save(excel_file)
+    return True
+
+
+def _finish_outputs(output_file: str) -> None:
+    print(f"\nResults saved to: {output_file}.jsonl")
+    print(f"CSV results saved to: {output_file}.csv")
+    db_file = os.path.join(os.path.dirname(output_file), RESULTS_DB_FILENAME)
+    with ResultsStore(db_file) as store:
+        store.replace_all(iter_results(f"{output_file}.jsonl"))
+    print(f"SQLite results saved to: {db_file}")
+    if csv_to_excel(f"{output_file}.csv", f"{output_file}.xlsx"):
+        print(f"Excel results saved to: {output_file}.xlsx")
+
+
+def _rewrite_outputs(output_file: str, stored_file: str, dropped: set[str]) -> None:
+    """Rewrite the JSONL and CSV outputs without the results of the dropped sources."""
+    partial_file = f"{output_file}.partial"
+    with ResultsWriter(partial_file) as writer:
+        for result in iter_results(stored_file):
+            if result.get('source', result.get('file')) not in dropped:
+                writer.write(result)
+    for extension in ('jsonl', 'csv'):
+        os.replace(f"{partial_file}.{extension}", f"{output_file}.{extension}")
+
+
+def _recorded_headers(directory: str, manifest: dict[str, dict]) -> dict[str, dict | None]:
+    """Transfer headers kept in the manifest, keyed by file path for find_superseded_files."""
+    return {
+        os.path.join(directory, source): entry['header']
+        for source, entry in manifest.items()
+        if 'header' in entry
+    }
+
+
+def _skip_superseded(
+    directory: str,
+    manifest: dict[str, dict],
+    superseded: dict[str, str],
+    headers: dict[str, dict | None],
+) -> set[str]:
+    """Mark superseded copies in the manifest and return those that had results written before."""
+    dropped = set()
+    for file_path, latest_path in superseded.items():
+        source = os.path.relpath(file_path, directory)
+        latest = os.path.relpath(latest_path, directory)
+        entry = manifest.get(source)
+        if entry is not None and not entry.get('superseded_by'):
+            dropped.add(source)
+        if entry is None or entry.get('superseded_by') != latest:
+            print(f"Skipping {source}: retransmission superseded by {latest}")
+        manifest[source] = dict(entry or file_fingerprint(file_path), header=headers.get(file_path), superseded_by=latest)
+    return dropped
+
+
+def _restore_checkpoint(output_file: str) -> dict | None:
+    """Load the progress record and cut the outputs back to its checkpointed offsets."""
+    progress = _load_json(f"{output_file}{PROGRESS_SUFFIX}", None)
+    if not progress:
+        return None
+    for key, offset in progress.get('offsets', {}).items():
+        path = f"{output_file}.{key}"
+        if not os.path.exists(path) or os.path.getsize(path) < offset:
+            logging.warning(f"Checkpoint does not match {path}; starting a fresh run")
+            return None
+    for key, offset in progress['offsets'].items():
+        # Drop anything written after the last durable checkpoint
+        with open(f"{output_file}.{key}", 'r+b') as f:
+            f.truncate(offset)
+    return progress
+
+
+def process_directory(
+    directory: str,
+    output_file: str = None,
+    resume: bool = False,
+    executor: BatchExecutor | None = None,
+    dedupe_transfers: bool = True,
+) -> list:
+    """Process every file in directory, checkpointing progress so an interrupted run can resume.
+
+    A progress record (pension_results.progress.json) with the completed files and
+    the durable output offsets is written every CHECKPOINT_INTERVAL_SECONDS and on
+    interruption. With resume=True, completed files are skipped and the outputs
+    are continued from the recorded offsets.
+
+    Files run in isolated worker processes; a file that exceeds the executor's
+    time budget or memory ceiling is moved to rejected/ and the batch continues.
+    With dedupe_transfers, retransmitted copies of a transfer are found from their
+    headers and skipped before any worker starts.
+    """
+    print(f"Scanning directory: {directory}")
+    # Updated to search for both XML and DAT files
+    unique_files = find_input_files(directory)
     
-    if not files_to_process:
+    if not unique_files:
         print(f"No XML or DAT files found in {directory} or its subdirectories")
         print("Available files and directories:")
         for item in os.listdir(directory):
             print(f"- {item}")
         return []
     
-    results = []
-    # Process unique files (avoid duplicates if any file matches both patterns)
-    unique_files = list(set(files_to_process))
+    processed = []
+    manifest = {}
+    output_file = os.path.join(directory, RESULTS_BASENAME)
+    progress_file = f"{output_file}{PROGRESS_SUFFIX}"
+
+    progress = _restore_checkpoint(output_file) if resume else None
+    if progress:
+        manifest = progress['manifest']
+        print(f"Resuming: {len(manifest)} files already done")
     print(f"Found {len(unique_files)} files to process...")
 
-    for file_path in unique_files:
-        print(f"\nProcessing {os.path.basename(file_path)}...")
-        processor = PensionFileProcessor(file_path)
-        result = processor.process()
-        if result:
-            results.append(result)
-            print(f"  Found {len(result['accounts'])} accounts")
+    def save_checkpoint(writer: ResultsWriter) -> None:
+        _write_json_atomic(progress_file, {
+            'manifest': manifest,
+            'offsets': writer.checkpoint(),
+            'updated_at': datetime.now().isoformat(),
+        }, durable=True)
+
+    executor = executor or BatchExecutor(process_file)
+    headers = _recorded_headers(directory, manifest)
+    superseded: dict[str, str] = {}
+    dropped: set[str] = set()
+    if dedupe_transfers:
+        # Checkpointed files take part too: a pending copy may supersede one already written
+        superseded = find_superseded_files(unique_files, headers)
+        dropped = _skip_superseded(directory, manifest, superseded, headers)
+        if dropped:
+            _rewrite_outputs(output_file, f"{output_file}.jsonl", dropped)
+    # A copy skipped earlier is processed after all when its replacement has gone
+    done = {source for source, entry in manifest.items() if not entry.get('superseded_by')}
+    pending = [path for path in unique_files if path not in superseded and os.path.relpath(path, directory) not in done]
+
+    with ResultsWriter(output_file, append=progress is not None) as writer:
+        if dropped:
+            # The offsets of the restored checkpoint no longer match the rewritten outputs
+            save_checkpoint(writer)
+        last_checkpoint = time.monotonic()
+        writing = False
+        try:
+            for file_path, result, rejection in executor.run(pending):
+                source = os.path.relpath(file_path, directory)
+                print(f"\nProcessed {os.path.basename(file_path)}")
+                fingerprint = file_fingerprint(file_path)
+                if file_path in headers:
+                    fingerprint['header'] = headers[file_path]
+                if rejection:
+                    # Rejected files leave the directory and stay out of the manifest
+                    quarantine_file(directory, source, rejection)
+                # Output and manifest must advance together for a checkpoint to be consistent
+                writing = True
+                if result:
+                    result['source'] = source
+                    writer.write(result)
+                    processed.append(source)
+                if not rejection:
+                    manifest[source] = fingerprint
+                writing = False
+                if result:
+                    print(f"  Found {len(result['accounts'])} accounts (route: {result['route']})")
+
+                if time.monotonic() - last_checkpoint >= CHECKPOINT_INTERVAL_SECONDS:
+                    save_checkpoint(writer)
+                    last_checkpoint = time.monotonic()
+        except KeyboardInterrupt:
+            if not writing:
+                save_checkpoint(writer)
+            print("\nInterrupted. Run again with --resume to continue from the last checkpoint.")
+            raise
 
     # Save results
-    if results:
-        output_file = os.path.join(directory, 'pension_results')
-
-        # Save as JSON
-        json_file = f"{output_file}.json"
-        with open(json_file, 'w', encoding='utf-8') as f:
-            json.dump(results, f, ensure_ascii=False, indent=2)
-        print(f"\nResults saved to: {json_file}")
-
-        # Prepare flattened rows once for CSV/Excel
-        flattened_rows = []
-        for result in results:
-            for account in result.get('accounts', []):
-                row = {}
-                for field in ['חברה מנהלת', 'מספר_חשבון', 'שם_תכנית', 'יתרה', 'תאריך_נכונות_יתרה']:
-                    row[field] = account.get(field, '')
-
-                row['חברה מנהלת'] = account.get('חברה_מנהלת', '')
-
-                balance_tags = account.get('שדות_פיצויים_תגמולים', {})
-                severance_components = account.get('רכיבי_פיצויים', {})
-                for column_name, tags in SEVERANCE_COLUMN_TAGS.items():
-                    value = severance_components.get(column_name)
-                    if value is not None:
-                        row[column_name] = f"{value:.2f}"
-                    else:
-                        row[column_name] = ''
-                employer_list = account.get('שמות_מעסיקים', [])
-                if isinstance(employer_list, list):
-                    row['מעסיקים היסטוריים'] = '.'.join(employer_list)
-                else:
-                    row['מעסיקים היסטוריים'] = account.get('מעסיקים_היסטוריים', '')
-                row['תאריך התחלה'] = account.get('תאריך_התחלה', '')
-                row['סוג מוצר'] = account.get('סוג_מוצר', '')
-
-                row['סך תגמולים'] = f"{account.get('סך_תגמולים', 0.0):.2f}"
-                row['סך פיצויים'] = f"{account.get('סך_פיצויים', 0.0):.2f}"
-                row['סך רכיבים'] = f"{account.get('סך_רכיבים', 0.0):.2f}"
-                balance_diff = account.get('פער_יתרה_מול_רכיבים', 0.0)
-                row['פער יתרה מול רכיבים'] = f"{balance_diff:.2f}"
-
-                tagmul_periods = account.get('תגמולים_לפי_תקופה', {})
-                for column_name in TAGMUL_PERIOD_COLUMNS.values():
-                    value = tagmul_periods.get(column_name)
-                    row[column_name] = f"{value:.2f}" if value is not None and value != 0 else ''
-
-                flattened_rows.append(row)
-
-        fieldnames = [
-            'חברה מנהלת',
-            'מספר_חשבון',
-            'שם_תכנית',
-            'יתרה',
-            'תאריך_נכונות_יתרה',
-            'תאריך התחלה',
-            'סוג מוצר',
-            'מעסיקים היסטוריים',
-            'סך תגמולים',
-            'סך פיצויים',
-            'סך רכיבים',
-            'פער יתרה מול רכיבים',
-            'פיצויים מעסקי נוכחי',
-            'פיצויים לאחר התחשבנות',
-            'פיצויים שלא עברו התחשבנות',
-            'פיצויים ממעסיקים קודמים ברצף זכויות',
-            'פיצויים ממעסיקים קודמים ברצף קצבה'
+    if os.path.getsize(writer.jsonl_file) > 0:
+        _finish_outputs(output_file)
+    _write_json_atomic(os.path.join(directory, MANIFEST_FILENAME), manifest)
+    if os.path.exists(progress_file):
+        os.remove(progress_file)
+
+    return processed
+
+
+def update_directory(
+    directory: str,
+    executor: BatchExecutor | None = None,
+    dedupe_transfers: bool = True,
+) -> dict[str, list[str]]:
+    """Reprocess only new or changed files and merge them into the persisted results.
+
+    The manifest (pension_manifest.json) records size, mtime and content hash per
+    file; unchanged files are detected from a stat call alone. New results are
+    appended to the JSONL and CSV outputs and stored in SQLite per source; the
+    outputs are only rewritten when an already stored file changed or was removed.
+    The Excel workbook is dropped rather than rebuilt (see export_excel).
+
+    With dedupe_transfers, new and changed files are checked for retransmissions
+    against the transfer headers recorded for every file already in the manifest.
+    """
+    manifest_path = os.path.join(directory, MANIFEST_FILENAME)
+    output_file = os.path.join(directory, RESULTS_BASENAME)
+    manifest = _load_json(manifest_path, None)
+    # Without a manifest the stored results cannot be trusted to match the files
+    stored_file = f"{output_file}.jsonl" if manifest is not None else ''
+    manifest = manifest or {}
+
+    current: dict[str, dict] = {}
+    changed: list[str] = []
+    for file_path in find_input_files(directory):
+        source = os.path.relpath(file_path, directory)
+        previous = manifest.get(source)
+        fingerprint = file_fingerprint(file_path, previous)
+        if previous is None or previous.get('sha256') != fingerprint['sha256']:
+            changed.append(source)
+        elif fingerprint is not previous:
+            # Touched but identical: keep its recorded header and superseded state
+            fingerprint = dict(previous, **fingerprint)
+        current[source] = fingerprint
+    removed = [source for source in manifest if source not in current]
+
+    summary = {'changed': changed, 'removed': removed}
+    if not changed and not removed:
+        if current != manifest:
+            _write_json_atomic(manifest_path, current)
+        return summary
+
+    # Records of changed or removed files already in the outputs have to be cut out first;
+    # files seen for the first time are only appended
+    stored = {source for source, entry in manifest.items() if not entry.get('superseded_by')}
+    replaced = (set(changed) | set(removed)) & stored
+    pending = list(changed)
+    if dedupe_transfers:
+        headers = _recorded_headers(directory, current)
+        superseded = find_superseded_files([os.path.join(directory, source) for source in current], headers)
+        replaced |= _skip_superseded(directory, current, superseded, headers) & stored
+        skipped = {os.path.relpath(path, directory) for path in superseded}
+        # A copy skipped earlier is processed after all when its replacement has gone
+        pending = [
+            source for source in current
+            if source not in skipped and (source in changed or current[source].get('superseded_by'))
         ]
+        for source, entry in current.items():
+            if source not in skipped:
+                entry = {key: value for key, value in entry.items() if key != 'superseded_by'}
+                entry['header'] = headers.get(os.path.join(directory, source))
+                current[source] = entry
+    if stored_file and replaced:
+        _rewrite_outputs(output_file, stored_file, replaced)
+
+    results = []
+    with ResultsWriter(output_file, append=bool(stored_file)) as writer:
+        executor = executor or BatchExecutor(process_file)
+        for file_path, result, rejection in executor.run([os.path.join(directory, source) for source in pending]):
+            source = os.path.relpath(file_path, directory)
+            print(f"Processed {source}")
+            if rejection:
+                quarantine_file(directory, source, rejection)
+                current.pop(source, None)
+            if result:
+                result['source'] = source
+                writer.write(result)
+                results.append(result)
+
+    db_file = os.path.join(directory, RESULTS_DB_FILENAME)
+    with ResultsStore(db_file) as store:
+        if stored_file:
+            store.delete_sources(replaced)
+            store.save_results(results, replace=True)
+        else:
+            store.replace_all(results)
+    # The workbook is a full rebuild; leave it to --excel rather than redo it per change
+    excel_file = f"{output_file}.xlsx"
+    if os.path.exists(excel_file):
+        os.remove(excel_file)
+    _write_json_atomic(manifest_path, current)
+    return summary
+
+
+def export_excel(directory: str) -> bool:
+    """Build the Excel workbook from the current CSV output."""
+    output_file = os.path.join(directory, RESULTS_BASENAME)
+    if not os.path.exists(f"{output_file}.csv"):
+        return False
+    if csv_to_excel(f"{output_file}.csv", f"{output_file}.xlsx"):
+        print(f"Excel results saved to: {output_file}.xlsx")
+        return True
+    return False
+
+
+def watch_directory(
+    directory: str,
+    interval: float = 2.0,
+    executor: BatchExecutor | None = None,
+    excel: bool = False,
+    dedupe_transfers: bool = True,
+) -> None:
+    """Poll the directory and merge new or changed files until interrupted.
+
+    With excel=True the workbook is built once on stop, not after every change.
+    """
+    print(f"Watching {directory} (every {interval:g}s, Ctrl+C to stop)")
+    try:
+        while True:
+            summary = update_directory(directory, executor, dedupe_transfers)
+            if summary['changed'] or summary['removed']:
+                print(f"Updated: {len(summary['changed'])} changed, {len(summary['removed'])} removed")
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+    if excel:
+        export_excel(directory)
 
-        fieldnames.extend(TAGMUL_PERIOD_COLUMNS.values())
-        # Save as CSV
-        csv_file = f"{output_file}.csv"
-        with open(csv_file, 'w', encoding='utf-8-sig', newline='') as f:
-            if flattened_rows:
-                writer = csv.DictWriter(f, fieldnames=fieldnames)
-                writer.writeheader()
-                for row in flattened_rows:
-                    writer.writerow({field: row.get(field, '') for field in fieldnames})
-        print(f"CSV results saved to: {csv_file}")
-
-        # Save as Excel if pandas is available
-        if pd is not None and flattened_rows:
-            excel_file = f"{output_file}.xlsx"
-            df = pd.DataFrame([{field: row.get(field, '') for field in fieldnames} for row in flattened_rows], columns=fieldnames)
-            df.to_excel(excel_file, index=False)
-            print(f"Excel results saved to: {excel_file}")
-        elif pd is None:
-            print("Pandas is not installed; skipping Excel export. Install with 'pip install pandas openpyxl' to enable it.")
-
-    return results
 
 def main():
     # Get the directory where this script is located
@@ -1088,13 +1949,62 @@ def main():
     # Look for XML files in the DATA subdirectory
     data_dir = os.path.join(script_dir, 'DATA')
 
-    if not os.path.exists(data_dir):
-        print(f"Error: The DATA directory was not found at: {data_dir}")
+    parser = argparse.ArgumentParser(description='Extract pension data from clearing-house XML files.')
+    parser.add_argument('directory', nargs='?', default=data_dir, help='directory to scan (default: DATA)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='reprocess only new or changed files and merge them into existing results')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running and merge files as they appear or change')
+    parser.add_argument('--excel', action='store_true',
+                        help='rebuild the Excel workbook after --incremental (or when --watch stops)')
+    parser.add_argument('--interval', type=float, default=2.0, help='polling interval in seconds for --watch')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue an interrupted run from its last checkpoint')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes (default: CPU count)')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIME_BUDGET,
+                        help='seconds allowed per file before it is rejected')
+    parser.add_argument('--max-memory', type=int, default=DEFAULT_MEMORY_LIMIT_MB,
+                        help='memory ceiling per file in MB (0 disables the limit)')
+    parser.add_argument('--max-tasks-per-worker', type=int, default=DEFAULT_MAX_TASKS_PER_WORKER,
+                        help='files a worker processes before it is replaced')
+    parser.add_argument('--keep-retransmissions', action='store_true',
+                        help='process every copy of a retransmitted transfer instead of only the latest')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.directory):
+        print(f"Error: The DATA directory was not found at: {args.directory}")
         print("Please make sure the DATA directory exists and contains your XML or DAT files.")
         return
 
-    print(f"Looking for XML and DAT files in: {data_dir}")
-    process_directory(data_dir)
+    executor = BatchExecutor(
+        process_file,
+        workers=args.workers,
+        time_budget=args.timeout,
+        memory_limit_mb=args.max_memory,
+        max_tasks_per_worker=args.max_tasks_per_worker,
+    )
+    print(f"Looking for XML and DAT files in: {args.directory}")
+    if args.watch:
+        watch_directory(
+            args.directory,
+            args.interval,
+            executor,
+            excel=args.excel,
+            dedupe_transfers=not args.keep_retransmissions,
+        )
+    elif args.incremental:
+        summary = update_directory(args.directory, executor, dedupe_transfers=not args.keep_retransmissions)
+        print(f"{len(summary['changed'])} changed, {len(summary['removed'])} removed")
+        if args.excel:
+            export_excel(args.directory)
+    else:
+        process_directory(
+            args.directory,
+            resume=args.resume,
+            executor=executor,
+            dedupe_transfers=not args.keep_retransmissions,
+        )
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,144 @@
+import os
+import gzip
+import json
+import time
+import secrets
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable
+
+RESULT_SUFFIX = '.json.gz'
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_MEMORY_ENTRIES = 32
+GC_INTERVAL_SECONDS = 10 * 60
+
+
+class ResultCache:
+    """Server-side store for processed uploads, keyed by random result IDs.
+
+    Entries live in a per-process LRU and in gzip-compressed JSON files under
+    directory. The files are the source of truth, so several gunicorn workers
+    can share one directory. Entries are written once and never modified, are
+    owned by the session that created them, and expire after ttl seconds.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        ttl: float = DEFAULT_TTL_SECONDS,
+        memory_entries: int = DEFAULT_MEMORY_ENTRIES,
+        on_expire: Callable[[dict[str, Any]], None] | None = None,
+    ):
+        self.directory = directory
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.on_expire = on_expire
+        self._memory: OrderedDict[str, dict[str, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_gc = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, result_id: str) -> str:
+        return os.path.join(self.directory, f'{result_id}{RESULT_SUFFIX}')
+
+    def _remember(self, result_id: str, entry: dict[str, Any]) -> None:
+        with self._lock:
+            self._memory[result_id] = entry
+            self._memory.move_to_end(result_id)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _expired(self, entry: dict[str, Any], now: float | None = None) -> bool:
+        return (now or time.time()) - entry['created_at'] > self.ttl
+
+    def put(self, owner: str, payload: dict[str, Any]) -> str:
+        """Store payload for owner and return its new result ID."""
+        entry = {'owner': owner, 'created_at': time.time(), 'payload': payload}
+        data = gzip.compress(json.dumps(entry, ensure_ascii=False).encode('utf-8'), compresslevel=6)
+        while True:
+            result_id = secrets.token_urlsafe(16)
+            try:
+                # Exclusive create: an ID is never handed out twice, even across processes
+                with open(self._path(result_id), 'xb') as f:
+                    f.write(data)
+                break
+            except FileExistsError:
+                continue
+        self._remember(result_id, entry)
+        return result_id
+
+    def get(self, result_id: str, owner: str) -> dict[str, Any] | None:
+        """Return the payload stored under result_id if owner created it and it has not expired."""
+        if not result_id or not all(c.isalnum() or c in '-_' for c in result_id):
+            return None
+        with self._lock:
+            entry = self._memory.get(result_id)
+            if entry is not None:
+                self._memory.move_to_end(result_id)
+        if entry is not None and not os.path.exists(self._path(result_id)):
+            # Deleted or expired by another worker: its results-store rows are gone too
+            with self._lock:
+                self._memory.pop(result_id, None)
+            return None
+        if entry is None:
+            entry = self._read(self._path(result_id))
+            if entry is None:
+                return None
+            self._remember(result_id, entry)
+        if entry['owner'] != owner or self._expired(entry):
+            return None
+        return entry['payload']
+
+    def delete(self, result_id: str, owner: str) -> None:
+        payload = self.get(result_id, owner)
+        if payload is None:
+            return
+        self._discard(result_id, payload)
+
+    def _discard(self, result_id: str, payload: dict[str, Any]) -> None:
+        with self._lock:
+            self._memory.pop(result_id, None)
+        try:
+            os.remove(self._path(result_id))
+        except FileNotFoundError:
+            # Another worker got there first
+            return
+        if self.on_expire is not None:
+            self.on_expire(payload)
+
+    def _read(self, path: str) -> dict[str, Any] | None:
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"Discarding unreadable result {path}: {str(e)}")
+            return None
+
+    def collect_garbage(self, force: bool = False) -> int | None:
+        """Remove expired entries and return how many, or None when skipped.
+
+        Runs at most once per GC_INTERVAL_SECONDS unless forced.
+        """
+        now = time.time()
+        if not force and now - self._last_gc < GC_INTERVAL_SECONDS:
+            return None
+        self._last_gc = now
+
+        removed = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(RESULT_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                # Entries are written once, so the file mtime is their creation time
+                if now - os.path.getmtime(path) <= self.ttl:
+                    continue
+            except FileNotFoundError:
+                continue
+            entry = self._read(path)
+            self._discard(name[:-len(RESULT_SUFFIX)], entry['payload'] if entry else {})
+            removed += 1
+        return removed
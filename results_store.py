@@ -0,0 +1,533 @@
+import os
+import re
+import json
+import sqlite3
+from datetime import datetime
+from typing import Any, Iterable, Iterator
+
+RESULTS_DB_FILENAME = 'pension_results.db'
+
+# Files are inserted in chunks so a long batch never holds every row in memory
+INSERT_CHUNK_FILES = 200
+ACCOUNT_BATCH_SIZE = 500
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    client_id TEXT,
+    route TEXT,
+    interface TEXT,
+    xml_version TEXT,
+    product_family TEXT,
+    execution_date TEXT,
+    sender_code TEXT,
+    transfer_id TEXT,
+    file_number TEXT,
+    processed_at TEXT
+);
+-- Highest id ever handed out per table; ids of deleted rows are never reused
+CREATE TABLE IF NOT EXISTS id_sequence (
+    name TEXT PRIMARY KEY,
+    last_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS clients (
+    client_id TEXT PRIMARY KEY,
+    full_name TEXT,
+    birth_date TEXT,
+    details TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS accounts (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    client_id TEXT,
+    account_number TEXT NOT NULL,
+    managing_company TEXT,
+    managing_company_code TEXT,
+    plan_name TEXT,
+    product_type TEXT,
+    start_date TEXT,
+    balance_date TEXT,
+    historical_employers TEXT,
+    raw_fields TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS balances (
+    account_id INTEGER PRIMARY KEY REFERENCES accounts(id) ON DELETE CASCADE,
+    balance REAL NOT NULL,
+    tagmul_total REAL NOT NULL,
+    severance_total REAL NOT NULL,
+    component_total REAL NOT NULL,
+    balance_diff REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tagmul_periods (
+    account_id INTEGER NOT NULL REFERENCES accounts(id) ON DELETE CASCADE,
+    period TEXT NOT NULL,
+    amount REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS severance_components (
+    account_id INTEGER NOT NULL REFERENCES accounts(id) ON DELETE CASCADE,
+    component TEXT NOT NULL,
+    amount REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS beneficiaries (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    client_id TEXT,
+    account_number TEXT,
+    record_type TEXT,
+    id_number TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    birth_date TEXT,
+    relation_code TEXT,
+    details TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS employers (
+    account_id INTEGER NOT NULL REFERENCES accounts(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    employer_id TEXT,
+    name TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS snapshots (
+    client_id TEXT NOT NULL,
+    managing_company_code TEXT NOT NULL,
+    account_number TEXT NOT NULL,
+    snapshot_date TEXT NOT NULL,
+    balance REAL NOT NULL,
+    execution_date TEXT,
+    managing_company TEXT,
+    plan_name TEXT,
+    product_type TEXT,
+    source TEXT,
+    recorded_at TEXT NOT NULL,
+    UNIQUE (client_id, managing_company_code, account_number, snapshot_date)
+);
+CREATE TRIGGER IF NOT EXISTS snapshots_no_update BEFORE UPDATE ON snapshots
+BEGIN SELECT RAISE(ABORT, 'snapshots are append-only'); END;
+CREATE TRIGGER IF NOT EXISTS snapshots_no_delete BEFORE DELETE ON snapshots
+BEGIN SELECT RAISE(ABORT, 'snapshots are append-only'); END;
+
+CREATE INDEX IF NOT EXISTS idx_files_source ON files(source);
+CREATE INDEX IF NOT EXISTS idx_files_client ON files(client_id);
+CREATE INDEX IF NOT EXISTS idx_accounts_file ON accounts(file_id);
+CREATE INDEX IF NOT EXISTS idx_accounts_client ON accounts(client_id);
+CREATE INDEX IF NOT EXISTS idx_accounts_number ON accounts(account_number);
+CREATE INDEX IF NOT EXISTS idx_accounts_company ON accounts(managing_company_code);
+CREATE INDEX IF NOT EXISTS idx_accounts_balance_date ON accounts(balance_date);
+CREATE INDEX IF NOT EXISTS idx_tagmul_account ON tagmul_periods(account_id);
+CREATE INDEX IF NOT EXISTS idx_severance_account ON severance_components(account_id);
+CREATE INDEX IF NOT EXISTS idx_beneficiaries_file ON beneficiaries(file_id);
+CREATE INDEX IF NOT EXISTS idx_beneficiaries_client ON beneficiaries(client_id);
+CREATE INDEX IF NOT EXISTS idx_employers_account ON employers(account_id);
+CREATE INDEX IF NOT EXISTS idx_snapshots_timeline ON snapshots(client_id, account_number, snapshot_date, balance);
+"""
+
+# Raw tag dictionaries kept per account as JSON
+RAW_FIELD_KEYS = ['שדות_חברה_מנהלת', 'שדות_סוג_תוכנית', 'שדות_פיצויים_תגמולים']
+
+BENEFICIARY_COLUMNS = [
+    'account_number',
+    'record_type',
+    'id_number',
+    'first_name',
+    'last_name',
+    'birth_date',
+    'relation_code',
+]
+
+ACCOUNT_FILTERS = {
+    'client_id': 'a.client_id = ?',
+    'account_number': 'a.account_number = ?',
+    'managing_company_code': 'a.managing_company_code = ?',
+    'balance_date_from': 'a.balance_date >= ?',
+    'balance_date_to': 'a.balance_date <= ?',
+}
+
+
+ISO_DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+def snapshot_date(balance_date: str | None, execution_date: str | None) -> str | None:
+    """Date a balance is valid for: TAARICH-NECHONUT when known, else the transfer's TAARICH-BITZUA."""
+    if balance_date and ISO_DATE_PATTERN.match(balance_date):
+        return balance_date
+    if execution_date and len(execution_date) >= 8 and execution_date[:8].isdigit():
+        return f"{execution_date[:4]}-{execution_date[4:6]}-{execution_date[6:8]}"
+    return None
+
+
+def _snapshot_rows(result: dict, recorded_at: str) -> list[tuple]:
+    client_id = (result.get('person_details') or {}).get('id_number')
+    if not client_id:
+        return []
+    header = result.get('header') or {}
+    source = result.get('source', result.get('file', ''))
+    rows = []
+    for account in result.get('accounts', []):
+        as_of = snapshot_date(account.get('תאריך_נכונות_יתרה'), header.get('execution_date'))
+        if not as_of:
+            continue
+        rows.append((
+            client_id,
+            account.get('קוד_חברה_מנהלת') or '',
+            account.get('מספר_חשבון', ''),
+            as_of,
+            account.get('יתרה', 0.0),
+            header.get('execution_date'),
+            account.get('חברה_מנהלת'),
+            account.get('שם_תכנית'),
+            account.get('סוג_מוצר'),
+            source,
+            recorded_at,
+        ))
+    return rows
+
+
+def _in_clause(column: str, values: list) -> tuple[str, list]:
+    return f"{column} IN ({','.join('?' * len(values))})", list(values)
+
+
+class ResultsStore:
+    """Normalized SQLite store for extracted file results.
+
+    Results are written with executemany inside a single transaction per call;
+    accounts and their balances, tagmul periods, severance components and
+    employers are queried back through indexed columns.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.executescript(SCHEMA_SQL)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def save_results(self, results: Iterable[dict], replace: bool = False) -> list[int]:
+        """Insert file results in one transaction and return their file ids in input order.
+
+        With replace=True, rows previously stored for the same source are removed first.
+        """
+        return self._save(results, replace=replace)
+
+    def replace_all(self, results: Iterable[dict]) -> list[int]:
+        """Drop every stored file and store results in their place, in one transaction."""
+        return self._save(results, clear=True)
+
+    def _save(self, results: Iterable[dict], replace: bool = False, clear: bool = False) -> list[int]:
+        file_ids: list[int] = []
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            if clear:
+                self.conn.execute('DELETE FROM files')
+            # Cached exports and stored results refer to files by id, so an id must never
+            # come back after its rows are deleted
+            next_file_id, next_account_id = self.conn.execute(
+                "SELECT MAX((SELECT COALESCE(MAX(id), 0) FROM files), "
+                "COALESCE((SELECT last_id FROM id_sequence WHERE name = 'files'), 0)) + 1, "
+                "MAX((SELECT COALESCE(MAX(id), 0) FROM accounts), "
+                "COALESCE((SELECT last_id FROM id_sequence WHERE name = 'accounts'), 0)) + 1"
+            ).fetchone()
+
+            chunk: list[dict] = []
+            for result in results:
+                chunk.append(result)
+                if len(chunk) >= INSERT_CHUNK_FILES:
+                    next_account_id = self._insert_chunk(chunk, next_file_id, next_account_id, replace)
+                    file_ids.extend(range(next_file_id, next_file_id + len(chunk)))
+                    next_file_id += len(chunk)
+                    chunk = []
+            if chunk:
+                next_account_id = self._insert_chunk(chunk, next_file_id, next_account_id, replace)
+                file_ids.extend(range(next_file_id, next_file_id + len(chunk)))
+                next_file_id += len(chunk)
+            self.conn.executemany(
+                'INSERT INTO id_sequence VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET '
+                'last_id = MAX(last_id, excluded.last_id)',
+                [('files', next_file_id - 1), ('accounts', next_account_id - 1)],
+            )
+        return file_ids
+
+    def add_snapshots(self, results: Iterable[dict]) -> None:
+        """Record balance snapshots for results without storing the results themselves."""
+        recorded_at = datetime.now().isoformat()
+        rows = [row for result in results for row in _snapshot_rows(result, recorded_at)]
+        with self.conn:
+            self.conn.executemany(f"INSERT OR IGNORE INTO snapshots VALUES ({','.join('?' * 11)})", rows)
+
+    def delete_files(self, file_ids: list[int]) -> None:
+        """Remove stored files and every row that belongs to them."""
+        with self.conn:
+            self.conn.executemany('DELETE FROM files WHERE id = ?', [(file_id,) for file_id in file_ids])
+
+    def has_files(self, file_ids: list[int]) -> bool:
+        """Whether every one of file_ids is still stored."""
+        clause, values = _in_clause('id', file_ids)
+        count = self.conn.execute(f'SELECT COUNT(*) FROM files WHERE {clause}', values).fetchone()[0]
+        return count == len(set(file_ids))
+
+    def delete_sources(self, sources: Iterable[str]) -> None:
+        """Remove every stored file recorded under one of sources."""
+        with self.conn:
+            self.conn.executemany('DELETE FROM files WHERE source = ?', [(source,) for source in sources])
+
+    def _insert_chunk(self, results: list[dict], file_id: int, account_id: int, replace: bool) -> int:
+        file_rows, client_rows, account_rows, balance_rows = [], [], [], []
+        tagmul_rows, severance_rows, beneficiary_rows, employer_rows = [], [], [], []
+        snapshot_rows = []
+        recorded_at = datetime.now().isoformat()
+
+        for result in results:
+            source = result.get('source', result.get('file', ''))
+            person = result.get('person_details') or {}
+            client_id = person.get('id_number') or None
+            schema = result.get('schema') or {}
+            header = result.get('header') or {}
+            file_rows.append((
+                file_id,
+                source,
+                result.get('file', os.path.basename(source)),
+                client_id,
+                result.get('route'),
+                schema.get('interface'),
+                schema.get('version'),
+                schema.get('family'),
+                header.get('execution_date'),
+                header.get('sender_code'),
+                header.get('transfer_id'),
+                header.get('file_number'),
+                result.get('processed_at'),
+            ))
+            if client_id:
+                client_rows.append((
+                    client_id,
+                    person.get('full_name'),
+                    person.get('birth_date'),
+                    json.dumps(person, ensure_ascii=False),
+                ))
+
+            for position, account in enumerate(result.get('accounts', [])):
+                account_rows.append((
+                    account_id,
+                    file_id,
+                    position,
+                    client_id,
+                    account.get('מספר_חשבון', ''),
+                    account.get('חברה_מנהלת'),
+                    account.get('קוד_חברה_מנהלת'),
+                    account.get('שם_תכנית'),
+                    account.get('סוג_מוצר'),
+                    account.get('תאריך_התחלה'),
+                    account.get('תאריך_נכונות_יתרה'),
+                    account.get('מעסיקים_היסטוריים', ''),
+                    json.dumps({key: account.get(key, {}) for key in RAW_FIELD_KEYS}, ensure_ascii=False),
+                ))
+                balance_rows.append((
+                    account_id,
+                    account.get('יתרה', 0.0),
+                    account.get('סך_תגמולים', 0.0),
+                    account.get('סך_פיצויים', 0.0),
+                    account.get('סך_רכיבים', 0.0),
+                    account.get('פער_יתרה_מול_רכיבים', 0.0),
+                ))
+                for period, amount in (account.get('תגמולים_לפי_תקופה') or {}).items():
+                    tagmul_rows.append((account_id, period, amount))
+                for component, amount in (account.get('רכיבי_פיצויים') or {}).items():
+                    severance_rows.append((account_id, component, amount))
+
+                names = account.get('שמות_מעסיקים') or []
+                ids = account.get('מזהי_מעסיקים') or []
+                for index, name in enumerate(names):
+                    employer_rows.append((account_id, index, ids[index] if index < len(ids) else None, name))
+                account_id += 1
+
+            snapshot_rows.extend(_snapshot_rows(result, recorded_at))
+            for beneficiary in result.get('beneficiaries', []):
+                beneficiary_rows.append((
+                    file_id,
+                    client_id,
+                    *(beneficiary.get(column) for column in BENEFICIARY_COLUMNS),
+                    json.dumps(beneficiary, ensure_ascii=False),
+                ))
+            file_id += 1
+
+        if replace:
+            self.conn.executemany('DELETE FROM files WHERE source = ?', [(row[1],) for row in file_rows])
+        self.conn.executemany(f"INSERT INTO files VALUES ({','.join('?' * 13)})", file_rows)
+        self.conn.executemany(
+            'INSERT INTO clients VALUES (?, ?, ?, ?) ON CONFLICT(client_id) DO UPDATE SET '
+            'full_name = excluded.full_name, birth_date = excluded.birth_date, details = excluded.details',
+            client_rows,
+        )
+        self.conn.executemany(f"INSERT INTO accounts VALUES ({','.join('?' * 13)})", account_rows)
+        self.conn.executemany('INSERT INTO balances VALUES (?, ?, ?, ?, ?, ?)', balance_rows)
+        self.conn.executemany('INSERT INTO tagmul_periods VALUES (?, ?, ?)', tagmul_rows)
+        self.conn.executemany('INSERT INTO severance_components VALUES (?, ?, ?)', severance_rows)
+        self.conn.executemany(f"INSERT INTO beneficiaries VALUES ({','.join('?' * 10)})", beneficiary_rows)
+        self.conn.executemany('INSERT INTO employers VALUES (?, ?, ?, ?)', employer_rows)
+        # Snapshots outlive the files they came from; re-saving the same transfer adds nothing
+        self.conn.executemany(f"INSERT OR IGNORE INTO snapshots VALUES ({','.join('?' * 11)})", snapshot_rows)
+        return account_id
+
+    def _account_where(self, file_ids: list[int] | None, filters: dict[str, Any]) -> tuple[str, list]:
+        clauses, params = [], []
+        if file_ids is not None:
+            clause, values = _in_clause('a.file_id', file_ids or [0])
+            clauses.append(clause)
+            params.extend(values)
+        for name, value in filters.items():
+            if value is None:
+                continue
+            if name not in ACCOUNT_FILTERS:
+                raise ValueError(f"Unknown account filter: {name}")
+            clauses.append(ACCOUNT_FILTERS[name])
+            params.append(value)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def iter_accounts(self, file_ids: list[int] | None = None, **filters) -> Iterator[dict[str, Any]]:
+        """Yield accounts in the same shape PensionFileProcessor produces, in file and document order.
+
+        Rows are read ACCOUNT_BATCH_SIZE at a time, so memory stays flat however many are selected.
+        """
+        where, params = self._account_where(file_ids, filters)
+        cursor = self.conn.execute(
+            'SELECT a.*, b.balance, b.tagmul_total, b.severance_total, b.component_total, b.balance_diff '
+            f'FROM accounts a JOIN balances b ON b.account_id = a.id{where} ORDER BY a.file_id, a.position',
+            params,
+        )
+        while True:
+            rows = cursor.fetchmany(ACCOUNT_BATCH_SIZE)
+            if not rows:
+                return
+            yield from self._build_accounts(rows)
+
+    def load_accounts(self, file_ids: list[int] | None = None, **filters) -> list[dict[str, Any]]:
+        return list(self.iter_accounts(file_ids, **filters))
+
+    def _build_accounts(self, rows: list[sqlite3.Row]) -> list[dict[str, Any]]:
+        tagmul: dict[int, dict[str, float]] = {}
+        severance: dict[int, dict[str, float]] = {}
+        employers: dict[int, list[sqlite3.Row]] = {}
+        # Child rows are fetched per table for the whole batch rather than per account
+        clause, values = _in_clause('account_id', [row['id'] for row in rows])
+        for row in self.conn.execute(f'SELECT * FROM tagmul_periods WHERE {clause}', values):
+            tagmul.setdefault(row['account_id'], {})[row['period']] = row['amount']
+        for row in self.conn.execute(f'SELECT * FROM severance_components WHERE {clause}', values):
+            severance.setdefault(row['account_id'], {})[row['component']] = row['amount']
+        for row in self.conn.execute(f'SELECT * FROM employers WHERE {clause} ORDER BY position', values):
+            employers.setdefault(row['account_id'], []).append(row)
+
+        accounts = []
+        for row in rows:
+            account_employers = employers.get(row['id'], [])
+            account = {
+                'מספר_חשבון': row['account_number'],
+                'שם_תכנית': row['plan_name'],
+                'חברה_מנהלת': row['managing_company'],
+                'קוד_חברה_מנהלת': row['managing_company_code'],
+                'יתרה': row['balance'],
+                'תאריך_נכונות_יתרה': row['balance_date'],
+                'תאריך_התחלה': row['start_date'],
+                'סוג_מוצר': row['product_type'],
+                'מעסיקים_היסטוריים': row['historical_employers'],
+            }
+            account.update(json.loads(row['raw_fields']))
+            account['תגמולים_לפי_תקופה'] = tagmul.get(row['id'], {})
+            account['רכיבי_פיצויים'] = severance.get(row['id'], {})
+            account['סך_תגמולים'] = row['tagmul_total']
+            account['סך_פיצויים'] = row['severance_total']
+            account['סך_רכיבים'] = row['component_total']
+            account['פער_יתרה_מול_רכיבים'] = row['balance_diff']
+            account['שמות_מעסיקים'] = [employer['name'] for employer in account_employers]
+            account['מזהי_מעסיקים'] = [employer['employer_id'] for employer in account_employers if employer['employer_id']]
+            accounts.append(account)
+        return accounts
+
+    def load_beneficiaries(self, file_ids: list[int] | None = None, client_id: str | None = None) -> list[dict]:
+        clauses, params = [], []
+        if file_ids is not None:
+            clause, values = _in_clause('file_id', file_ids or [0])
+            clauses.append(clause)
+            params.extend(values)
+        if client_id is not None:
+            clauses.append('client_id = ?')
+            params.append(client_id)
+        where = (' WHERE ' + ' AND '.join(clauses)) if clauses else ''
+        rows = self.conn.execute(f'SELECT details FROM beneficiaries{where} ORDER BY file_id, rowid', params)
+        return [json.loads(row['details']) for row in rows]
+
+    def load_clients(self, file_ids: list[int]) -> list[dict[str, str]]:
+        """Details of every client the given files belong to."""
+        clause, values = _in_clause('f.id', file_ids or [0])
+        rows = self.conn.execute(
+            f'SELECT DISTINCT c.client_id, c.details FROM files f JOIN clients c ON c.client_id = f.client_id '
+            f'WHERE {clause} ORDER BY c.client_id',
+            values,
+        )
+        return [json.loads(row['details']) for row in rows]
+
+    def load_client(self, client_id: str) -> dict[str, str]:
+        row = self.conn.execute('SELECT details FROM clients WHERE client_id = ?', (client_id,)).fetchone()
+        return json.loads(row['details']) if row else {}
+
+    def account_totals(self, file_ids: list[int] | None = None, **filters) -> dict[str, Any]:
+        """Sum balances and components with SQL aggregates over the selected accounts."""
+        where, params = self._account_where(file_ids, filters)
+        row = self.conn.execute(
+            'SELECT COUNT(*) AS accounts, SUM(b.balance) AS balance, SUM(b.tagmul_total) AS tagmul_total, '
+            'SUM(b.severance_total) AS severance_total, SUM(b.component_total) AS component_total, '
+            'SUM(b.balance_diff) AS balance_diff '
+            f'FROM accounts a JOIN balances b ON b.account_id = a.id{where}',
+            params,
+        ).fetchone()
+        totals: dict[str, Any] = dict(row)
+        totals['tagmul_periods'] = dict(self.conn.execute(
+            'SELECT t.period, SUM(t.amount) FROM tagmul_periods t JOIN accounts a ON a.id = t.account_id'
+            f'{where} GROUP BY t.period',
+            params,
+        ).fetchall())
+        totals['severance_components'] = dict(self.conn.execute(
+            'SELECT s.component, SUM(s.amount) FROM severance_components s JOIN accounts a ON a.id = s.account_id'
+            f'{where} GROUP BY s.component',
+            params,
+        ).fetchall())
+        return totals
+
+    def balance_timeline(self, client_id: str) -> list[dict[str, Any]]:
+        """Balance history of a client's accounts, one entry per account with points in date order."""
+        rows = self.conn.execute(
+            'SELECT * FROM snapshots WHERE client_id = ? ORDER BY account_number, managing_company_code, snapshot_date',
+            (client_id,),
+        )
+        timeline: dict[tuple[str, str], dict[str, Any]] = {}
+        for row in rows:
+            key = (row['managing_company_code'], row['account_number'])
+            entry = timeline.get(key)
+            if entry is None:
+                entry = timeline[key] = {
+                    'account_number': row['account_number'],
+                    'managing_company_code': row['managing_company_code'],
+                    'points': [],
+                }
+            # Names come from the latest snapshot
+            entry['managing_company'] = row['managing_company']
+            entry['plan_name'] = row['plan_name']
+            entry['product_type'] = row['product_type']
+            entry['points'].append({
+                'date': row['snapshot_date'],
+                'balance': row['balance'],
+                'execution_date': row['execution_date'],
+                'source': row['source'],
+            })
+        return list(timeline.values())
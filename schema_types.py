@@ -0,0 +1,202 @@
+import os
+import re
+import glob
+import json
+import logging
+from typing import Any
+import xml.etree.ElementTree as ET
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SCHEMA_DIR = os.path.join(BASE_DIR, 'הנחיות')
+TYPE_TABLE_FILE = os.path.join(BASE_DIR, 'schema_types.json')
+
+XSD_NS = '{http://www.w3.org/2001/XMLSchema}'
+
+# Value kinds derived from the XSD restriction of each element
+NUMERIC_KINDS = {'decimal', 'int'}
+
+DATE_PATTERN_PREFIX = '([0-9]\\d{3}((0[1-9]|1[012])'
+MONTH_PATTERN_PREFIX = '(((1[0-9]\\d{2})|(2[0-9]\\d{2}))(0[1-9]|1[0-2]))'
+
+CODE_LABEL_PATTERN = re.compile(r'(\d+)\s*=\s*(.+?)(?=\s+\d+\s*=|$)', re.S)
+
+_type_table: dict[str, dict[str, Any]] | None = None
+
+
+def _classify_restriction(restriction) -> str:
+    base = (restriction.get('base') or '').replace('xsd:', '')
+    enumerations = restriction.findall(f'{XSD_NS}enumeration')
+    pattern = restriction.find(f'{XSD_NS}pattern')
+    pattern_value = pattern.get('value', '') if pattern is not None else ''
+
+    if enumerations:
+        return 'code'
+    if base == 'decimal':
+        return 'decimal'
+    if base == 'int':
+        return 'int'
+    if base == 'date':
+        return 'date'
+    if DATE_PATTERN_PREFIX in pattern_value:
+        return 'date'
+    if pattern_value.startswith(MONTH_PATTERN_PREFIX):
+        return 'month'
+    return 'string'
+
+
+def _parse_code_labels(element, codes: list[str]) -> dict[str, str]:
+    documentation = element.find(f'{XSD_NS}annotation/{XSD_NS}documentation')
+    if documentation is None or not documentation.text:
+        return {}
+    text = ' '.join(documentation.text.split())
+    labels = {code: label.strip(' .,;') for code, label in CODE_LABEL_PATTERN.findall(text)}
+    return {code: labels[code] for code in codes if labels.get(code)}
+
+
+def _merge_entry(table: dict[str, dict[str, Any]], tag: str, entry: dict[str, Any]) -> None:
+    existing = table.get(tag)
+    if existing is None:
+        table[tag] = entry
+        return
+
+    if existing['type'] != entry['type']:
+        # Same tag declared with different kinds in different contexts: keep it textual
+        kinds = {existing['type'], entry['type']}
+        existing['type'] = 'decimal' if kinds <= NUMERIC_KINDS else 'string'
+        existing.pop('codes', None)
+        existing.pop('labels', None)
+        return
+
+    if existing['type'] == 'code':
+        existing['codes'] = sorted(set(existing['codes']) | set(entry['codes']), key=lambda c: (len(c), c))
+        if existing.get('labels') is not None:
+            merged = dict(existing['labels'])
+            for code, label in entry.get('labels', {}).items():
+                if merged.setdefault(code, label) != label:
+                    # Conflicting meanings for the same code: labels are ambiguous by tag
+                    existing['labels'] = None
+                    return
+            existing['labels'] = merged
+
+
+def compile_schema_types(schema_dir: str = SCHEMA_DIR) -> dict[str, dict[str, Any]]:
+    """Compile every XSD under schema_dir into a tag -> {'type', 'codes', 'labels'} table."""
+    table: dict[str, dict[str, Any]] = {}
+    schema_files = sorted(
+        glob.glob(os.path.join(schema_dir, '**', '*.xsd'), recursive=True)
+        + glob.glob(os.path.join(schema_dir, '**', '*.XSD'), recursive=True)
+    )
+    for schema_file in schema_files:
+        try:
+            root = ET.parse(schema_file).getroot()
+        except ET.ParseError as e:
+            logging.warning(f"Skipping unreadable schema {schema_file}: {str(e)}")
+            continue
+
+        for element in root.iter(f'{XSD_NS}element'):
+            tag = element.get('name')
+            restriction = element.find(f'{XSD_NS}simpleType/{XSD_NS}restriction')
+            if not tag or restriction is None:
+                continue
+            entry: dict[str, Any] = {'type': _classify_restriction(restriction)}
+            if entry['type'] == 'code':
+                codes = [enum.get('value') for enum in restriction.findall(f'{XSD_NS}enumeration')]
+                entry['codes'] = codes
+                entry['labels'] = _parse_code_labels(element, codes)
+            _merge_entry(table, tag, entry)
+
+    return table
+
+
+def _schema_files_mtime(schema_dir: str) -> float:
+    mtimes = [
+        os.path.getmtime(path)
+        for path in glob.glob(os.path.join(schema_dir, '**', '*.*'), recursive=True)
+        if path.lower().endswith('.xsd')
+    ]
+    return max(mtimes, default=0.0)
+
+
+def build_type_table(schema_dir: str = SCHEMA_DIR, cache_file: str = TYPE_TABLE_FILE) -> dict[str, dict[str, Any]]:
+    """Compile the XSDs and write the cached type table.
+
+    The table is written to a temporary file and moved into place, so a process
+    loading the cache concurrently never reads a partial file.
+    """
+    table = compile_schema_types(schema_dir)
+    temp_path = f'{cache_file}.{os.getpid()}.tmp'
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(table, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(temp_path, cache_file)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return table
+
+
+def load_type_table(schema_dir: str = SCHEMA_DIR, cache_file: str = TYPE_TABLE_FILE) -> dict[str, dict[str, Any]]:
+    """Return the tag type table, rebuilding the cache when the XSDs are newer."""
+    global _type_table
+    if _type_table is not None:
+        return _type_table
+
+    table: dict[str, dict[str, Any]] = {}
+    try:
+        schema_mtime = _schema_files_mtime(schema_dir)
+        if os.path.exists(cache_file) and os.path.getmtime(cache_file) >= schema_mtime:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                table = json.load(f)
+        elif schema_mtime:
+            table = build_type_table(schema_dir, cache_file)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Unable to load schema type table: {str(e)}")
+
+    _type_table = table
+    return table
+
+
+def tag_type(tag: str) -> str | None:
+    """Declared kind of a tag ('decimal', 'int', 'code', 'date', 'month', 'string'), or None."""
+    entry = load_type_table().get(tag)
+    return entry['type'] if entry else None
+
+
+def code_label(tag: str, code: str) -> str:
+    entry = load_type_table().get(tag)
+    if not entry or not entry.get('labels'):
+        return ''
+    return entry['labels'].get(code, '')
+
+
+def decode_value(tag: str, text: str | None) -> Any:
+    """Convert a raw element value according to the tag's declared type.
+
+    Numeric kinds return float/int (None when the value does not parse), dates
+    return 'YYYY-MM-DD' / 'YYYY-MM' strings, codes and strings return the
+    stripped text. Tags missing from the schema are returned as stripped text.
+    """
+    if text is None:
+        return None
+    value = text.strip()
+    kind = tag_type(tag)
+    if kind == 'decimal':
+        try:
+            return float(value.replace(',', '')) if value else None
+        except ValueError:
+            return None
+    if kind == 'int':
+        try:
+            return int(value) if value else None
+        except ValueError:
+            return None
+    if kind == 'date' and len(value) == 8 and value.isdigit():
+        return f"{value[:4]}-{value[4:6]}-{value[6:]}"
+    if kind == 'month' and len(value) == 6 and value.isdigit():
+        return f"{value[:4]}-{value[4:6]}"
+    return value
+
+
+if __name__ == '__main__':
+    compiled = build_type_table()
+    print(f"Compiled {len(compiled)} element types to {TYPE_TABLE_FILE}")
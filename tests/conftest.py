@@ -0,0 +1,8 @@
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UPLOADS_DIR = os.path.join(REPO_DIR, 'uploads')
+
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
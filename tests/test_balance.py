@@ -0,0 +1,72 @@
+import os
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from conftest import UPLOADS_DIR
+from process_pensions import PensionFileProcessor
+
+
+def find_balance(xml: str) -> float:
+    return PensionFileProcessor('unused.xml')._find_balance(ET.fromstring(xml))
+
+
+def test_tracks_in_block_itrot_are_summed():
+    xml = '''<HeshbonOPolisa>
+        <BlockItrot>
+            <PerutYitrot><TOTAL-CHISACHON-MTZBR>100.25</TOTAL-CHISACHON-MTZBR></PerutYitrot>
+            <PerutYitrot><TOTAL-ERKEI-PIDION>50</TOTAL-ERKEI-PIDION></PerutYitrot>
+        </BlockItrot>
+        <YITRAT-KASPEY-TAGMULIM>999</YITRAT-KASPEY-TAGMULIM>
+    </HeshbonOPolisa>'''
+    assert find_balance(xml) == pytest.approx(150.25)
+
+
+def test_zero_block_itrot_is_a_zero_balance():
+    xml = '''<HeshbonOPolisa>
+        <BlockItrot><PerutYitrot><TOTAL-CHISACHON-MTZBR>0</TOTAL-CHISACHON-MTZBR></PerutYitrot></BlockItrot>
+        <YITRAT-KASPEY-TAGMULIM>999</YITRAT-KASPEY-TAGMULIM>
+    </HeshbonOPolisa>'''
+    assert find_balance(xml) == 0.0
+
+
+def test_investment_tracks_used_without_block_itrot():
+    xml = '''<HeshbonOPolisa>
+        <PerutMasluleiHashkaa><SCHUM-TZVIRA-BAMASLUL>70</SCHUM-TZVIRA-BAMASLUL></PerutMasluleiHashkaa>
+        <PerutMasluleiHashkaa><SCHUM-TZVIRA-BAMASLUL>30</SCHUM-TZVIRA-BAMASLUL></PerutMasluleiHashkaa>
+    </HeshbonOPolisa>'''
+    assert find_balance(xml) == pytest.approx(100.0)
+
+
+def test_end_of_year_balance_used_next():
+    xml = '''<HeshbonOPolisa>
+        <PerutYitrotLesofShanaKodemet><YITRAT-SOF-SHANA>1234.5</YITRAT-SOF-SHANA></PerutYitrotLesofShanaKodemet>
+    </HeshbonOPolisa>'''
+    assert find_balance(xml) == pytest.approx(1234.5)
+
+
+def test_generic_balance_field_on_the_account():
+    xml = '<HeshbonOPolisa><YITRAT-KASPEY-TAGMULIM>4321</YITRAT-KASPEY-TAGMULIM></HeshbonOPolisa>'
+    assert find_balance(xml) == pytest.approx(4321.0)
+
+
+def test_sum_insured_is_not_a_balance():
+    xml = '''<HeshbonOPolisa>
+        <TAARICH-HITZTARFUT-RISHON>20181101</TAARICH-HITZTARFUT-RISHON>
+        <Kisui>
+            <SCHUM-BITUACH>254000</SCHUM-BITUACH>
+            <SCHUM-BITUAH-LEMAVET>375445</SCHUM-BITUAH-LEMAVET>
+            <ALUT-KISUI>227.5</ALUT-KISUI>
+        </Kisui>
+    </HeshbonOPolisa>'''
+    assert find_balance(xml) == 0.0
+
+
+@pytest.mark.parametrize('filename, account_number', [
+    ('SwiftNess_51678241_520004078_INK_201811132020_4.xml', '898759822'),
+    ('SwiftNess_51678241_512304882_INP_201811132020_1.xml', '70052485817'),
+])
+def test_risk_only_policies_report_no_balance(filename, account_number):
+    result = PensionFileProcessor(os.path.join(UPLOADS_DIR, filename)).process()
+    balances = {account['מספר_חשבון']: account['יתרה'] for account in result['accounts']}
+    assert balances[account_number] == 0.0
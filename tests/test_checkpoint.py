@@ -0,0 +1,82 @@
+import json
+import os
+import shutil
+
+import pytest
+
+from conftest import UPLOADS_DIR
+from process_pensions import (
+    PROGRESS_SUFFIX,
+    RESULTS_BASENAME,
+    _restore_checkpoint,
+    iter_results,
+    process_directory,
+    process_file,
+)
+
+SAMPLE_FILE = os.path.join(UPLOADS_DIR, 'SwiftNess_51678241_512227265_KGM_201811132020_7.xml')
+OTHER_FILE = os.path.join(UPLOADS_DIR, 'SwiftNess_51678241_512227265_KGM_201811132020_8.xml')
+
+
+class InterruptingExecutor:
+    """Runs process_file in this process, interrupted after stop_after files."""
+
+    def __init__(self, stop_after=None):
+        self.stop_after = stop_after
+        self.processed = []
+
+    def run(self, file_paths):
+        for file_path in file_paths:
+            if len(self.processed) == self.stop_after:
+                raise KeyboardInterrupt
+            self.processed.append(os.path.basename(file_path))
+            yield file_path, process_file(file_path), None
+
+
+def write_outputs(tmp_path, offsets, contents):
+    output_file = str(tmp_path / RESULTS_BASENAME)
+    for key, data in contents.items():
+        with open(f'{output_file}.{key}', 'wb') as f:
+            f.write(data)
+    with open(f'{output_file}{PROGRESS_SUFFIX}', 'w', encoding='utf-8') as f:
+        json.dump({'manifest': {'a.xml': {}}, 'offsets': offsets}, f)
+    return output_file
+
+
+def test_outputs_are_cut_back_to_the_checkpoint(tmp_path):
+    output_file = write_outputs(
+        tmp_path,
+        {'jsonl': 6, 'csv': 4},
+        {'jsonl': b'{"a"}\n{"partial', 'csv': b'h\nr\nhalf-row'},
+    )
+    progress = _restore_checkpoint(output_file)
+    assert progress['manifest'] == {'a.xml': {}}
+    with open(f'{output_file}.jsonl', 'rb') as f:
+        assert f.read() == b'{"a"}\n'
+    with open(f'{output_file}.csv', 'rb') as f:
+        assert f.read() == b'h\nr\n'
+
+
+def test_outputs_shorter_than_the_checkpoint_start_a_fresh_run(tmp_path):
+    output_file = write_outputs(tmp_path, {'jsonl': 6, 'csv': 40}, {'jsonl': b'{"a"}\n{"b"}\n', 'csv': b'h\n'})
+    assert _restore_checkpoint(output_file) is None
+    with open(f'{output_file}.jsonl', 'rb') as f:
+        assert f.read() == b'{"a"}\n{"b"}\n'
+
+
+def test_missing_progress_record_is_no_checkpoint(tmp_path):
+    assert _restore_checkpoint(str(tmp_path / RESULTS_BASENAME)) is None
+
+
+def test_resume_continues_after_an_interruption(tmp_path):
+    shutil.copy(SAMPLE_FILE, tmp_path / 'a.xml')
+    shutil.copy(OTHER_FILE, tmp_path / 'b.xml')
+    with pytest.raises(KeyboardInterrupt):
+        process_directory(str(tmp_path), executor=InterruptingExecutor(stop_after=1), dedupe_transfers=False)
+    assert os.path.exists(tmp_path / f'{RESULTS_BASENAME}{PROGRESS_SUFFIX}')
+
+    executor = InterruptingExecutor()
+    process_directory(str(tmp_path), resume=True, executor=executor, dedupe_transfers=False)
+    assert executor.processed == ['b.xml']
+    sources = [result['source'] for result in iter_results(str(tmp_path / f'{RESULTS_BASENAME}.jsonl'))]
+    assert sources == ['a.xml', 'b.xml']
@@ -0,0 +1,57 @@
+import glob
+import os
+from io import BytesIO
+
+import pytest
+from openpyxl import load_workbook
+
+import app as app_module
+from conftest import UPLOADS_DIR
+from process_pensions import process_file
+from results_store import ResultsStore
+
+SHEETS = ['נתוני פנסיה', 'מוטבים', 'פרטי לקוח', 'שדות יתרה גולמיים', 'התאמת יתרות']
+
+
+@pytest.fixture
+def stored(tmp_path):
+    results = [process_file(path) for path in sorted(glob.glob(os.path.join(UPLOADS_DIR, 'SwiftNess_*_ING_*.xml')))]
+    with ResultsStore(str(tmp_path / 'results.db')) as store:
+        file_ids = store.save_results(results)
+        workbook = app_module.build_export_workbook(store, file_ids, 'hash')
+    return results, load_workbook(BytesIO(workbook))
+
+
+def data_rows(sheet):
+    return list(sheet.iter_rows(min_row=2, values_only=True))
+
+
+def test_every_sheet_is_written(stored):
+    results, workbook = stored
+    assert workbook.sheetnames == SHEETS
+    assert workbook.properties.identifier == 'hash'
+    accounts = [account for result in results for account in result['accounts']]
+
+    sheet = workbook['נתוני פנסיה']
+    assert [cell.value for cell in sheet[1]] == app_module.TABLE_COLUMNS
+    assert sheet.sheet_view.rightToLeft and sheet.freeze_panes == 'A2'
+    rows = data_rows(sheet)
+    balance = app_module.TABLE_COLUMNS.index('יתרה')
+    assert [row[balance] for row in rows] == pytest.approx([account['יתרה'] for account in accounts])
+    assert sheet.cell(row=2, column=balance + 1).number_format == app_module.NUMBER_FORMAT
+
+    beneficiaries = [beneficiary for result in results for beneficiary in result['beneficiaries']]
+    assert beneficiaries
+    id_column = list(app_module.BENEFICIARY_EXPORT_COLUMNS).index('id_number')
+    assert [row[id_column] for row in data_rows(workbook['מוטבים'])] == [b.get('id_number') for b in beneficiaries]
+
+    client = dict(data_rows(workbook['פרטי לקוח']))
+    assert client['מספר תעודת זהות'] == results[0]['person_details']['id_number']
+
+    raw_fields = sum(len(account.get(group) or {}) for account in accounts for group in app_module.RAW_FIELD_GROUPS)
+    assert len(data_rows(workbook['שדות יתרה גולמיים'])) == raw_fields
+
+    differences = [account['פער_יתרה_מול_רכיבים'] for account in accounts if account['פער_יתרה_מול_רכיבים']]
+    assert differences
+    diff_column = list(app_module.RECONCILIATION_COLUMNS).index('פער_יתרה_מול_רכיבים')
+    assert [row[diff_column] for row in data_rows(workbook['התאמת יתרות'])] == pytest.approx(differences)
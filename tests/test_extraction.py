@@ -0,0 +1,115 @@
+import json
+import os
+import shutil
+
+from conftest import UPLOADS_DIR
+from process_pensions import ACCOUNT_FIELD_DISPATCH, dispatch_entries, process_file
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+HOLDINGS_FILE = os.path.join(UPLOADS_DIR, '51683845_512065202_KGM_202502051310_1.xml')
+# Accounts extracted from this file by the hand-written fallback chains the dispatch
+# table replaced, without the employer fields that are now scoped per account
+REFERENCE_FILE = '51683845_512244146_KGM_202502051310_2.xml'
+EMPLOYER_FIELDS = {'מעסיקים_היסטוריים', 'מזהי_מעסיקים', 'שמות_מעסיקים'}
+
+GENERIC_LAYOUT = '''<Mimshak>
+  <KoteretKovetz><SUG-MIMSHAK>1</SUG-MIMSHAK><MISPAR-GIRSAT-XML>008</MISPAR-GIRSAT-XML></KoteretKovetz>
+  <Accounts>
+    <Heshbon><MISPAR-POLISA-O-HESHBON>777</MISPAR-POLISA-O-HESHBON><TOTAL-CHISACHON-MTZBR>1500.25</TOTAL-CHISACHON-MTZBR></Heshbon>
+  </Accounts>
+</Mimshak>'''
+
+EMPLOYER_LAYOUT = '''<Mimshak>
+  <KoteretKovetz><SUG-MIMSHAK>1</SUG-MIMSHAK><MISPAR-GIRSAT-XML>008</MISPAR-GIRSAT-XML></KoteretKovetz>
+  <YeshutYatzran><Mutzarim>
+    <Mutzar>
+      <NetuneiMutzar>
+        <YeshutMaasik><MPR-MAASIK-BE-YATZRAN>1</MPR-MAASIK-BE-YATZRAN><SHEM-MAASIK>Alpha</SHEM-MAASIK></YeshutMaasik>
+        <YeshutMaasik><MPR-MAASIK-BE-YATZRAN>2</MPR-MAASIK-BE-YATZRAN><SHEM-MAASIK>Beta</SHEM-MAASIK></YeshutMaasik>
+      </NetuneiMutzar>
+      <HeshbonotOPolisot>
+        <HeshbonOPolisa><MISPAR-POLISA-O-HESHBON>A1</MISPAR-POLISA-O-HESHBON>
+          <PirteiHaasaka><MPR-MAASIK-BE-YATZRAN>1</MPR-MAASIK-BE-YATZRAN></PirteiHaasaka></HeshbonOPolisa>
+        <HeshbonOPolisa><MISPAR-POLISA-O-HESHBON>A2</MISPAR-POLISA-O-HESHBON>
+          <PirteiHaasaka><MPR-MAASIK-BE-YATZRAN>2</MPR-MAASIK-BE-YATZRAN></PirteiHaasaka></HeshbonOPolisa>
+      </HeshbonotOPolisot>
+    </Mutzar>
+    <Mutzar>
+      <NetuneiMutzar>
+        <YeshutMaasik><MPR-MAASIK-BE-YATZRAN>3</MPR-MAASIK-BE-YATZRAN><SHEM-MAASIK>Gamma</SHEM-MAASIK></YeshutMaasik>
+      </NetuneiMutzar>
+      <HeshbonotOPolisot>
+        <HeshbonOPolisa><MISPAR-POLISA-O-HESHBON>B1</MISPAR-POLISA-O-HESHBON></HeshbonOPolisa>
+      </HeshbonotOPolisot>
+    </Mutzar>
+  </Mutzarim></YeshutYatzran>
+</Mimshak>'''
+
+
+def account_numbers(result):
+    return [account['מספר_חשבון'] for account in result['accounts']]
+
+
+def test_known_variant_takes_the_holdings_route():
+    result = process_file(HOLDINGS_FILE)
+    assert result['route'] == 'holdings'
+    assert result['schema'] == {'interface': '2', 'version': '008', 'family': 'KGM'}
+
+
+def test_unknown_family_takes_the_generic_route_to_the_same_accounts(tmp_path):
+    unknown = shutil.copy(HOLDINGS_FILE, tmp_path / '51683845_512065202_XYZ_202502051310_1.xml')
+    result = process_file(str(unknown))
+    assert result['route'] == 'generic'
+    assert result['schema']['family'] == 'XYZ'
+    assert account_numbers(result) == account_numbers(process_file(HOLDINGS_FILE))
+
+
+def test_known_variant_without_the_fixed_path_falls_back_to_generic(tmp_path):
+    path = tmp_path / '1_2_KGM_202401010000_1.xml'
+    path.write_text(GENERIC_LAYOUT, encoding='utf-8')
+    result = process_file(str(path))
+    assert result['route'] == 'generic'
+    assert result['schema'] == {'interface': '1', 'version': '008', 'family': 'KGM'}
+    assert account_numbers(result) == ['777']
+
+
+def test_dispatch_table_matches_the_fallback_chains():
+    with open(os.path.join(DATA_DIR, REFERENCE_FILE.replace('.xml', '.accounts.json')), encoding='utf-8') as f:
+        expected = json.load(f)['accounts']
+    accounts = process_file(os.path.join(UPLOADS_DIR, REFERENCE_FILE))['accounts']
+    assert [{key: value for key, value in account.items() if key not in EMPLOYER_FIELDS} for account in accounts] == expected
+
+
+def test_first_listed_tag_wins_regardless_of_document_order(tmp_path):
+    path = tmp_path / 'priority.xml'
+    path.write_text(GENERIC_LAYOUT.replace(
+        '<MISPAR-POLISA-O-HESHBON>',
+        '<MISPAR-POLISA>999</MISPAR-POLISA><MISPAR-POLISA-O-HESHBON>',
+    ), encoding='utf-8')
+    assert account_numbers(process_file(str(path))) == ['777']
+
+
+def test_keyword_tags_are_resolved_once_into_the_table():
+    tag = 'SCHUM-TAGMULIM-BDIKA'
+    assert tag not in ACCOUNT_FIELD_DISPATCH['dispatch']
+    entries = dispatch_entries(ACCOUNT_FIELD_DISPATCH, tag)
+    assert [field for field, _, _ in entries] == ['balance_fields']
+    assert ACCOUNT_FIELD_DISPATCH['dispatch'][tag] is entries
+
+
+def test_employers_are_scoped_to_each_account(tmp_path):
+    path = tmp_path / '1_2_KGM_202401010000_1.xml'
+    path.write_text(EMPLOYER_LAYOUT, encoding='utf-8')
+    result = process_file(str(path))
+    assert result['route'] == 'holdings'
+    employers = {
+        account['מספר_חשבון']: (account['מזהי_מעסיקים'], account['שמות_מעסיקים'])
+        for account in result['accounts']
+    }
+    # Referenced employers only; an account without references gets its product's employers
+    assert employers == {
+        'A1': (['1'], ['Alpha']),
+        'A2': (['2'], ['Beta']),
+        'B1': (['3'], ['Gamma']),
+    }
+    assert result['employers'] == {'1': 'Alpha', '2': 'Beta', '3': 'Gamma'}
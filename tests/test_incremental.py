@@ -0,0 +1,105 @@
+import json
+import os
+import shutil
+
+import process_pensions
+from conftest import UPLOADS_DIR
+from process_pensions import (
+    MANIFEST_FILENAME,
+    RESULTS_BASENAME,
+    iter_results,
+    process_file,
+    update_directory,
+    watch_directory,
+)
+from results_store import RESULTS_DB_FILENAME, ResultsStore
+
+SAMPLE_FILE = os.path.join(UPLOADS_DIR, 'SwiftNess_51678241_512227265_KGM_201811132020_7.xml')
+OTHER_FILE = os.path.join(UPLOADS_DIR, 'SwiftNess_51678241_512227265_KGM_201811132020_8.xml')
+
+
+class RecordingExecutor:
+    """Runs process_file in this process and records which files it was given."""
+
+    def __init__(self):
+        self.processed = []
+
+    def run(self, file_paths):
+        for file_path in file_paths:
+            self.processed.append(os.path.basename(file_path))
+            yield file_path, process_file(file_path), None
+
+
+def update(directory):
+    executor = RecordingExecutor()
+    summary = update_directory(str(directory), executor, dedupe_transfers=False)
+    return summary, sorted(executor.processed)
+
+
+def stored_sources(directory):
+    jsonl_sources = sorted(result['source'] for result in iter_results(os.path.join(directory, f'{RESULTS_BASENAME}.jsonl')))
+    with ResultsStore(os.path.join(directory, RESULTS_DB_FILENAME)) as store:
+        db_sources = sorted(row[0] for row in store.conn.execute('SELECT source FROM files'))
+    assert jsonl_sources == db_sources
+    return jsonl_sources
+
+
+def test_only_new_and_changed_files_are_reprocessed(tmp_path):
+    shutil.copy(SAMPLE_FILE, tmp_path / 'a.xml')
+    assert update(tmp_path) == ({'changed': ['a.xml'], 'removed': []}, ['a.xml'])
+
+    shutil.copy(OTHER_FILE, tmp_path / 'b.xml')
+    assert update(tmp_path) == ({'changed': ['b.xml'], 'removed': []}, ['b.xml'])
+    assert stored_sources(tmp_path) == ['a.xml', 'b.xml']
+
+    assert update(tmp_path) == ({'changed': [], 'removed': []}, [])
+
+    with open(tmp_path / 'a.xml', 'a', encoding='utf-8') as f:
+        f.write('\n<!-- resent -->\n')
+    assert update(tmp_path) == ({'changed': ['a.xml'], 'removed': []}, ['a.xml'])
+    # The changed file replaces its earlier record instead of adding a second one
+    assert stored_sources(tmp_path) == ['a.xml', 'b.xml']
+
+
+def test_touched_but_identical_file_is_not_reprocessed(tmp_path):
+    shutil.copy(SAMPLE_FILE, tmp_path / 'a.xml')
+    update(tmp_path)
+    with open(tmp_path / MANIFEST_FILENAME, encoding='utf-8') as f:
+        before = json.load(f)['a.xml']
+
+    stat = os.stat(tmp_path / 'a.xml')
+    os.utime(tmp_path / 'a.xml', ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert update(tmp_path) == ({'changed': [], 'removed': []}, [])
+    with open(tmp_path / MANIFEST_FILENAME, encoding='utf-8') as f:
+        after = json.load(f)['a.xml']
+    assert after['sha256'] == before['sha256'] and after['mtime'] == before['mtime'] + 10 ** 9
+
+
+def test_removed_file_leaves_the_results(tmp_path):
+    shutil.copy(SAMPLE_FILE, tmp_path / 'a.xml')
+    shutil.copy(OTHER_FILE, tmp_path / 'b.xml')
+    update(tmp_path)
+    os.remove(tmp_path / 'a.xml')
+    assert update(tmp_path) == ({'changed': [], 'removed': ['a.xml']}, [])
+    assert stored_sources(tmp_path) == ['b.xml']
+    with open(tmp_path / MANIFEST_FILENAME, encoding='utf-8') as f:
+        assert list(json.load(f)) == ['b.xml']
+
+
+def test_watch_merges_files_that_appear_between_polls(tmp_path, monkeypatch):
+    shutil.copy(SAMPLE_FILE, tmp_path / 'a.xml')
+    polls = []
+
+    def sleep(seconds):
+        polls.append(seconds)
+        if len(polls) == 1:
+            shutil.copy(OTHER_FILE, tmp_path / 'b.xml')
+        else:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(process_pensions.time, 'sleep', sleep)
+    executor = RecordingExecutor()
+    watch_directory(str(tmp_path), interval=0.5, executor=executor, excel=True)
+    assert executor.processed == ['a.xml', 'b.xml']
+    assert stored_sources(tmp_path) == ['a.xml', 'b.xml']
+    assert os.path.exists(tmp_path / f'{RESULTS_BASENAME}.xlsx')
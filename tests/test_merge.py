@@ -0,0 +1,92 @@
+from process_pensions import merge_results
+
+COMPANY = '512065202'
+
+
+def account(number, balance, balance_date='', company=COMPANY):
+    return {
+        'מספר_חשבון': number,
+        'קוד_חברה_מנהלת': company,
+        'חברה_מנהלת': 'חברה',
+        'יתרה': balance,
+        'תאריך_נכונות_יתרה': balance_date,
+    }
+
+
+def result(file, accounts, execution_date='', beneficiaries=()):
+    return {
+        'file': file,
+        'header': {'execution_date': execution_date},
+        'accounts': accounts,
+        'beneficiaries': list(beneficiaries),
+    }
+
+
+def kept(merged):
+    return [(item['file'], account['מספר_חשבון'], account['יתרה']) for item in merged for account in item['accounts']]
+
+
+def test_latest_balance_date_wins_and_differences_are_reported():
+    older = result('old.xml', [account('1', 100.0, '2024-01-31'), account('2', 5.0)], execution_date='20250101000000')
+    newer = result('new.xml', [account('1', 200.0, '2024-06-30')], execution_date='20240701000000')
+    merged, conflicts = merge_results([older, newer])
+    assert kept(merged) == [('old.xml', '2', 5.0), ('new.xml', '1', 200.0)]
+    assert conflicts == [{
+        'managing_company_code': COMPANY,
+        'managing_company': 'חברה',
+        'account_number': '1',
+        'kept_file': 'new.xml',
+        'kept_balance': 200.0,
+        'kept_balance_date': '2024-06-30',
+        'dropped_file': 'old.xml',
+        'dropped_balance': 100.0,
+        'dropped_balance_date': '2024-01-31',
+    }]
+    # The inputs are left as they were
+    assert len(older['accounts']) == 2
+
+
+def test_identical_copies_are_merged_without_a_conflict():
+    first = result('a.xml', [account('1', 100.0, '2024-01-31')])
+    second = result('b.xml', [account('1', 100.0, '2024-01-31')])
+    merged, conflicts = merge_results([first, second])
+    assert kept(merged) == [('a.xml', '1', 100.0)]
+    assert conflicts == []
+
+
+def test_transfer_timestamp_breaks_balance_date_ties():
+    by_header = [
+        result('a.xml', [account('1', 100.0)], execution_date='20240101000000'),
+        result('b.xml', [account('1', 150.0)], execution_date='20240201000000'),
+    ]
+    assert kept(merge_results(by_header)[0]) == [('b.xml', '1', 150.0)]
+
+    by_file_name = [
+        result('x_1_KGM_202402011200_1.xml', [account('1', 150.0)]),
+        result('x_1_KGM_202401011200_1.xml', [account('1', 100.0)]),
+    ]
+    merged, conflicts = merge_results(by_file_name)
+    assert kept(merged) == [('x_1_KGM_202402011200_1.xml', '1', 150.0)]
+    assert [conflict['dropped_file'] for conflict in conflicts] == ['x_1_KGM_202401011200_1.xml']
+
+
+def test_accounts_are_matched_per_company_and_repeats_in_one_file_are_kept():
+    first = result('a.xml', [account('1', 100.0), account('1', 100.0), account('לא ידוע', 1.0)])
+    second = result('b.xml', [account('1', 300.0, company='520004078'), account('לא ידוע', 2.0)])
+    merged, conflicts = merge_results([first, second])
+    assert kept(merged) == [
+        ('a.xml', '1', 100.0), ('a.xml', '1', 100.0), ('a.xml', 'לא ידוע', 1.0),
+        ('b.xml', '1', 300.0), ('b.xml', 'לא ידוע', 2.0),
+    ]
+    assert conflicts == []
+
+
+def test_beneficiaries_of_dropped_accounts_are_removed():
+    older = result(
+        'old.xml',
+        [account('1', 100.0, '2024-01-31'), account('2', 5.0)],
+        beneficiaries=[{'account_number': '1', 'id_number': 'A'}, {'account_number': '2', 'id_number': 'B'}],
+    )
+    newer = result('new.xml', [account('1', 200.0, '2024-06-30')], beneficiaries=[{'account_number': '1', 'id_number': 'C'}])
+    merged, _ = merge_results([older, newer])
+    assert [[beneficiary['id_number'] for beneficiary in item['beneficiaries']] for item in merged] == [['B'], ['C']]
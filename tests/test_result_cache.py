@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+from result_cache import RESULT_SUFFIX, ResultCache
+
+
+@pytest.fixture
+def directory(tmp_path):
+    return str(tmp_path / 'results')
+
+
+def test_only_the_owner_gets_the_payload(directory):
+    cache = ResultCache(directory)
+    result_id = cache.put('alice', {'rows': [1, 2]})
+    assert cache.get(result_id, 'alice') == {'rows': [1, 2]}
+    assert cache.get(result_id, 'bob') is None
+    # Also when read back from disk by another process
+    assert ResultCache(directory).get(result_id, 'bob') is None
+    assert ResultCache(directory).get(result_id, 'alice') == {'rows': [1, 2]}
+
+
+@pytest.mark.parametrize('result_id', ['', '../results', 'a/b', 'a.json'])
+def test_malformed_ids_are_refused(directory, result_id):
+    assert ResultCache(directory).get(result_id, 'alice') is None
+
+
+def test_expired_entries_are_hidden_and_collected(directory):
+    expired = []
+    cache = ResultCache(directory, ttl=60, on_expire=expired.append)
+    result_id = cache.put('alice', {'file_ids': [7]})
+    path = os.path.join(directory, f'{result_id}{RESULT_SUFFIX}')
+    old = os.path.getmtime(path) - 120
+    os.utime(path, (old, old))
+    cache._memory[result_id]['created_at'] -= 120
+
+    assert cache.get(result_id, 'alice') is None
+    assert cache.collect_garbage(force=True) == 1
+    assert expired == [{'file_ids': [7]}]
+    assert not os.path.exists(path)
+
+
+def test_garbage_collection_is_rate_limited(directory):
+    cache = ResultCache(directory)
+    assert cache.collect_garbage() == 0
+    assert cache.collect_garbage() is None
+
+
+def test_entry_removed_by_another_process_is_not_served_from_memory(directory):
+    cache = ResultCache(directory)
+    result_id = cache.put('alice', {'rows': []})
+    other_worker = ResultCache(directory)
+    other_worker.delete(result_id, 'alice')
+    assert cache.get(result_id, 'alice') is None
+    assert result_id not in cache._memory
+
+
+def test_delete_by_another_owner_keeps_the_entry(directory):
+    cache = ResultCache(directory)
+    result_id = cache.put('alice', {'rows': []})
+    cache.delete(result_id, 'bob')
+    assert cache.get(result_id, 'alice') == {'rows': []}
@@ -0,0 +1,170 @@
+import glob
+import gzip
+import os
+from io import BytesIO
+
+import numpy as np
+import pytest
+from openpyxl import load_workbook
+
+from conftest import UPLOADS_DIR
+
+import app as app_module
+from results_store import ResultsStore
+
+FLASH_TEXT = 'הודעת בדיקה'
+CLIENT_PATTERNS = {'first': '51683845_*.xml', 'second': '11428323_*.xml'}
+CLIENT_IDS = {'first': '51683845', 'second': '11428323'}
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    app = app_module.app
+    monkeypatch.setitem(app.config, 'TESTING', True)
+    for key, name in (
+        ('UPLOAD_FOLDER', 'uploads'),
+        ('PROCESSED_FOLDER', 'processed'),
+        ('EXPORT_FOLDER', 'exports'),
+        ('RESULTS_FOLDER', 'results'),
+        ('SPOOL_FOLDER', 'spool'),
+    ):
+        path = tmp_path / name
+        path.mkdir()
+        monkeypatch.setitem(app.config, key, str(path))
+    monkeypatch.setitem(app.config, 'RESULTS_DB', str(tmp_path / 'results.db'))
+    monkeypatch.setattr(app_module, '_result_cache', None)
+    monkeypatch.setattr(app_module, '_upload_spool', None)
+    return app.test_client()
+
+
+def upload(client, pattern, count=2):
+    paths = sorted(glob.glob(os.path.join(UPLOADS_DIR, pattern)))[:count]
+    files = [(open(path, 'rb'), os.path.basename(path)) for path in paths]
+    try:
+        response = client.post('/', data={'file': files}, content_type='multipart/form-data')
+    finally:
+        for handle, _ in files:
+            handle.close()
+    assert response.status_code == 200
+
+
+@pytest.fixture
+def result_id(client):
+    upload(client, CLIENT_PATTERNS['first'])
+    with client.session_transaction() as session:
+        return session['result_id']
+
+
+def fetch(client, url, **kwargs):
+    # Read the streamed body so its request context is popped before the next request
+    response = client.get(url, **kwargs)
+    response.get_data()
+    return response
+
+
+def test_flash_is_shown_once(client, result_id):
+    with client.session_transaction() as session:
+        session['_flashes'] = [('warning', FLASH_TEXT)]
+    response = fetch(client, f'/results/{result_id}')
+    assert FLASH_TEXT in response.get_data(as_text=True)
+    assert response.get_etag() == (None, None)
+    assert response.cache_control.no_store
+
+    with client.session_transaction() as session:
+        assert '_flashes' not in session
+    assert FLASH_TEXT not in fetch(client, f'/results/{result_id}').get_data(as_text=True)
+    assert FLASH_TEXT not in fetch(client, '/').get_data(as_text=True)
+
+
+def test_unchanged_results_page_answers_304(client, result_id):
+    response = fetch(client, f'/results/{result_id}')
+    etag, weak = response.get_etag()
+    assert etag and not weak
+    assert response.cache_control.private and response.cache_control.no_cache
+
+    cached = fetch(client, f'/results/{result_id}', headers={'If-None-Match': f'"{etag}"'})
+    assert cached.status_code == 304
+    assert cached.get_etag() == (etag, False)
+
+    gzipped = fetch(client, f'/results/{result_id}', headers={'If-None-Match': f'"{etag}"', 'Accept-Encoding': 'gzip'})
+    assert gzipped.status_code == 200
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+
+
+def test_pending_flash_is_not_answered_with_304(client, result_id):
+    etag, _ = fetch(client, f'/results/{result_id}').get_etag()
+    with client.session_transaction() as session:
+        session['_flashes'] = [('warning', FLASH_TEXT)]
+    response = fetch(client, f'/results/{result_id}', headers={'If-None-Match': f'"{etag}"'})
+    assert response.status_code == 200
+    assert FLASH_TEXT in response.get_data(as_text=True)
+
+
+def test_results_of_another_session_redirect(client, result_id):
+    other = app_module.app.test_client()
+    response = other.get(f'/results/{result_id}')
+    assert response.status_code == 302
+
+
+def test_streamed_csv_export_is_compressed(client, result_id):
+    plain = fetch(client, '/export.csv')
+    gzipped = fetch(client, '/export.csv', headers={'Accept-Encoding': 'gzip'})
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(gzipped.get_data()) == plain.get_data()
+    assert gzipped.get_etag()[0] != plain.get_etag()[0]
+    assert fetch(client, '/export.csv', headers={
+        'Accept-Encoding': 'gzip',
+        'If-None-Match': f'"{gzipped.get_etag()[0]}"',
+    }).status_code == 304
+
+
+@pytest.mark.filterwarnings('error')
+def test_amounts_format_like_str_format():
+    values = np.array([
+        [0.0, -0.0, 0.005, 0.015, 2.675, 1.005, 999.995, np.nan],
+        [1000.0, 1e6, -1234567.891, 6107188.5, -0.001, 5e-300, 123456789012.345, np.nan],
+        [2.0 ** 52 + 0.5, 2.0 ** 53, -1e17, 1e300, np.inf, -np.inf, 99.995, -999999.995],
+    ])
+    expected = [['' if not np.isfinite(value) else f'{value:,.2f}' for value in row] for row in values]
+    assert app_module._format_amounts(values).tolist() == expected
+
+
+def exported_client_ids(client):
+    response = fetch(client, '/export')
+    assert response.status_code == 200
+    sheet = load_workbook(BytesIO(response.get_data()), read_only=True)['פרטי לקוח']
+    return {value for _, value in sheet.iter_rows(min_row=2, values_only=True) if value in CLIENT_IDS.values()}
+
+
+def test_late_export_job_does_not_write_another_clients_rows(client, monkeypatch):
+    scheduled = []
+    monkeypatch.setattr(app_module, 'schedule_export_artifacts', lambda *args: scheduled.append(args))
+
+    upload(client, CLIENT_PATTERNS['first'])
+    # Uploading again releases the first result's rows before its export job ran
+    upload(client, CLIENT_PATTERNS['second'])
+    first_job, second_job = scheduled
+    assert not set(first_job[1]) & set(second_job[1])
+    assert not app_module.write_export_artifacts(*first_job)
+    assert not os.path.exists(app_module.export_artifact_path(first_job[0], 'xlsx'))
+
+    assert exported_client_ids(client) == {CLIENT_IDS['second']}
+    upload(client, CLIENT_PATTERNS['first'])
+    assert exported_client_ids(client) == {CLIENT_IDS['first']}
+
+
+def test_cached_export_of_other_content_is_rebuilt(client, result_id):
+    fetch(client, '/export')
+    [path] = glob.glob(os.path.join(app_module.app.config['EXPORT_FOLDER'], '*.xlsx'))
+    with open(path, 'wb') as f:
+        f.write(b'not this upload')
+    assert exported_client_ids(client) == {CLIENT_IDS['first']}
+
+
+def test_upload_larger_than_the_queue_is_admitted_in_slices(client, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, 'UPLOAD_QUEUE_LIMIT', 3)
+    monkeypatch.setitem(app_module.app.config, 'UPLOAD_QUEUE_PER_USER', 2)
+    monkeypatch.setattr(app_module, '_upload_queue', None)
+    upload(client, '56544653_*.xml', count=7)
+    with ResultsStore(app_module.app.config['RESULTS_DB']) as store:
+        assert store.conn.execute('SELECT COUNT(*) FROM files').fetchone()[0] == 7
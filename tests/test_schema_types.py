@@ -0,0 +1,48 @@
+import json
+import os
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import schema_types
+from process_pensions import PensionFileProcessor
+from schema_types import build_type_table, tag_type
+
+SCHEMA = '''<xsd:schema xmlns:xsd="http://www.w3.org/2001/XMLSchema">
+  <xsd:element name="SCHUM">
+    <xsd:simpleType><xsd:restriction base="xsd:decimal"/></xsd:simpleType>
+  </xsd:element>
+</xsd:schema>'''
+
+
+def test_type_table_is_replaced_atomically(tmp_path, monkeypatch):
+    (tmp_path / 'schema.xsd').write_text(SCHEMA, encoding='utf-8')
+    cache_file = tmp_path / 'types.json'
+    cache_file.write_text('{"OLD": {"type": "string"}}', encoding='utf-8')
+
+    def failing_dump(*args, **kwargs):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(schema_types.json, 'dump', failing_dump)
+    with pytest.raises(OSError):
+        build_type_table(str(tmp_path), str(cache_file))
+    # The previous cache is untouched and no temporary file is left behind
+    assert json.loads(cache_file.read_text(encoding='utf-8')) == {'OLD': {'type': 'string'}}
+    assert sorted(os.listdir(tmp_path)) == ['schema.xsd', 'types.json']
+
+    monkeypatch.undo()
+    assert build_type_table(str(tmp_path), str(cache_file)) == {'SCHUM': {'type': 'decimal'}}
+    assert json.loads(cache_file.read_text(encoding='utf-8')) == {'SCHUM': {'type': 'decimal'}}
+    assert sorted(os.listdir(tmp_path)) == ['schema.xsd', 'types.json']
+
+
+@pytest.mark.parametrize('tag, text, expected', [
+    ('TOTAL-CHISACHON-MTZBR', '1,234.50', 1234.5),
+    ('KOD-SUG-HAFRASHA', '3', None),
+    ('TAARICH-NECHONUT', '20240131', None),
+    ('UNDECLARED-AMOUNT', '12.5', 12.5),
+])
+def test_only_numeric_tags_are_read_as_amounts(tag, text, expected):
+    assert tag_type('UNDECLARED-AMOUNT') is None
+    elem = ET.fromstring(f'<Heshbon><{tag}>{text}</{tag}></Heshbon>')
+    assert PensionFileProcessor('unused.xml')._get_float(elem, tag) == expected
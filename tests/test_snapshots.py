@@ -0,0 +1,77 @@
+import sqlite3
+
+import pytest
+
+import app as app_module
+from results_store import ResultsStore, snapshot_date
+
+
+def result(source, execution_date, accounts, client_id='123456789'):
+    return {
+        'source': source,
+        'person_details': {'id_number': client_id},
+        'header': {'execution_date': execution_date},
+        'accounts': accounts,
+    }
+
+
+def account(number, balance, balance_date='', plan='תכנית'):
+    return {
+        'מספר_חשבון': number,
+        'קוד_חברה_מנהלת': '512065202',
+        'חברה_מנהלת': 'חברה',
+        'שם_תכנית': plan,
+        'יתרה': balance,
+        'תאריך_נכונות_יתרה': balance_date,
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    with ResultsStore(str(tmp_path / 'results.db')) as store:
+        yield store
+
+
+def test_snapshot_date_prefers_the_balance_date():
+    assert snapshot_date('2024-06-30', '20240715120000') == '2024-06-30'
+    assert snapshot_date('', '20240715120000') == '2024-07-15'
+    assert snapshot_date('30/06/2024', None) is None
+
+
+def test_snapshots_are_append_only(store):
+    store.save_results([result('a.xml', '20240101000000', [account('1', 100.0, '2023-12-31')])])
+    with pytest.raises(sqlite3.IntegrityError, match='append-only'):
+        with store.conn:
+            store.conn.execute('UPDATE snapshots SET balance = 0')
+    with pytest.raises(sqlite3.IntegrityError, match='append-only'):
+        with store.conn:
+            store.conn.execute('DELETE FROM snapshots')
+
+    # Removing the stored file keeps its snapshots, and saving the same transfer again adds none
+    store.delete_sources(['a.xml'])
+    store.save_results([result('a.xml', '20240101000000', [account('1', 100.0, '2023-12-31')])])
+    assert store.conn.execute('SELECT COUNT(*) FROM snapshots').fetchone()[0] == 1
+
+
+def test_timeline_lists_each_account_in_date_order(store):
+    store.save_results([result('2025.xml', '20250101000000', [account('1', 300.0, '2024-12-31', plan='חדשה')])])
+    store.add_snapshots([result('2018.xml', '20181113000000', [account('1', 100.0), account('2', 50.0)])])
+    store.save_results([result('other.xml', '20250101000000', [account('1', 999.0)], client_id='987654321')])
+
+    timeline = store.balance_timeline('123456789')
+    assert [(entry['account_number'], entry['plan_name']) for entry in timeline] == [('1', 'חדשה'), ('2', 'תכנית')]
+    assert [(point['date'], point['balance'], point['source']) for point in timeline[0]['points']] == [
+        ('2018-11-13', 100.0, '2018.xml'),
+        ('2024-12-31', 300.0, '2025.xml'),
+    ]
+    assert store.balance_timeline('555') == []
+
+
+def test_timeline_api_ignores_leading_zeros(store, monkeypatch):
+    store.save_results([result('a.xml', '20240101000000', [account('1', 100.0, '2023-12-31')])])
+    monkeypatch.setitem(app_module.app.config, 'RESULTS_DB', store.db_path)
+    response = app_module.app.test_client().get('/api/timeline/0123456789')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['client_id'] == '123456789'
+    assert [point['balance'] for point in data['accounts'][0]['points']] == [100.0]
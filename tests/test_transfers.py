@@ -0,0 +1,156 @@
+import json
+import os
+import shutil
+
+from conftest import UPLOADS_DIR
+from process_pensions import (
+    MANIFEST_FILENAME,
+    PROGRESS_SUFFIX,
+    REJECTED_DIRNAME,
+    RESULTS_BASENAME,
+    find_superseded_files,
+    iter_results,
+    process_directory,
+    process_file,
+    read_transfer_header,
+    update_directory,
+)
+from results_store import RESULTS_DB_FILENAME, ResultsStore
+
+SAMPLE_FILE = os.path.join(UPLOADS_DIR, 'SwiftNess_51678241_512227265_KGM_201811132020_7.xml')
+OTHER_FILE = os.path.join(UPLOADS_DIR, 'SwiftNess_51678241_512227265_KGM_201811132020_8.xml')
+
+
+class InlineExecutor:
+    """Runs process_file in this process, with the BatchExecutor.run interface."""
+
+    def run(self, file_paths):
+        for file_path in file_paths:
+            yield file_path, process_file(file_path), None
+
+
+class RejectingExecutor(InlineExecutor):
+    """Rejects the files named in rejected, as a worker that crashed on them would."""
+
+    def __init__(self, rejected):
+        self.rejected = rejected
+
+    def run(self, file_paths):
+        for file_path, result, rejection in super().run(file_paths):
+            if os.path.basename(file_path) in self.rejected:
+                yield file_path, None, 'worker crashed'
+            else:
+                yield file_path, result, rejection
+
+
+def write_copy(path, source=SAMPLE_FILE, execution_date=None, transfer_id=None):
+    with open(source, 'r', encoding='utf-8') as f:
+        text = f.read()
+    header = read_transfer_header(source)
+    if execution_date:
+        text = text.replace(f"<TAARICH-BITZUA>{header['execution_date']}<", f"<TAARICH-BITZUA>{execution_date}<", 1)
+    if transfer_id:
+        text = text.replace(f"<MEZAHE-HAAVARA>{header['transfer_id']}<", f"<MEZAHE-HAAVARA>{transfer_id}<", 1)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return str(path)
+
+
+def stored_sources(directory):
+    jsonl_sources = sorted(result['source'] for result in iter_results(os.path.join(directory, f'{RESULTS_BASENAME}.jsonl')))
+    with ResultsStore(os.path.join(directory, RESULTS_DB_FILENAME)) as store:
+        db_sources = sorted(row[0] for row in store.conn.execute('SELECT source FROM files'))
+    assert jsonl_sources == db_sources
+    return jsonl_sources
+
+
+def test_latest_retransmission_supersedes_earlier_copies(tmp_path):
+    original = write_copy(tmp_path / 'a.xml', execution_date='20240101000000')
+    resent = write_copy(tmp_path / 'b.xml', execution_date='20240201000000')
+    other_transfer = write_copy(tmp_path / 'c.xml', execution_date='20230101000000', transfer_id='999')
+    assert find_superseded_files([original, resent, other_transfer]) == {original: resent}
+
+
+def test_identical_copies_keep_the_first_file(tmp_path):
+    first = write_copy(tmp_path / 'a.xml')
+    second = write_copy(tmp_path / 'b.xml')
+    assert find_superseded_files([first, second]) == {second: first}
+
+
+def test_different_accounts_of_one_transfer_are_not_retransmissions():
+    info = read_transfer_header(SAMPLE_FILE)
+    other = read_transfer_header(OTHER_FILE)
+    assert info['first_account'] and other['first_account'] != info['first_account']
+    assert find_superseded_files([SAMPLE_FILE, OTHER_FILE]) == {}
+
+
+def test_header_prepass_stops_at_the_header_without_transfer_ids(tmp_path):
+    path = tmp_path / 'no_ids.xml'
+    path.write_text(
+        '<Mimshak><KoteretKovetz><TAARICH-BITZUA>20240101000000</TAARICH-BITZUA></KoteretKovetz>'
+        '<YeshutYatzran><MISPAR-POLISA-O-HESHBON>123</MISPAR-POLISA-O-HESHBON></YeshutYatzran>'
+        '<not-well-formed></Mimshak>',
+        encoding='utf-8',
+    )
+    assert read_transfer_header(str(path)) == {'execution_date': '20240101000000'}
+    assert find_superseded_files([str(path), str(path)]) == {}
+
+
+def test_header_prepass_stops_at_the_end_of_the_first_product(tmp_path):
+    path = tmp_path / 'no_account.xml'
+    path.write_text(
+        '<Mimshak><KoteretKovetz><MEZAHE-HAAVARA>1</MEZAHE-HAAVARA></KoteretKovetz>'
+        '<YeshutYatzran><Mutzarim><Mutzar></Mutzar><not-well-formed></Mutzarim></YeshutYatzran></Mimshak>',
+        encoding='utf-8',
+    )
+    assert read_transfer_header(str(path)) == {'transfer_id': '1'}
+
+
+def test_update_checks_new_files_against_recorded_headers(tmp_path):
+    write_copy(tmp_path / 'a.xml', execution_date='20240101000000')
+    process_directory(str(tmp_path), executor=InlineExecutor())
+    assert stored_sources(tmp_path) == ['a.xml']
+
+    write_copy(tmp_path / 'b.xml', execution_date='20240201000000')
+    update_directory(str(tmp_path), InlineExecutor())
+    assert stored_sources(tmp_path) == ['b.xml']
+    with open(tmp_path / MANIFEST_FILENAME, encoding='utf-8') as f:
+        assert json.load(f)['a.xml']['superseded_by'] == 'b.xml'
+
+    # An older copy arriving later is skipped too
+    write_copy(tmp_path / 'old.xml', execution_date='20231201000000')
+    update_directory(str(tmp_path), InlineExecutor())
+    assert stored_sources(tmp_path) == ['b.xml']
+
+    os.remove(tmp_path / 'b.xml')
+    update_directory(str(tmp_path), InlineExecutor())
+    assert stored_sources(tmp_path) == ['a.xml']
+
+
+def test_resume_compares_pending_files_with_checkpointed_ones(tmp_path):
+    write_copy(tmp_path / 'a.xml', execution_date='20240101000000')
+    process_directory(str(tmp_path), executor=InlineExecutor())
+    output_file = os.path.join(tmp_path, RESULTS_BASENAME)
+    with open(tmp_path / MANIFEST_FILENAME, encoding='utf-8') as f:
+        manifest = json.load(f)
+    # As if the run had been interrupted right after a.xml
+    with open(f'{output_file}{PROGRESS_SUFFIX}', 'w', encoding='utf-8') as f:
+        json.dump({
+            'manifest': manifest,
+            'offsets': {key: os.path.getsize(f'{output_file}.{key}') for key in ('jsonl', 'csv')},
+        }, f)
+
+    write_copy(tmp_path / 'b.xml', execution_date='20240201000000')
+    shutil.copy(OTHER_FILE, tmp_path / 'c.xml')
+    process_directory(str(tmp_path), resume=True, executor=InlineExecutor())
+    assert [result['source'] for result in iter_results(f'{output_file}.jsonl')] == ['b.xml', 'c.xml']
+
+
+def test_rejected_files_stay_out_of_the_manifest(tmp_path):
+    write_copy(tmp_path / 'a.xml')
+    shutil.copy(OTHER_FILE, tmp_path / 'bad.xml')
+    process_directory(str(tmp_path), executor=RejectingExecutor({'bad.xml'}))
+    assert (tmp_path / REJECTED_DIRNAME / 'bad.xml').exists()
+    with open(tmp_path / MANIFEST_FILENAME, encoding='utf-8') as f:
+        assert list(json.load(f)) == ['a.xml']
+    assert stored_sources(tmp_path) == ['a.xml']
@@ -0,0 +1,123 @@
+import threading
+
+import pytest
+
+from upload_queue import FairJobQueue, QueueFull
+
+
+class Gate:
+    """Job function that records its calls and blocks until released."""
+
+    def __init__(self):
+        self.calls = []
+        self.released = threading.Event()
+        self.started = threading.Event()
+
+    def __call__(self, item):
+        self.calls.append(item)
+        self.started.set()
+        self.released.wait(5)
+        return item
+
+
+def test_users_take_turns():
+    gate = Gate()
+    queue = FairJobQueue(1, max_queued=10, max_queued_per_user=10)
+    # Occupy the only worker so the rest stays queued in submission order
+    blocker = queue.submit_many('blocker', gate, ['blocker'])
+    assert gate.started.wait(5)
+    bulk = queue.submit_many('bulk', gate, ['bulk-1', 'bulk-2', 'bulk-3'])
+    single = queue.submit_many('single', gate, ['single-1'])
+    gate.released.set()
+    for future in blocker + bulk + single:
+        future.result(timeout=5)
+    assert gate.calls == ['blocker', 'bulk-1', 'single-1', 'bulk-2', 'bulk-3']
+
+
+def test_results_and_exceptions_reach_the_futures():
+    queue = FairJobQueue(2)
+    futures = queue.submit_many('user', lambda item: 10 // item, [5, 0])
+    assert futures[0].result(timeout=5) == 2
+    with pytest.raises(ZeroDivisionError):
+        futures[1].result(timeout=5)
+
+
+def test_per_user_limit_leaves_other_users_admitted():
+    gate = Gate()
+    queue = FairJobQueue(1, max_queued=10, max_queued_per_user=2)
+    queue.submit_many('blocker', gate, ['running'])
+    assert gate.started.wait(5)
+    queue.submit_many('user', gate, ['a', 'b'])
+    with pytest.raises(QueueFull) as excinfo:
+        queue.submit_many('user', gate, ['c'])
+    assert excinfo.value.per_user and excinfo.value.retry_after >= 1
+    # Another user is still admitted
+    queue.submit_many('other', gate, ['d'])
+    gate.released.set()
+
+
+def test_global_limit_rejects_whole_submission():
+    gate = Gate()
+    queue = FairJobQueue(1, max_queued=3, max_queued_per_user=3)
+    queue.submit_many('blocker', gate, ['running'])
+    assert gate.started.wait(5)
+    queue.submit_many('first', gate, ['a', 'b'])
+    with pytest.raises(QueueFull) as excinfo:
+        queue.submit_many('second', gate, ['c', 'd'])
+    assert not excinfo.value.per_user
+    metrics = queue.metrics()
+    assert metrics['queued'] == 2 and metrics['rejected'] == 1
+    gate.released.set()
+
+
+def test_submission_waits_for_room_until_its_timeout():
+    gate = Gate()
+    queue = FairJobQueue(1, max_queued=10, max_queued_per_user=1)
+    queue.submit_many('user', gate, ['running'])
+    assert gate.started.wait(5)
+    queue.submit_many('user', gate, ['queued'])
+    with pytest.raises(QueueFull):
+        queue.submit_many('user', gate, ['late'], timeout=0.05)
+
+    threading.Timer(0.1, gate.released.set).start()
+    [late] = queue.submit_many('user', gate, ['late'], timeout=5)
+    assert late.result(timeout=5) == 'late'
+    assert queue.metrics()['rejected'] == 1
+
+
+def test_large_submission_is_admitted_in_slices():
+    queue = FairJobQueue(2, max_queued=5, max_queued_per_user=3)
+    futures = queue.submit_in_slices('user', lambda item: item * 2, range(10), timeout=5)
+    assert [future.result(timeout=5) for future in futures] == [item * 2 for item in range(10)]
+
+
+def test_sliced_submission_is_refused_at_once_when_busy():
+    gate = Gate()
+    queue = FairJobQueue(1, max_queued=10, max_queued_per_user=2)
+    queue.submit_many('user', gate, ['running'])
+    assert gate.started.wait(5)
+    queue.submit_many('user', gate, ['a', 'b'])
+    with pytest.raises(QueueFull) as excinfo:
+        queue.submit_in_slices('user', gate, ['c', 'd', 'e'], timeout=60)
+    assert excinfo.value.per_user
+    gate.released.set()
+
+
+def test_sliced_submission_cancels_its_jobs_when_a_slice_times_out():
+    gate = Gate()
+    queue = FairJobQueue(1, max_queued=3, max_queued_per_user=2)
+    queue.submit_many('blocker', gate, ['running'])
+    assert gate.started.wait(5)
+    queue.submit_many('other', gate, ['x'])
+    with pytest.raises(QueueFull):
+        queue.submit_in_slices('user', gate, ['a', 'b', 'c'], timeout=0.05)
+    gate.released.set()
+    assert queue.submit_many('check', gate, ['y'], timeout=5)[0].result(timeout=5) == 'y'
+    assert 'a' not in gate.calls and 'b' not in gate.calls
+
+
+def test_submission_larger_than_the_limits_is_refused():
+    queue = FairJobQueue(1, max_queued=5, max_queued_per_user=3)
+    assert queue.max_batch == 3
+    with pytest.raises(ValueError):
+        queue.submit_many('user', str, range(4))
@@ -0,0 +1,169 @@
+import hashlib
+import os
+import threading
+
+import pytest
+
+import app as app_module
+from upload_queue import QueueFull
+from upload_spool import SpoolError, UploadSpool
+
+CONTENT = b'<Mimshak>' + b'x' * 3000 + b'</Mimshak>'
+CHUNK_BYTES = 1024
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def chunks_of(data):
+    return [data[start:start + CHUNK_BYTES] for start in range(0, len(data), CHUNK_BYTES)]
+
+
+@pytest.fixture
+def spool(tmp_path):
+    return UploadSpool(str(tmp_path / 'spool'))
+
+
+def upload_chunks(spool, upload_id, filename, data=CONTENT):
+    for index, chunk in enumerate(chunks_of(data)):
+        spool.write_chunk(upload_id, filename, index, chunk, sha256(chunk))
+    return len(chunks_of(data))
+
+
+def test_chunks_are_assembled_in_order(spool):
+    upload_id = spool.create('owner')
+    total = upload_chunks(spool, upload_id, 'a.xml')
+    path = spool.assemble(upload_id, 'a.xml', total, sha256(CONTENT))
+    with open(path, 'rb') as f:
+        assert f.read() == CONTENT
+    assert spool.status(upload_id) == {'a.xml': {'state': 'processing'}}
+    # Completing again is not a second assembly
+    assert spool.assemble(upload_id, 'a.xml', total, sha256(CONTENT)) is None
+
+
+def test_chunk_with_wrong_checksum_is_rejected(spool):
+    upload_id = spool.create('owner')
+    with pytest.raises(SpoolError):
+        spool.write_chunk(upload_id, 'a.xml', 0, b'data', sha256(b'other'))
+    assert spool.received_chunks(upload_id, 'a.xml') == []
+
+
+def test_file_with_wrong_checksum_keeps_its_chunks(spool):
+    upload_id = spool.create('owner')
+    total = upload_chunks(spool, upload_id, 'a.xml')
+    with pytest.raises(SpoolError):
+        spool.assemble(upload_id, 'a.xml', total, sha256(b'other'))
+    assert not os.path.exists(spool.file_path(upload_id, 'a.xml'))
+    assert spool.received_chunks(upload_id, 'a.xml') == list(range(total))
+    assert spool.assemble(upload_id, 'a.xml', total, sha256(CONTENT))
+
+
+def test_missing_chunks_are_reported(spool):
+    upload_id = spool.create('owner')
+    spool.write_chunk(upload_id, 'a.xml', 1, b'data', sha256(b'data'))
+    with pytest.raises(SpoolError, match=r'missing chunks \[0\]'):
+        spool.assemble(upload_id, 'a.xml', 2)
+
+
+@pytest.mark.parametrize('upload_id', ['', '..', '../other', 'a/b', 'a\\b', '.'])
+def test_upload_ids_outside_the_spool_are_refused(spool, upload_id):
+    spool.create('owner')
+    assert not spool.owns(upload_id, 'owner')
+
+
+def test_only_one_concurrent_assembly_wins(spool):
+    upload_id = spool.create('owner')
+    total = upload_chunks(spool, upload_id, 'a.xml', CONTENT * 200)
+    barrier = threading.Barrier(4)
+    outcomes = []
+
+    def complete():
+        barrier.wait()
+        outcomes.append(spool.assemble(upload_id, 'a.xml', total))
+
+    threads = [threading.Thread(target=complete) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len([path for path in outcomes if path]) == 1
+    with open(spool.file_path(upload_id, 'a.xml'), 'rb') as f:
+        assert f.read() == CONTENT * 200
+
+
+def test_retryable_failure_is_claimed_once(spool):
+    upload_id = spool.create('owner')
+    spool.write_result(upload_id, 'a.xml', error='parsing queue full', retryable=True)
+    assert spool.claim_retry(upload_id, 'a.xml')
+    assert not spool.claim_retry(upload_id, 'a.xml')
+    spool.write_result(upload_id, 'a.xml', error='bad file')
+    assert not spool.claim_retry(upload_id, 'a.xml')
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    app = app_module.app
+    monkeypatch.setitem(app.config, 'TESTING', True)
+    monkeypatch.setitem(app.config, 'SPOOL_FOLDER', str(tmp_path / 'spool'))
+    monkeypatch.setattr(app_module, '_upload_spool', None)
+    return app.test_client()
+
+
+def start_upload(client, filename='a.xml'):
+    upload_id = client.post('/api/uploads').get_json()['upload_id']
+    for index, chunk in enumerate(chunks_of(CONTENT)):
+        response = client.put(
+            f'/api/uploads/{upload_id}/files/{filename}/chunks/{index}',
+            data=chunk,
+            headers={'X-Chunk-SHA256': sha256(chunk)},
+        )
+        assert response.status_code == 200, response.get_data(as_text=True)
+    return upload_id
+
+
+def test_traversal_in_file_names_stays_inside_the_upload(client, tmp_path):
+    upload_id = client.post('/api/uploads').get_json()['upload_id']
+    response = client.put(
+        f'/api/uploads/{upload_id}/files/..%2F..%2Fescape.xml/chunks/0',
+        data=b'data',
+        headers={'X-Chunk-SHA256': sha256(b'data')},
+    )
+    assert response.status_code in (200, 404)
+    escaped = [os.path.join(root, name) for root, _, names in os.walk(tmp_path) for name in names if 'escape' in name]
+    assert all(os.sep + upload_id + os.sep in path for path in escaped)
+
+
+def test_other_sessions_cannot_use_an_upload(client):
+    upload_id = start_upload(client)
+    other = app_module.app.test_client()
+    assert other.get(f'/api/uploads/{upload_id}').status_code == 404
+    assert other.post(f'/api/uploads/{upload_id}/files/a.xml/complete', json={'chunks': 3}).status_code == 404
+
+
+def test_full_queue_does_not_block_finish(client, monkeypatch):
+    upload_id = start_upload(client)
+
+    class FullQueue:
+        def submit_many(self, user, fn, items):
+            raise QueueFull('64 jobs already queued', 5, per_user=False)
+
+    monkeypatch.setattr(app_module, 'get_upload_queue', lambda: FullQueue())
+    response = client.post(f'/api/uploads/{upload_id}/files/a.xml/complete', json={'chunks': len(chunks_of(CONTENT))})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '5'
+    state = client.get(f'/api/uploads/{upload_id}').get_json()['files']['a.xml']
+    assert state['state'] == 'failed' and state['retryable']
+
+    queued = []
+
+    class OpenQueue:
+        def submit_many(self, user, fn, items):
+            queued.extend(items)
+            return []
+
+    monkeypatch.setattr(app_module, 'get_upload_queue', lambda: OpenQueue())
+    response = client.post(f'/api/uploads/{upload_id}/files/a.xml/complete', json={'chunks': len(chunks_of(CONTENT))})
+    assert response.status_code == 202
+    assert len(queued) == 1
+    assert client.get(f'/api/uploads/{upload_id}').get_json()['files']['a.xml'] == {'state': 'processing'}
@@ -0,0 +1,206 @@
+import math
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Iterable
+
+DEFAULT_MAX_QUEUED = 64
+DEFAULT_MAX_QUEUED_PER_USER = 32
+METRIC_SAMPLES = 500
+
+
+class QueueFull(Exception):
+    """Raised when a submission would exceed the queue's limits."""
+
+    def __init__(self, message: str, retry_after: int, per_user: bool):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.per_user = per_user
+
+
+def _summary(samples: deque) -> dict[str, float]:
+    if not samples:
+        return {'mean': 0.0, 'p95': 0.0, 'max': 0.0}
+    ordered = sorted(samples)
+    return {
+        'mean': round(sum(ordered) / len(ordered), 3),
+        'p95': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        'max': round(ordered[-1], 3),
+    }
+
+
+class FairJobQueue:
+    """Bounded job queue run by a fixed number of threads, taking turns between users.
+
+    Each user's jobs run in submission order, but users are served round-robin, so
+    a single-file upload waits behind at most one job of every other active user
+    rather than behind a whole bulk upload. Limits, turns and metrics are per
+    process, which is why the app runs in a single gunicorn worker (gunicorn.conf.py).
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        max_queued: int = DEFAULT_MAX_QUEUED,
+        max_queued_per_user: int = DEFAULT_MAX_QUEUED_PER_USER,
+    ):
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self.max_queued_per_user = max_queued_per_user
+        self._queues: dict[str, deque] = {}
+        self._turns: deque[str] = deque()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+        self._wait_times: deque[float] = deque(maxlen=METRIC_SAMPLES)
+        self._service_times: deque[float] = deque(maxlen=METRIC_SAMPLES)
+        self._condition = threading.Condition()
+        for index in range(self.workers):
+            threading.Thread(target=self._run, name=f'upload-queue-{index}', daemon=True).start()
+
+    @property
+    def max_batch(self) -> int:
+        return min(self.max_queued, self.max_queued_per_user)
+
+    def _retry_after(self, backlog: int) -> int:
+        """Seconds until roughly backlog jobs have drained, from recent service times."""
+        service = sum(self._service_times) / len(self._service_times) if self._service_times else 1.0
+        return max(1, math.ceil(service * backlog / self.workers))
+
+    def _admission_error(self, user: str, count: int) -> QueueFull | None:
+        queue = self._queues.get(user)
+        user_queued = len(queue) if queue else 0
+        if user_queued + count > self.max_queued_per_user:
+            return QueueFull(
+                f'{user_queued} jobs already queued for this user',
+                self._retry_after(user_queued),
+                per_user=True,
+            )
+        if self._queued + count > self.max_queued:
+            return QueueFull(
+                f'{self._queued} jobs already queued',
+                self._retry_after(self._queued + count - self.max_queued),
+                per_user=False,
+            )
+        return None
+
+    def submit_many(
+        self,
+        user: str,
+        fn: Callable[[Any], Any],
+        items: Iterable[Any],
+        timeout: float | None = None,
+    ) -> list[Future]:
+        """Queue fn(item) for every item on behalf of user, all or none.
+
+        Raises QueueFull when the user's or the global queue limit would be exceeded,
+        after waiting up to timeout seconds for room when one is given, and ValueError
+        when the submission alone exceeds them.
+        """
+        items = list(items)
+        if len(items) > self.max_batch:
+            raise ValueError(f'at most {self.max_batch} jobs can be submitted at once')
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while True:
+                full = self._admission_error(user, len(items))
+                if full is None:
+                    break
+                remaining = deadline - time.monotonic() if deadline is not None else 0
+                if remaining <= 0:
+                    self._rejected += 1
+                    raise full
+                self._condition.wait(remaining)
+
+            queue = self._queues.get(user)
+            if queue is None:
+                queue = self._queues[user] = deque()
+                self._turns.append(user)
+            queued_at = time.monotonic()
+            futures = []
+            for item in items:
+                future: Future = Future()
+                queue.append((future, fn, item, queued_at))
+                futures.append(future)
+            self._queued += len(items)
+            self._condition.notify(len(items))
+        return futures
+
+    def submit_in_slices(
+        self,
+        user: str,
+        fn: Callable[[Any], Any],
+        items: Iterable[Any],
+        timeout: float,
+    ) -> list[Future]:
+        """Queue fn(item) for any number of items, max_batch at a time.
+
+        The first slice is admitted or refused like submit_many, so a busy queue still
+        answers QueueFull at once; later slices wait up to timeout seconds each for
+        room as earlier jobs are picked up. Raises QueueFull, with every job of the
+        submission cancelled, when a slice is still refused after that.
+        """
+        items = list(items)
+        futures = self.submit_many(user, fn, items[:self.max_batch])
+        try:
+            for start in range(self.max_batch, len(items), self.max_batch):
+                futures.extend(self.submit_many(user, fn, items[start:start + self.max_batch], timeout=timeout))
+        except QueueFull:
+            # The submission fails as a whole; jobs not yet started are dropped
+            for future in futures:
+                future.cancel()
+            raise
+        return futures
+
+    def _next_job(self):
+        with self._condition:
+            while not self._turns:
+                self._condition.wait()
+            user = self._turns.popleft()
+            queue = self._queues[user]
+            job = queue.popleft()
+            if queue:
+                # Back of the line: other users get a turn before this one's next job
+                self._turns.append(user)
+            else:
+                del self._queues[user]
+            self._queued -= 1
+            self._running += 1
+            # Room for a submission waiting in submit_many
+            self._condition.notify_all()
+            return job
+
+    def _run(self) -> None:
+        while True:
+            future, fn, item, queued_at = self._next_job()
+            started = time.monotonic()
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(item))
+                except BaseException as e:
+                    future.set_exception(e)
+            finished = time.monotonic()
+            with self._condition:
+                self._running -= 1
+                self._completed += 1
+                self._wait_times.append(started - queued_at)
+                self._service_times.append(finished - started)
+
+    def metrics(self) -> dict[str, Any]:
+        """Queue depth, throughput counters and recent wait/service time summaries in seconds."""
+        with self._condition:
+            return {
+                'workers': self.workers,
+                'queued': self._queued,
+                'running': self._running,
+                'active_users': len(self._queues),
+                'max_queued': self.max_queued,
+                'max_queued_per_user': self.max_queued_per_user,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'wait_seconds': _summary(self._wait_times),
+                'service_seconds': _summary(self._service_times),
+            }
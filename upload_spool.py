@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import secrets
+from typing import Any
+
+MANIFEST_FILENAME = 'manifest.json'
+CHUNKS_DIRNAME = 'chunks'
+FILES_DIRNAME = 'files'
+RESULTS_DIRNAME = 'results'
+CHUNK_SUFFIX = '.part'
+# Created with O_EXCL in a file's chunk directory by the one request assembling it
+ASSEMBLING_MARKER = '.assembling'
+RESULT_SUFFIX = '.json'
+COPY_BUFFER_BYTES = 1024 * 1024
+
+
+class SpoolError(Exception):
+    """Raised when a chunk or an assembled file fails validation."""
+
+
+def _is_valid_id(upload_id: str) -> bool:
+    return bool(upload_id) and all(c.isalnum() or c in '-_' for c in upload_id)
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    # Readers in other processes never see a partly written file
+    temp = f'{path}.{secrets.token_hex(4)}.tmp'
+    with open(temp, 'wb') as f:
+        f.write(data)
+    os.replace(temp, path)
+
+
+class UploadSpool:
+    """On-disk staging area for chunked uploads.
+
+    Each upload is a directory named by a random ID, holding its owner, the
+    received chunks of every file, the assembled files and their parse results.
+    Nothing is kept in memory, so the requests of one upload may be served by
+    different server processes.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, upload_id: str, *parts: str) -> str:
+        return os.path.join(self.directory, upload_id, *parts)
+
+    def _chunk_path(self, upload_id: str, filename: str, index: int) -> str:
+        return self._path(upload_id, CHUNKS_DIRNAME, filename, f'{index:06d}{CHUNK_SUFFIX}')
+
+    def create(self, owner: str) -> str:
+        """Start an upload for owner and return its ID."""
+        while True:
+            upload_id = secrets.token_urlsafe(16)
+            try:
+                os.mkdir(self._path(upload_id))
+                break
+            except FileExistsError:
+                continue
+        for dirname in (CHUNKS_DIRNAME, FILES_DIRNAME, RESULTS_DIRNAME):
+            os.mkdir(self._path(upload_id, dirname))
+        manifest = {'owner': owner, 'created_at': time.time()}
+        _write_atomic(self._path(upload_id, MANIFEST_FILENAME), json.dumps(manifest).encode('utf-8'))
+        return upload_id
+
+    def owns(self, upload_id: str, owner: str) -> bool:
+        if not _is_valid_id(upload_id):
+            return False
+        try:
+            with open(self._path(upload_id, MANIFEST_FILENAME), 'r', encoding='utf-8') as f:
+                return json.load(f).get('owner') == owner
+        except (OSError, ValueError):
+            return False
+
+    def write_chunk(self, upload_id: str, filename: str, index: int, data: bytes, sha256: str) -> None:
+        """Store chunk index of filename after checking its SHA-256; a re-sent chunk replaces the earlier copy."""
+        if hashlib.sha256(data).hexdigest() != sha256.strip().lower():
+            raise SpoolError(f'checksum mismatch for chunk {index} of {filename}')
+        os.makedirs(self._path(upload_id, CHUNKS_DIRNAME, filename), exist_ok=True)
+        _write_atomic(self._chunk_path(upload_id, filename, index), data)
+
+    def received_chunks(self, upload_id: str, filename: str) -> list[int]:
+        try:
+            names = os.listdir(self._path(upload_id, CHUNKS_DIRNAME, filename))
+        except FileNotFoundError:
+            return []
+        return sorted(int(name[:-len(CHUNK_SUFFIX)]) for name in names if name.endswith(CHUNK_SUFFIX))
+
+    def file_path(self, upload_id: str, filename: str) -> str:
+        return self._path(upload_id, FILES_DIRNAME, filename)
+
+    def assemble(self, upload_id: str, filename: str, total_chunks: int, sha256: str | None = None) -> str | None:
+        """Join chunks 0..total_chunks-1 into filename and return its path.
+
+        Checks the whole file's SHA-256 when given. Only one call assembles a file:
+        returns None when it was already assembled, or another call is assembling it.
+        """
+        if total_chunks < 1:
+            raise SpoolError(f'{filename} needs at least one chunk')
+        target = self.file_path(upload_id, filename)
+        chunk_dir = self._path(upload_id, CHUNKS_DIRNAME, filename)
+        received = self.received_chunks(upload_id, filename)
+        if not received and os.path.exists(target):
+            return None
+        missing = sorted(set(range(total_chunks)) - set(received))
+        if missing:
+            raise SpoolError(f'{filename} is missing chunks {missing[:20]}')
+
+        marker = os.path.join(chunk_dir, ASSEMBLING_MARKER)
+        try:
+            os.close(os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except (FileExistsError, FileNotFoundError):
+            # Taken by a concurrent call, or that call already finished and removed the chunks
+            return None
+
+        temp = f'{target}.{secrets.token_hex(4)}.tmp'
+        try:
+            digest = hashlib.sha256()
+            with open(temp, 'wb') as out:
+                for index in range(total_chunks):
+                    with open(self._chunk_path(upload_id, filename, index), 'rb') as f:
+                        for block in iter(lambda: f.read(COPY_BUFFER_BYTES), b''):
+                            digest.update(block)
+                            out.write(block)
+            if sha256 and digest.hexdigest() != sha256.strip().lower():
+                raise SpoolError(f'checksum mismatch for {filename}')
+        except BaseException:
+            # Leave the chunks for a corrected re-send and a later attempt
+            if os.path.exists(temp):
+                os.remove(temp)
+            os.remove(marker)
+            raise
+        os.replace(temp, target)
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+        return target
+
+    def _result_path(self, upload_id: str, filename: str) -> str:
+        return self._path(upload_id, RESULTS_DIRNAME, f'{filename}{RESULT_SUFFIX}')
+
+    def write_result(
+        self,
+        upload_id: str,
+        filename: str,
+        result: Any = None,
+        error: str | None = None,
+        retryable: bool = False,
+    ) -> None:
+        """Record a file's parse outcome; a retryable failure can be taken back with claim_retry."""
+        record = {'result': result, 'error': error}
+        if retryable:
+            record['retryable'] = True
+        data = json.dumps(record, ensure_ascii=False, default=str).encode('utf-8')
+        _write_atomic(self._result_path(upload_id, filename), data)
+
+    def claim_retry(self, upload_id: str, filename: str) -> bool:
+        """Remove a retryable failure record so the file can be queued again; only one caller gets True."""
+        record = self.read_result(upload_id, filename)
+        if not record or not record.get('retryable'):
+            return False
+        path = self._result_path(upload_id, filename)
+        claimed = f'{path}.{secrets.token_hex(4)}.claim'
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            return False
+        with open(claimed, 'r', encoding='utf-8') as f:
+            record = json.load(f)
+        if not record.get('retryable'):
+            # Replaced by a real outcome in the meantime
+            os.rename(claimed, path)
+            return False
+        os.remove(claimed)
+        return True
+
+    def read_result(self, upload_id: str, filename: str) -> dict[str, Any] | None:
+        try:
+            with open(self._result_path(upload_id, filename), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def status(self, upload_id: str) -> dict[str, dict[str, Any]]:
+        """Per-file state ('receiving', 'processing', 'parsed' or 'failed') with the received chunk indexes."""
+        files: dict[str, dict[str, Any]] = {}
+        for filename in os.listdir(self._path(upload_id, CHUNKS_DIRNAME)):
+            files[filename] = {'state': 'receiving', 'chunks': self.received_chunks(upload_id, filename)}
+        for filename in os.listdir(self._path(upload_id, FILES_DIRNAME)):
+            if filename.endswith('.tmp'):
+                continue
+            record = self.read_result(upload_id, filename)
+            if record is None:
+                files[filename] = {'state': 'processing'}
+            elif record['error']:
+                files[filename] = {'state': 'failed', 'error': record['error'], 'retryable': record.get('retryable', False)}
+            else:
+                files[filename] = {'state': 'parsed'}
+        return files
+
+    def remove(self, upload_id: str) -> None:
+        shutil.rmtree(self._path(upload_id), ignore_errors=True)
+
+    def collect_garbage(self, ttl: float) -> int:
+        """Remove uploads started more than ttl seconds ago and return how many."""
+        cutoff = time.time() - ttl
+        removed = 0
+        for upload_id in os.listdir(self.directory):
+            try:
+                if os.path.getmtime(self._path(upload_id, MANIFEST_FILENAME)) >= cutoff:
+                    continue
+            except FileNotFoundError:
+                # Still being created, or a stray entry
+                continue
+            self.remove(upload_id)
+            removed += 1
+        return removed